@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Nightly Nudge Summary Refresh for StyleMail POC
+
+Collects every employee whose active nudges have no matching NudgeSummary,
+submits the summary prompts as one OpenAI Batch API job, waits for it and
+bulk-writes the results. Re-running with the same --job-dir resumes an
+interrupted job instead of starting a new one.
+
+    python nightly_summaries.py --job-dir jobs/2024-06-01
+    python nightly_summaries.py --job-dir jobs/dev --local   # plain chat calls, no Batch API
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, List
+from dotenv import load_dotenv
+from openai import OpenAI
+from sqlalchemy import select
+
+from database import SessionLocal, Nudge, NudgeSummary, init_db
+from nudges import NUDGE_COLUMNS, SUMMARY_PROMPT, format_nudge_for_prompt, is_active, nudge_fingerprint
+from stylemail.batch import BatchJob, LocalBatchBackend, OpenAIBatchBackend, run_job
+from stylemail.clients import ClientRegistry
+from stylemail.config import Config
+from stylemail.generator import NudgeSummaryGenerator, chat_kwargs
+from stylemail.upstream import CHAT_UPSTREAM
+
+# Employees whose existing summaries are looked up per query.
+EXISTING_LOOKUP_SIZE = 1000
+
+
+def collect_pending(db, generator: NudgeSummaryGenerator, prompt: str):
+    """Yield (employee_id, chat body, {"nudge_snippet", "nudge_fingerprint"}) for every stale summary."""
+    nudges_by_employee: Dict[str, List[Dict[str, str]]] = {}
+    rows = db.execute(
+        select(*NUDGE_COLUMNS).where(is_active()).order_by(Nudge.employee_id, Nudge.id)
+    )
+    for row in rows:
+        nudges_by_employee.setdefault(row.employee_id, []).append(format_nudge_for_prompt(row))
+
+    employee_ids = list(nudges_by_employee)
+    for start in range(0, len(employee_ids), EXISTING_LOOKUP_SIZE):
+        chunk = employee_ids[start:start + EXISTING_LOOKUP_SIZE]
+        existing = set(db.execute(
+            select(NudgeSummary.employee_id, NudgeSummary.nudge_fingerprint).where(NudgeSummary.employee_id.in_(chunk))
+        ).all())
+        for employee_id in chunk:
+            nudges = nudges_by_employee[employee_id]
+            fingerprint = nudge_fingerprint(nudges, prompt)
+            if (employee_id, fingerprint) in existing:
+                continue
+            meta = {"nudge_snippet": ", ".join([nudge["title"] for nudge in nudges]), "nudge_fingerprint": fingerprint}
+            yield employee_id, chat_kwargs(generator.build_prompt(prompt, nudges)), meta
+
+
+def write_summaries(db, chunk) -> None:
+    """Insert one NudgeSummary per result, skipping rows a crashed run already committed."""
+    employee_ids = [employee_id for employee_id, _, _ in chunk]
+    existing = set(db.execute(
+        select(NudgeSummary.employee_id, NudgeSummary.nudge_fingerprint).where(NudgeSummary.employee_id.in_(employee_ids))
+    ).all())
+    db.add_all([
+        NudgeSummary(
+            employee_id=employee_id,
+            summary=result["content"],
+            nudge_snippet=meta["nudge_snippet"],
+            nudge_fingerprint=meta["nudge_fingerprint"],
+        )
+        for employee_id, result, meta in chunk
+        if (employee_id, meta["nudge_fingerprint"]) not in existing
+    ])
+    db.commit()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Refresh stale nudge summaries through the OpenAI Batch API.")
+    parser.add_argument("--job-dir", required=True, help="Directory holding the job state; reuse it to resume")
+    parser.add_argument("--prompt", default=SUMMARY_PROMPT, help="Must match the prompt /nudge-summary is called with")
+    parser.add_argument("--local", action="store_true", help="Run requests as direct chat calls instead of a Batch API job")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    args = parser.parse_args()
+
+    config = Config(
+        openai_api_key=os.getenv("OPENAI_API_KEY", ""),
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_port=int(os.getenv("REDIS_PORT", 6379)),
+        redis_db=int(os.getenv("REDIS_DB", 0)),
+        redis_password=os.getenv("REDIS_PASSWORD", ""),
+        http_max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        http_max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+    )
+    clients = ClientRegistry(config)
+    if args.local:
+        # Paced, retried and capped like the server's chat calls.
+        backend = LocalBatchBackend(
+            lambda body: CHAT_UPSTREAM.call(clients.openai.chat.completions, **body).choices[0].message.content
+        )
+    else:
+        backend = OpenAIBatchBackend(OpenAI(api_key=config.openai_api_key))
+    generator = NudgeSummaryGenerator(config.openai_api_key, None, client=clients.openai)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        job = BatchJob(args.job_dir)
+        if job.stage is not None:
+            print(f"🔁 Resuming job in {args.job_dir} at stage '{job.stage}'")
+        summary = run_job(
+            job,
+            backend,
+            collect=lambda: collect_pending(db, generator, args.prompt),
+            write=lambda chunk: write_summaries(db, chunk),
+            poll_interval=args.poll_interval,
+        )
+    finally:
+        db.close()
+        clients.close()
+
+    print(f"✅ Batch {summary['batch_id']}: {summary['written']}/{summary['requests']} summaries written")
+    for employee_id, error in summary["errors"].items():
+        print(f"❌ {employee_id}: {error}")
+    sys.exit(1 if summary["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Shared formatting of Nudge rows for the nudge email/summary prompts and
+/fetch-nudge-data.
+
+Each employee's active nudges are rendered once into a nudge_views row
+(NudgeBlock) whenever a flush writes them, so the nudge endpoints read one
+prepared row instead of formatting every Nudge on each request.
+"""
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import Select, delete, insert, literal, select
+from database import Nudge, NudgeView
+from stylemail.config import CHAT_MODEL
+
+# The prompt the dashboard (static/demo.html) sends to /nudge-summary. The
+# nightly job summarizes with it too: the prompt is part of the fingerprint,
+# so summaries written with any other prompt are never reused.
+SUMMARY_PROMPT = "Create a professional performance summary"
+
+# Columns read by RenderedNudge; queries select only these instead of
+# loading full ORM entities.
+NUDGE_COLUMNS = (
+    Nudge.id,
+    Nudge.employee_id,
+    Nudge.nudge_type,
+    Nudge.title,
+    Nudge.instructions,
+    Nudge.threshold,
+    Nudge.date_range_from,
+    Nudge.date_range_to,
+    Nudge.prior_date_range_from,
+    Nudge.prior_date_range_to,
+    Nudge.metric_name,
+    Nudge.metric_value,
+    Nudge.unit,
+    Nudge.operator,
+)
+
+
+def is_active():
+    # Rendered as a literal so the planner can match the partial index
+    # ix_nudges_employee_active even for server-side prepared statements.
+    return Nudge.status == literal("active", literal_execute=True)
+
+
+def active_nudges_query(employee_ids: List[str], *columns) -> Select:
+    """Select the given columns of the employees' active nudges, in a stable order."""
+    return (
+        select(*columns)
+        .where(Nudge.employee_id.in_(employee_ids), is_active())
+        .order_by(Nudge.employee_id, Nudge.id)
+    )
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class RenderedNudge:
+    """A Nudge, or a row of NUDGE_COLUMNS, with its dates formatted once."""
+
+    __slots__ = (
+        "id", "nudge_type", "title", "instructions", "threshold", "metric_name",
+        "metric_value", "unit", "operator", "date_range", "prior_date_range",
+    )
+
+    def __init__(self, nudge):
+        self.id = nudge.id
+        self.nudge_type = nudge.nudge_type
+        self.title = nudge.title
+        self.instructions = nudge.instructions
+        self.threshold = nudge.threshold
+        self.metric_name = nudge.metric_name
+        self.metric_value = nudge.metric_value
+        self.unit = nudge.unit
+        self.operator = nudge.operator
+        self.date_range = (_iso(nudge.date_range_from), _iso(nudge.date_range_to))
+        self.prior_date_range = (_iso(nudge.prior_date_range_from), _iso(nudge.prior_date_range_to))
+
+    def for_prompt(self) -> Dict[str, str]:
+        """The nudge as the nudge email/summary prompts take it."""
+        return {
+            "title": self.title,
+            "instructions": self.instructions or "No Instructions",
+            "metrics": (
+                f"Threshold: {self.threshold or 'N/A'}, "
+                f"Date Range: {self.date_range[0] or 'N/A'} to {self.date_range[1] or 'N/A'}, "
+                f"Prior Date Range: {self.prior_date_range[0] or 'N/A'} to {self.prior_date_range[1] or 'N/A'}, "
+                f"Metric: {self.metric_name or 'N/A'}, "
+                f"Value: {self.metric_value or 'N/A'}, "
+                f"Unit: {self.unit or 'N/A'}, "
+                f"Operator: {self.operator or 'N/A'}"
+            )
+        }
+
+    def for_api(self) -> Dict[str, Any]:
+        """The nudge as /fetch-nudge-data returns it."""
+        return {
+            "id": self.id,
+            "config": {
+                "message": self.title,
+                "metaData": self.instructions,
+                "threshold": self.threshold,
+                "dateRange": {"from": self.date_range[0], "to": self.date_range[1]},
+                "priorDateRange": {"from": self.prior_date_range[0], "to": self.prior_date_range[1]},
+                "metric": self.metric_name,
+                "unit": self.unit,
+                "operator": self.operator
+            },
+            "nudge_type": self.nudge_type,
+            "metric_value": self.metric_value
+        }
+
+
+def format_nudge_for_prompt(nudge) -> Dict[str, str]:
+    """Format a Nudge, or a row of NUDGE_COLUMNS, for the nudge prompts."""
+    return RenderedNudge(nudge).for_prompt()
+
+
+class NudgeBlock:
+    """One employee's active nudges, rendered for the prompts and the API."""
+
+    __slots__ = ("employee_id", "prompt", "api", "snippet")
+
+    def __init__(self, employee_id: str, prompt: List[Dict[str, str]], api: List[Dict[str, Any]], snippet: str):
+        self.employee_id = employee_id
+        self.prompt = prompt
+        self.api = api
+        self.snippet = snippet
+
+    @classmethod
+    def from_view(cls, row) -> "NudgeBlock":
+        """Load a row of nudge_views_query."""
+        return cls(row.employee_id, json.loads(row.prompt_nudges), json.loads(row.api_nudges), row.nudge_snippet or "")
+
+    def view_row(self) -> Dict[str, Any]:
+        return {
+            "employee_id": self.employee_id,
+            "prompt_nudges": json.dumps(self.prompt, separators=(",", ":")),
+            "api_nudges": json.dumps(self.api, separators=(",", ":")),
+            "nudge_snippet": self.snippet,
+            "nudge_count": len(self.prompt),
+            "refreshed_at": datetime.utcnow(),
+        }
+
+
+def render_blocks(employee_ids: List[str], rows) -> Dict[str, NudgeBlock]:
+    """Group rows of NUDGE_COLUMNS into one block per employee; employees without rows get an empty block."""
+    rendered: Dict[str, List] = {employee_id: [] for employee_id in employee_ids}
+    for row in rows:
+        rendered.setdefault(row.employee_id, []).append(RenderedNudge(row))
+    return {
+        employee_id: NudgeBlock(
+            employee_id,
+            [nudge.for_prompt() for nudge in nudges],
+            [nudge.for_api() for nudge in nudges],
+            ", ".join([nudge.title for nudge in nudges]),
+        )
+        for employee_id, nudges in rendered.items()
+    }
+
+
+def nudge_views_query(employee_ids: List[str]) -> Select:
+    return select(
+        NudgeView.employee_id,
+        NudgeView.prompt_nudges,
+        NudgeView.api_nudges,
+        NudgeView.nudge_snippet,
+    ).where(NudgeView.employee_id.in_(employee_ids))
+
+
+def refresh_nudge_views(connection, employee_ids: List[str]) -> Dict[str, NudgeBlock]:
+    """Re-render the employees' nudge views on a sync Connection, inside the caller's transaction."""
+    blocks = render_blocks(employee_ids, connection.execute(active_nudges_query(employee_ids, *NUDGE_COLUMNS)).all())
+    connection.execute(delete(NudgeView).where(NudgeView.employee_id.in_(employee_ids)))
+    connection.execute(insert(NudgeView), [block.view_row() for block in blocks.values()])
+    return blocks
+
+
+def _normalize(value: str) -> str:
+    return " ".join(str(value).split())
+
+
+def nudge_fingerprint(nudges: List[Dict[str, str]], prompt: str, user_id: Optional[str] = None, model: str = CHAT_MODEL) -> str:
+    """
+    sha256 hex digest identifying the generated output for these formatted
+    nudges, prompt, style owner and model. Nudge order and whitespace do not
+    matter, so an unchanged set of nudges always maps to the same
+    64-character fingerprint. Emails are written in user_id's style and pass
+    it; summaries aren't styled and leave it None.
+    """
+    payloads = sorted(
+        json.dumps({k: _normalize(v) for k, v in nudge.items()}, sort_keys=True, separators=(",", ":"))
+        for nudge in nudges
+    )
+    document = json.dumps({"model": model, "user_id": user_id, "prompt": _normalize(prompt), "nudges": payloads}, separators=(",", ":"))
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
@@ -11,34 +11,38 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from database import SessionLocal, Employee, Nudge, AttendanceRecord, init_db
 
+# Demo employees, also read by the load test (stylemail.loadtest)
+DEMO_EMPLOYEES = [
+    {
+        "id": "emp_001",
+        "name": "Sarah Johnson",
+        "email": "sarah.johnson@company.com",
+        "department": "Engineering",
+        "position": "Senior Software Engineer",
+        "manager_id": None,
+    },
+    {
+        "id": "emp_002",
+        "name": "Michael Chen",
+        "email": "michael.chen@company.com",
+        "department": "Marketing",
+        "position": "Marketing Specialist",
+        "manager_id": None,
+    },
+    {
+        "id": "emp_003",
+        "name": "Emily Rodriguez",
+        "email": "emily.rodriguez@company.com",
+        "department": "Sales",
+        "position": "Sales Representative",
+        "manager_id": None,
+    },
+]
+
+
 def seed_employees(db: Session):
     """Seed sample employees"""
-    employees = [
-        Employee(
-            id="emp_001",
-            name="Sarah Johnson",
-            email="sarah.johnson@company.com",
-            department="Engineering",
-            position="Senior Software Engineer",
-            manager_id=None
-        ),
-        Employee(
-            id="emp_002",
-            name="Michael Chen",
-            email="michael.chen@company.com",
-            department="Marketing",
-            position="Marketing Specialist",
-            manager_id=None
-        ),
-        Employee(
-            id="emp_003",
-            name="Emily Rodriguez",
-            email="emily.rodriguez@company.com",
-            department="Sales",
-            position="Sales Representative",
-            manager_id=None
-        ),
-    ]
+    employees = [Employee(**data) for data in DEMO_EMPLOYEES]
     
     for employee in employees:
         existing = db.query(Employee).filter(Employee.id == employee.id).first()
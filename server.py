@@ -1,20 +1,32 @@
+import json
+import math
 import sqlite3
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends
+import time
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, List, Dict, Optional
 from dotenv import load_dotenv
 import uvicorn
 from os import getenv
-from sqlalchemy.orm import Session
-
-from stylemail import seed_user_style, generate_email, generate_nudge_summary, generate_nudge_email
-from stylemail.vectorstore import UserVectorStore
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from stylemail.async_api import seed_user_style, generate_email, generate_nudge_summary, generate_nudge_email, stream_email, stream_nudge_email, generate_nudge_emails_batch
+from stylemail.async_vectorstore import AsyncUserVectorStore
+from stylemail.cache import UserMatrixCache, AsyncEmbeddingCache, AsyncResponseCache
+from stylemail.concurrency import AsyncRequestCoalescer
 from stylemail.config import Config
+from stylemail.clients import ClientRegistry
+from stylemail.metrics import REGISTRY, REQUEST_SECONDS, span
+from stylemail.upstream import UpstreamUnavailableError
 from services import get_auth_token, get_nudge_data
-from database import init_db, get_db, Employee, Nudge, NudgeSummary, NudgeEmail
+from database import init_db, get_async_db, AsyncSessionLocal, Employee, Nudge, NudgeSummary, NudgeEmail, NudgeView
+from nudges import NUDGE_COLUMNS, NudgeBlock, active_nudges_query, nudge_fingerprint, nudge_views_query, render_blocks
 
 # Load environment variables
 load_dotenv()
@@ -42,7 +54,11 @@ def create_employee_nudge_summary_table():
 
 
 config: Config = None
-store: UserVectorStore = None
+store: AsyncUserVectorStore = None
+embedding_cache: AsyncEmbeddingCache = None
+response_cache: AsyncResponseCache = None
+clients: ClientRegistry = None
+coalescer: AsyncRequestCoalescer = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -62,15 +78,37 @@ async def lifespan(app: FastAPI):
         redis_port=redis_port,
         redis_db=redis_db,
         redis_password=redis_password,
+        http_max_connections=int(getenv("HTTP_MAX_CONNECTIONS", "100")),
+        http_max_keepalive_connections=int(getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        http_keepalive_expiry=float(getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+        redis_max_connections=int(getenv("REDIS_MAX_CONNECTIONS", "50")),
     )
     print("[server] Loaded config:", config)
+    global clients
+    clients = ClientRegistry(config)
     global store
-    store = UserVectorStore(
-        host=config.redis_host,
-        port=config.redis_port,
-        db=config.redis_db,
-        password=config.redis_password,
+    store = AsyncUserVectorStore(
+        redis_client=clients.async_redis(),
+        matrix_cache=UserMatrixCache(max_bytes=int(getenv("MATRIX_CACHE_MB", "64")) * 1024 * 1024),
+        ann_threshold=int(getenv("ANN_THRESHOLD", "5000")) or None,
+        ann_n_probe=int(getenv("ANN_N_PROBE")) if getenv("ANN_N_PROBE") else None,
     )
+    store.start_invalidation_listener()
+    global embedding_cache
+    embedding_cache = AsyncEmbeddingCache(store.redis, namespace=store.namespace)
+    # Semantic response cache for /generate, enabled by setting a similarity threshold
+    global response_cache
+    if getenv("RESPONSE_CACHE_THRESHOLD"):
+        response_cache = AsyncResponseCache(
+            store.redis,
+            namespace=store.namespace,
+            threshold=float(getenv("RESPONSE_CACHE_THRESHOLD")),
+            ttl_seconds=int(getenv("RESPONSE_CACHE_TTL", "86400")),
+            max_entries_per_user=int(getenv("RESPONSE_CACHE_MAX_PER_USER", "50")),
+        )
+    # One LLM call per identical nudge summary/email request, across workers
+    global coalescer
+    coalescer = AsyncRequestCoalescer(store.redis, namespace=store.namespace)
     # Initialize PostgreSQL database
     init_db()
     
@@ -78,13 +116,16 @@ async def lifespan(app: FastAPI):
     create_employee_nudge_summary_table()
 
     try:
-        pong = store.redis.ping()
+        pong = await store.redis.ping()
         print(f"[server] Redis connection successful: {pong}")
     except Exception as e:
         print(f"[server] Redis connection failed: {e}")
 
     yield
 
+    await store.stop_invalidation_listener()
+    await clients.aclose()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -92,34 +133,112 @@ app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/nudge-email/{id}), not the raw path, to keep cardinality bounded.
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+
+
+def _cache_counts():
+    counts = {}
+    if embedding_cache:
+        stats = embedding_cache.stats()
+        counts[("embedding", "hit")] = stats["hits_local"] + stats["hits_redis"]
+        counts[("embedding", "miss")] = stats["misses"]
+    if response_cache:
+        stats = response_cache.stats()
+        counts[("response", "hit")] = stats["hits"]
+        counts[("response", "miss")] = stats["misses"]
+    return counts
+
+
+REGISTRY.register_callback("stylemail_cache_requests_total", "Embedding and response cache lookups by outcome.", "counter", ["cache", "result"], _cache_counts)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Stage latencies, request latencies, token usage and cache hit counters in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint to verify the API is running."""
     return {
         "status": "healthy",
-        "redis": "connected" if store and store.redis.ping() else "disconnected",
+        "redis": "connected" if store and await store.redis.ping() else "disconnected",
         "message": "StyleMail API is running"
     }
 
 
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters for the embedding cache and, when enabled, the response cache."""
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "response_cache": response_cache.stats() if response_cache else None,
+    }
+
+
+def _http_error(e: Exception) -> HTTPException:
+    """
+    503 with Retry-After when OpenAI is down or throttling us (the generators
+    wrap the UpstreamUnavailableError, so the exception chain is searched),
+    400 for everything else.
+    """
+    cause = e
+    while cause is not None and not isinstance(cause, UpstreamUnavailableError):
+        cause = cause.__cause__ or cause.__context__
+    if cause is not None:
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, math.ceil(cause.retry_after)))})
+    return HTTPException(status_code=400, detail=str(e))
+
+
 class SeedRequest(BaseModel):
     user_id: str
     samples: list[str]
 
 
 class GenerateRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
     user_id: str
     subject: str
     prompt: str
+    # Optional retrieval overrides: style samples to retrieve, the MMR
+    # relevance/diversity trade-off (sent as "lambda"), and the token budget
+    # of the style examples in the prompt.
+    top_k: Optional[int] = Field(default=None, ge=1, le=20)
+    mmr_lambda: Optional[float] = Field(default=None, ge=0.0, le=1.0, alias="lambda")
+    style_tokens: Optional[int] = Field(default=None, ge=1)
+
+    def retrieval(self) -> Dict[str, Any]:
+        return {"top_k": self.top_k, "mmr_lambda": self.mmr_lambda, "style_tokens": self.style_tokens}
 
 
 @app.post("/seed")
-def seed(req: SeedRequest):
+async def seed(req: SeedRequest):
     try:
-        seed_user_style(req.user_id, req.samples, store=store, openai_api_key=config.openai_api_key)
+        await seed_user_style(req.user_id, req.samples, store=store, openai_api_key=config.openai_api_key, embedding_cache=embedding_cache, clients=clients)
+        if response_cache:
+            # Emails generated from the old samples no longer match the user's style
+            await response_cache.invalidate(req.user_id)
         return {"status": "ok"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e)
 
 
 class NudgeSummaryRequest(BaseModel):
@@ -129,12 +248,62 @@ class NudgeSummaryRequest(BaseModel):
 
 
 @app.post("/generate")
-def generate(req: GenerateRequest):
+async def generate(req: GenerateRequest, response: Response):
     try:
-        result = generate_email(req.user_id, req.subject, req.prompt, store=store, openai_api_key=config.openai_api_key)
+        result = await generate_email(req.user_id, req.subject, req.prompt, store=store, openai_api_key=config.openai_api_key, embedding_cache=embedding_cache, clients=clients, response_cache=response_cache, **req.retrieval())
+        response.headers["X-StyleMail-Cache"] = result.pop("cache", "off")
         return result
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e)
+
+
+def _sse(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _start_stream(events):
+    """
+    Pull the first event before the response starts, so validation, retrieval
+    and connection errors still surface as an HTTP error instead of mid-stream.
+    """
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise _http_error(e)
+    return first
+
+
+@app.post("/generate/stream")
+async def generate_stream(req: GenerateRequest):
+    """Stream a style-aware email as SSE 'subject'/'body' events followed by 'done'."""
+    try:
+        events = stream_email(req.user_id, req.subject, req.prompt, store=store, openai_api_key=config.openai_api_key, embedding_cache=embedding_cache, clients=clients, **req.retrieval())
+    except Exception as e:
+        raise _http_error(e)
+    first = await _start_stream(events)
+
+    async def relay():
+        result = {"subject": "", "body": ""}
+        try:
+            pending = [first] if first else []
+            async for kind, text in _chain(pending, events):
+                result[kind] = result[kind] + text if kind == "body" else text
+                yield _sse(kind, text)
+            yield _sse("done", result)
+        except Exception as e:
+            yield _sse("error", str(e))
+
+    return StreamingResponse(relay(), media_type="text/event-stream")
+
+
+async def _chain(first_events, events):
+    for event in first_events:
+        yield event
+    async for event in events:
+        yield event
 
 
 class FetchNudgeDataRequest(BaseModel):
@@ -143,154 +312,250 @@ class FetchNudgeDataRequest(BaseModel):
     email: str
     password: str
     employee_id: str
+    # /nudge-email only: return the latest unsent email this user generated
+    # from the same nudges and prompt instead of writing a new one.
+    reuse_unsent: bool = False
+
+async def _single_flight(key: str, compute, cross_worker: bool = True):
+    """
+    Run compute() once for concurrent identical requests. Followers in this
+    worker share the leader's result; with cross_worker, followers in other
+    workers wait for its Redis lock, then find the row it saved. Pass
+    cross_worker=False when compute() does not reuse saved rows. The flight
+    outlives the leader's request if that is cancelled, so compute() opens
+    its own database session.
+    """
+    if coalescer is None:
+        return await compute()
+    return await coalescer.run(key, compute, cross_worker=cross_worker)
+
+
+async def _nudge_blocks(db: AsyncSession, employee_ids: List[str]) -> Dict[str, NudgeBlock]:
+    """
+    Load the employees' rendered active nudges from nudge_views in one query.
+    Employees without a view yet (nudges written before the table existed)
+    are rendered from their nudges, and the views saved for next time, empty
+    ones included so employees without nudges are not re-rendered each call.
+    """
+    rows = (await db.execute(nudge_views_query(employee_ids))).all()
+    blocks = {row.employee_id: NudgeBlock.from_view(row) for row in rows}
+    missing = [employee_id for employee_id in employee_ids if employee_id not in blocks]
+    if missing:
+        rendered = render_blocks(missing, (await db.execute(active_nudges_query(missing, *NUDGE_COLUMNS))).all())
+        blocks.update(rendered)
+        await _save_nudge_views(list(rendered.values()))
+    return blocks
+
+
+async def _save_nudge_views(blocks: List[NudgeBlock]) -> None:
+    if not blocks:
+        return
+    try:
+        # Own session, so the views are kept even when the request doesn't commit.
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(NudgeView), [block.view_row() for block in blocks])
+            with span("db_commit"):
+                await session.commit()
+    except IntegrityError:
+        pass  # Saved first by a concurrent request or a nudge write
+
+
+async def _nudge_block(db: AsyncSession, employee_id: str) -> NudgeBlock:
+    return (await _nudge_blocks(db, [employee_id]))[employee_id]
 
 @app.post("/fetch-nudge-data")
-def fetch_nudge_data_endpoint(req: FetchNudgeDataRequest, db: Session = Depends(get_db)):
+async def fetch_nudge_data_endpoint(req: FetchNudgeDataRequest, db: AsyncSession = Depends(get_async_db)):
     """Fetch nudge data from PostgreSQL database"""
     try:
-        # Query nudges for the employee
-        nudges = db.query(Nudge).filter(
-            Nudge.employee_id == req.employee_id,
-            Nudge.status == "active"
-        ).all()
-        
-        # Format nudges similar to API response
-        nudge_data = {
-            "data": [
-                {
-                    "id": nudge.id,
-                    "config": {
-                        "message": nudge.title,
-                        "metaData": nudge.instructions,
-                        "threshold": nudge.threshold,
-                        "dateRange": {
-                            "from": nudge.date_range_from.isoformat() if nudge.date_range_from else None,
-                            "to": nudge.date_range_to.isoformat() if nudge.date_range_to else None
-                        },
-                        "priorDateRange": {
-                            "from": nudge.prior_date_range_from.isoformat() if nudge.prior_date_range_from else None,
-                            "to": nudge.prior_date_range_to.isoformat() if nudge.prior_date_range_to else None
-                        },
-                        "metric": nudge.metric_name,
-                        "unit": nudge.unit,
-                        "operator": nudge.operator
-                    },
-                    "nudge_type": nudge.nudge_type,
-                    "metric_value": nudge.metric_value
-                }
-                for nudge in nudges
-            ]
-        }
-        
-        return nudge_data
+        # Nudges are stored already formatted like the API response
+        block = await _nudge_block(db, req.employee_id)
+        return {"data": block.api}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e)
 
 @app.post("/nudge-email")
-def nudge_email_endpoint(req: FetchNudgeDataRequest, db: Session = Depends(get_db)):
+async def nudge_email_endpoint(req: FetchNudgeDataRequest, db: AsyncSession = Depends(get_async_db)):
     """Generate nudge email from PostgreSQL data"""
     try:
-        # Query nudges for the employee
-        nudges_data = db.query(Nudge).filter(
-            Nudge.employee_id == req.employee_id,
-            Nudge.status == "active"
-        ).all()
-        
-        # Prepare nudge data for email generation
-        nudges = [
-            {
-                "title": nudge.title,
-                "instructions": nudge.instructions or "No Instructions",
-                "metrics": (
-                    f"Threshold: {nudge.threshold or 'N/A'}, "
-                    f"Date Range: {nudge.date_range_from.isoformat() if nudge.date_range_from else 'N/A'} to {nudge.date_range_to.isoformat() if nudge.date_range_to else 'N/A'}, "
-                    f"Prior Date Range: {nudge.prior_date_range_from.isoformat() if nudge.prior_date_range_from else 'N/A'} to {nudge.prior_date_range_to.isoformat() if nudge.prior_date_range_to else 'N/A'}, "
-                    f"Metric: {nudge.metric_name or 'N/A'}, "
-                    f"Value: {nudge.metric_value or 'N/A'}, "
-                    f"Unit: {nudge.unit or 'N/A'}, "
-                    f"Operator: {nudge.operator or 'N/A'}"
+        block = await _nudge_block(db, req.employee_id)
+        nudges = block.prompt
+        fingerprint = nudge_fingerprint(nudges, req.prompt, user_id=req.user_id)
+
+        async def generate_once():
+            # Shared with other requests' followers, so it must not use this request's session.
+            async with AsyncSessionLocal() as session:
+                if req.reuse_unsent:
+                    # Reuse an unsent email this user generated from the same nudges and prompt
+                    existing_email = (await session.execute(
+                        select(NudgeEmail.subject, NudgeEmail.body).where(
+                            NudgeEmail.employee_id == req.employee_id,
+                            NudgeEmail.nudge_fingerprint == fingerprint,
+                            NudgeEmail.sent.is_not(True)
+                        ).order_by(NudgeEmail.id.desc()).limit(1)
+                    )).first()
+
+                    if existing_email:
+                        print(f"[nudge_email] Found existing email for employee {req.employee_id}")
+                        return {"subject": existing_email.subject, "body": existing_email.body}
+
+                # Generate nudge email
+                result = await generate_nudge_email(req.user_id, req.prompt, nudges, store=store, openai_api_key=config.openai_api_key, clients=clients)
+
+                # Save generated email to database
+                email_record = NudgeEmail(
+                    employee_id=req.employee_id,
+                    subject=result.get("subject", "Nudge Email"),
+                    body=result.get("body", ""),
+                    nudge_snippet=block.snippet,
+                    nudge_fingerprint=fingerprint
                 )
-            }
-            for nudge in nudges_data
-        ]
+                session.add(email_record)
+                with span("db_commit"):
+                    await session.commit()
+                return result
+
+        # Without reuse_unsent another worker could not use the saved email,
+        # so only this worker's identical requests are coalesced.
+        return await _single_flight(
+            f"nudge-email:{req.user_id}:{req.employee_id}:{fingerprint}", generate_once, cross_worker=req.reuse_unsent
+        )
+    except Exception as e:
+        await db.rollback()
+        raise _http_error(e)
 
-        # Generate nudge email
-        result = generate_nudge_email(req.user_id, req.prompt, nudges, store=store, openai_api_key=config.openai_api_key)
-        
-        # Save generated email to database
-        nudge_snippet = ", ".join([nudge["title"] for nudge in nudges])
-        email_record = NudgeEmail(
-            employee_id=req.employee_id,
-            subject=result.get("subject", "Nudge Email"),
-            body=result.get("body", ""),
-            nudge_snippet=nudge_snippet
+class NudgeEmailBatchRequest(BaseModel):
+    user_id: str
+    prompt: str
+    # Bounded so one request cannot queue unbounded work or take every
+    # LLM slot in the process.
+    employee_ids: List[str] = Field(min_length=1, max_length=500)
+    max_concurrency: int = Field(default=8, ge=1, le=32)
+
+
+@app.post("/nudge-email/batch")
+async def nudge_email_batch_endpoint(req: NudgeEmailBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """Generate nudge emails for many employees; failures are reported per employee"""
+    try:
+        employee_ids = list(dict.fromkeys(req.employee_ids))
+        if not employee_ids:
+            raise ValueError("employee_ids must be a non-empty list")
+        blocks = await _nudge_blocks(db, employee_ids)
+        nudges_by_employee = {employee_id: blocks[employee_id].prompt for employee_id in employee_ids}
+
+        results = await generate_nudge_emails_batch(
+            req.user_id, req.prompt, nudges_by_employee,
+            store=store, openai_api_key=config.openai_api_key, clients=clients,
+            max_concurrency=req.max_concurrency,
         )
-        db.add(email_record)
-        db.commit()
-        
-        return result
+
+        # Save every generated email in one commit
+        db.add_all([
+            NudgeEmail(
+                employee_id=employee_id,
+                subject=result.get("subject", "Nudge Email"),
+                body=result.get("body", ""),
+                nudge_snippet=blocks[employee_id].snippet,
+                nudge_fingerprint=nudge_fingerprint(nudges_by_employee[employee_id], req.prompt, user_id=req.user_id)
+            )
+            for employee_id, result in results.items()
+            if "error" not in result
+        ])
+        with span("db_commit"):
+            await db.commit()
+
+        return {
+            "results": [
+                {"employee_id": employee_id, **results[employee_id]}
+                for employee_id in employee_ids
+            ]
+        }
+    except Exception as e:
+        await db.rollback()
+        raise _http_error(e)
+
+
+@app.post("/nudge-email/stream")
+async def nudge_email_stream_endpoint(req: FetchNudgeDataRequest, db: AsyncSession = Depends(get_async_db)):
+    """Stream a nudge email as SSE events and save it once the stream completes"""
+    try:
+        block = await _nudge_block(db, req.employee_id)
+        nudges = block.prompt
+        events = stream_nudge_email(req.user_id, req.prompt, nudges, store=store, openai_api_key=config.openai_api_key, clients=clients)
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+        raise _http_error(e)
+    first = await _start_stream(events)
+    nudge_snippet = block.snippet
+    fingerprint = nudge_fingerprint(nudges, req.prompt, user_id=req.user_id)
+
+    async def relay():
+        result = {"subject": "", "body": ""}
+        try:
+            pending = [first] if first else []
+            async for kind, text in _chain(pending, events):
+                result[kind] = result[kind] + text if kind == "body" else text
+                yield _sse(kind, text)
+            # The request-scoped session may already be closed once streaming starts.
+            async with AsyncSessionLocal() as session:
+                session.add(NudgeEmail(
+                    employee_id=req.employee_id,
+                    subject=result["subject"] or "Nudge Email",
+                    body=result["body"],
+                    nudge_snippet=nudge_snippet,
+                    nudge_fingerprint=fingerprint
+                ))
+                with span("db_commit"):
+                    await session.commit()
+            yield _sse("done", result)
+        except Exception as e:
+            yield _sse("error", str(e))
+
+    return StreamingResponse(relay(), media_type="text/event-stream")
 
 @app.post("/nudge-summary")
-def nudge_summary_endpoint(req: FetchNudgeDataRequest, db: Session = Depends(get_db)):
+async def nudge_summary_endpoint(req: FetchNudgeDataRequest, db: AsyncSession = Depends(get_async_db)):
     """Generate nudge summary from PostgreSQL data"""
     try:
-        # Query nudges for the employee
-        nudges_data = db.query(Nudge).filter(
-            Nudge.employee_id == req.employee_id,
-            Nudge.status == "active"
-        ).all()
-        
-        print(f"[nudge_summary] Fetched {len(nudges_data)} nudges from database")
-        
-        # Prepare nudge data for summary generation
-        nudges = [
-            {
-                "title": nudge.title,
-                "instructions": nudge.instructions or "No Instructions",
-                "metrics": (
-                    f"Threshold: {nudge.threshold or 'N/A'}, "
-                    f"Date Range: {nudge.date_range_from.isoformat() if nudge.date_range_from else 'N/A'} to {nudge.date_range_to.isoformat() if nudge.date_range_to else 'N/A'}, "
-                    f"Prior Date Range: {nudge.prior_date_range_from.isoformat() if nudge.prior_date_range_from else 'N/A'} to {nudge.prior_date_range_to.isoformat() if nudge.prior_date_range_to else 'N/A'}, "
-                    f"Metric: {nudge.metric_name or 'N/A'}, "
-                    f"Value: {nudge.metric_value or 'N/A'}, "
-                    f"Unit: {nudge.unit or 'N/A'}, "
-                    f"Operator: {nudge.operator or 'N/A'}"
+        block = await _nudge_block(db, req.employee_id)
+        nudges = block.prompt
+        print(f"[nudge_summary] Fetched {len(nudges)} nudges from database")
+
+        nudge_snippet = block.snippet
+        fingerprint = nudge_fingerprint(nudges, req.prompt)
+
+        async def summarize_once():
+            # Shared with other requests' followers, so it must not use this request's session.
+            async with AsyncSessionLocal() as session:
+                # Check if a summary of the same nudges and prompt already exists
+                existing_summary = (await session.execute(
+                    select(NudgeSummary.summary).where(
+                        NudgeSummary.employee_id == req.employee_id,
+                        NudgeSummary.nudge_fingerprint == fingerprint
+                    ).limit(1)
+                )).first()
+
+                if existing_summary:
+                    print(f"[nudge_summary] Found existing summary for employee {req.employee_id}")
+                    return {"summary": existing_summary.summary}
+
+                # Generate nudge summary
+                result = await generate_nudge_summary(req.employee_id, req.prompt, nudges, store=store, openai_api_key=config.openai_api_key, clients=clients)
+
+                # Insert new summary into the database
+                summary_record = NudgeSummary(
+                    employee_id=req.employee_id,
+                    summary=result["summary"],
+                    nudge_snippet=nudge_snippet,
+                    nudge_fingerprint=fingerprint
                 )
-            }
-            for nudge in nudges_data
-        ]
-
-        # Prepare nudge snippet for comparison
-        nudge_snippet = ", ".join([nudge["title"] for nudge in nudges])
-
-        # Check if summary already exists with matching nudge snippet
-        existing_summary = db.query(NudgeSummary).filter(
-            NudgeSummary.employee_id == req.employee_id,
-            NudgeSummary.nudge_snippet == nudge_snippet
-        ).first()
-        
-        if existing_summary:
-            print(f"[nudge_summary] Found existing summary for employee {req.employee_id}")
-            return {"summary": existing_summary.summary}
-
-        # Generate nudge summary
-        result = generate_nudge_summary(req.employee_id, req.prompt, nudges, store=store, openai_api_key=config.openai_api_key)
-
-        # Insert new summary into the database
-        summary_record = NudgeSummary(
-            employee_id=req.employee_id,
-            summary=result["summary"],
-            nudge_snippet=nudge_snippet
-        )
-        db.add(summary_record)
-        db.commit()
+                session.add(summary_record)
+                with span("db_commit"):
+                    await session.commit()
 
-        return result
+                return result
+
+        return await _single_flight(f"nudge-summary:{req.employee_id}:{fingerprint}", summarize_once)
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+        await db.rollback()
+        raise _http_error(e)
 
     uvicorn.run("server:app", host="127.0.0.1", port=8000, reload=True)
@@ -1 +1,20 @@
-from stylemail.api import seed_user_style, generate_email, generate_nudge_summary, generate_nudge_email
+"""
+StyleMail: generate emails in a user's own writing style.
+
+The public API below is loaded on first access, so importing the package (or
+a light submodule such as stylemail.config) doesn't pull in numpy, redis or
+openai.
+"""
+from importlib import import_module
+
+__all__ = ["seed_user_style", "generate_email", "generate_nudge_summary", "generate_nudge_email"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return getattr(import_module("stylemail.api"), name)
+    raise AttributeError(f"module 'stylemail' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,169 @@
+"""
+Approximate nearest-neighbour search over a user's normalized style matrix.
+
+IVFIndex is an inverted-file index: spherical k-means splits the samples into
+~sqrt(n) lists, and a query is scored exactly against only the samples in
+the n_probe lists whose centroids are closest to it.
+"""
+import hashlib
+import math
+from typing import List, Optional
+import numpy as np
+
+
+def top_k_indices(scores: np.ndarray, texts: List[str], top_k: int) -> List[int]:
+    """
+    Indices of the top-k scores, highest first. Ties are broken by text in
+    descending order, matching a reverse sort over (score, text) tuples.
+    """
+    if top_k <= 0 or len(scores) == 0:
+        return []
+    if top_k < len(scores):
+        # argpartition picks arbitrarily among scores tied with the k-th, so
+        # keep all of them and let the text tie-break choose.
+        kth = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(len(scores))
+    return sorted(candidates.tolist(), key=lambda i: (scores[i], texts[i]), reverse=True)[:top_k]
+
+
+def default_n_lists(n: int) -> int:
+    return max(1, int(round(math.sqrt(n))))
+
+
+def default_n_probe(n_lists: int) -> int:
+    return max(1, int(math.ceil(n_lists * 0.15)))
+
+
+def outgrown(n_lists: int, n: int) -> bool:
+    """True once a corpus of n samples should be retrained into more lists."""
+    return default_n_lists(n) > 2 * n_lists
+
+
+def centroids_build_id(centroids: np.ndarray) -> str:
+    """Short digest identifying one trained set of centroids."""
+    return hashlib.sha1(np.ascontiguousarray(centroids, dtype=np.float32).tobytes()).hexdigest()[:12]
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, n_probe: Optional[int] = None):
+        """
+        Args:
+            centroids (np.ndarray): (n_lists, dim) L2-normalized float32 centroids.
+            assignments (np.ndarray): List number of every row of the indexed matrix.
+            n_probe (Optional[int]): Lists scanned per query. Defaults to ~15% of the lists.
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.n_probe = min(n_probe or default_n_probe(self.n_lists), self.n_lists)
+        self.order = np.argsort(self.assignments, kind="stable")
+        self.bounds = np.searchsorted(self.assignments[self.order], np.arange(self.n_lists + 1))
+        # When rows are already grouped by list, each list is a slice of the
+        # matrix and search scores views instead of gathering rows.
+        self.contiguous = bool(np.all(self.assignments[:-1] <= self.assignments[1:]))
+        self.build_id = centroids_build_id(self.centroids)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + 2 * self.assignments.nbytes
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, n_lists: Optional[int] = None, n_probe: Optional[int] = None, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        """
+        Build an index over an L2-normalized matrix with spherical k-means.
+        At most 256 samples per list are used to fit the centroids.
+        """
+        n = len(matrix)
+        n_lists = min(n_lists or default_n_lists(n), n)
+        rng = np.random.default_rng(seed)
+        sample = matrix if n <= 256 * n_lists else matrix[rng.choice(n, 256 * n_lists, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = cls.assign_rows(centroids, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            used = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            sums[used] = np.add.reduceat(sample[np.argsort(labels, kind="stable")], starts[used])
+            empty = np.flatnonzero(counts == 0)
+            # Reseed empty lists from random samples so every list stays in use.
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return cls(centroids, cls.assign_rows(centroids, matrix), n_probe=n_probe)
+
+    @staticmethod
+    def assign_rows(centroids: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Nearest centroid of every row, in chunks to bound the score matrix."""
+        labels = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), 8192):
+            chunk = rows[start:start + 8192]
+            labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def grouped(self) -> "IVFIndex":
+        """
+        The same index for the matrix reordered by self.order, i.e. with every
+        list stored contiguously.
+        """
+        return IVFIndex(self.centroids, self.assignments[self.order], n_probe=self.n_probe)
+
+    def search(self, matrix: np.ndarray, texts: List[str], query: np.ndarray, top_k: int) -> List[int]:
+        """
+        Rows of matrix closest to the normalized query, highest score first,
+        looking only at the n_probe nearest lists. Falls back to scanning
+        every row when those lists hold fewer than top_k samples.
+        """
+        centroid_scores = self.centroids @ query
+        if self.n_probe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, self.n_probe - 1)[:self.n_probe]
+        else:
+            probe = np.arange(self.n_lists)
+        if self.contiguous:
+            rows = np.concatenate([np.arange(self.bounds[i], self.bounds[i + 1]) for i in probe])
+            scores = np.concatenate([matrix[self.bounds[i]:self.bounds[i + 1]] @ query for i in probe])
+        else:
+            rows = np.concatenate([self.order[self.bounds[i]:self.bounds[i + 1]] for i in probe])
+            scores = matrix[rows] @ query
+        if len(rows) < min(top_k, len(matrix)):
+            return top_k_indices(matrix @ query, texts, top_k)
+        picked = top_k_indices(scores, [texts[i] for i in rows], top_k)
+        return [int(rows[i]) for i in picked]
+
+
+def mmr_select(matrix: np.ndarray, query: np.ndarray, candidates: List[int], top_k: int, lambda_: float) -> List[int]:
+    """
+    Maximal marginal relevance over candidate rows of a normalized matrix.
+
+    Each step picks the candidate maximizing
+    lambda_ * sim(query, c) - (1 - lambda_) * max(sim(c, already picked)),
+    so lambda_=1 is plain top-k and lower values trade relevance for
+    diversity. The candidate similarities are computed once as one matmul and
+    each step updates the running max with a single row.
+    """
+    if top_k <= 0 or not candidates:
+        return []
+    rows = np.asarray(candidates)
+    vectors = matrix[rows]
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    available = np.ones(len(rows), dtype=bool)
+    # Ties keep candidate order, since argmax returns the first maximum.
+    best = int(np.argmax(relevance))
+    picked = [int(rows[best])]
+    available[best] = False
+    redundancy = similarity[best].copy()
+    while len(picked) < min(top_k, len(rows)):
+        scores = lambda_ * relevance - (1.0 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(int(rows[best]))
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
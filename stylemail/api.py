@@ -1,30 +1,23 @@
 import logging
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from stylemail.clients import ClientRegistry
+from stylemail.cache import EmbeddingCache, ResponseCache
 from stylemail.config import Config
 from stylemail.vectorstore import UserVectorStore
 from stylemail.seeder import StyleSeeder
 from stylemail.generator import EmailGenerator, NudgeSummaryGenerator, NudgeEmailGenerator
+from stylemail.prompting import PromptBudget
 
 
-def seed_user_style(user_id: str, samples: List[str], store: UserVectorStore, openai_api_key: str) -> None:
-    """
-    Store a user's writing style by embedding sample texts and saving them to Redis.
-    """
+def _validate_seed(user_id: str, samples: List[str]) -> None:
     if not user_id or not isinstance(user_id, str):
         raise ValueError("user_id must be a non-empty string")
     if not samples or not all(isinstance(s, str) for s in samples):
         raise ValueError("samples must be a list of non-empty strings")
 
-    seeder = StyleSeeder(openai_api_key, store)
-    logging.info(f"Seeding style for user '{user_id}' with {len(samples)} samples.")
-    seeder.seed_user_style(user_id, samples)
-
 
-def generate_email(user_id: str, subject: str, prompt: str, store: UserVectorStore, openai_api_key: str) -> Dict[str, str]:
-    """
-    Generate a personalized email using the user's writing style and a given prompt.
-    Returns a dictionary with 'subject' and 'body'.
-    """
+def _validate_generate(user_id: str, subject: str, prompt: str) -> None:
     if not user_id or not isinstance(user_id, str):
         raise ValueError("user_id must be a non-empty string")
     if not subject or not isinstance(subject, str):
@@ -32,13 +25,26 @@ def generate_email(user_id: str, subject: str, prompt: str, store: UserVectorSto
     if not prompt or not isinstance(prompt, str):
         raise ValueError("prompt must be a non-empty string")
 
-    generator = EmailGenerator(openai_api_key, store)
-    logging.info(f"[generate_email] user='{user_id}' subject='{subject}' prompt='{prompt}'")
-    return generator.generate_email(user_id, subject, prompt)
-def generate_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: UserVectorStore, openai_api_key: str) -> Dict[str, str]:
-    """
-    Generate an email for a list of nudges based on a given prompt.
-    """
+
+def _retrieval_settings(top_k: Optional[int], mmr_lambda: Optional[float], style_tokens: Optional[int]) -> Dict[str, Any]:
+    """Validate per-request retrieval overrides and turn them into EmailGenerator kwargs."""
+    settings: Dict[str, Any] = {}
+    if top_k is not None:
+        if not isinstance(top_k, int) or top_k < 1:
+            raise ValueError("top_k must be a positive integer")
+        settings["top_k"] = top_k
+    if mmr_lambda is not None:
+        if not 0.0 <= mmr_lambda <= 1.0:
+            raise ValueError("mmr_lambda must be between 0 and 1")
+        settings["mmr_lambda"] = mmr_lambda
+    if style_tokens is not None:
+        if not isinstance(style_tokens, int) or style_tokens < 1:
+            raise ValueError("style_tokens must be a positive integer")
+        settings["prompt_budget"] = PromptBudget(style_tokens=style_tokens)
+    return settings
+
+
+def _validate_nudges(user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> None:
     if not user_id or not isinstance(user_id, str):
         raise ValueError("user_id must be a non-empty string")
     if not prompt or not isinstance(prompt, str):
@@ -46,20 +52,102 @@ def generate_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]]
     if not nudges or not all(isinstance(n, dict) for n in nudges):
         raise ValueError("nudges must be a list of dictionaries with 'title', 'instructions', and 'metrics' keys")
 
-    generator = NudgeEmailGenerator(openai_api_key, store)
-    logging.info(f"[generate_nudge_email] user='{user_id}' prompt='{prompt}' nudges='{nudges}'")
+
+def seed_user_style(user_id: str, samples: List[str], store: UserVectorStore, openai_api_key: str, embedding_cache: Optional[EmbeddingCache] = None, clients: Optional[ClientRegistry] = None) -> int:
+    """
+    Store a user's writing style by embedding sample texts and saving them to Redis.
+    Returns the number of new samples stored.
+    """
+    _validate_seed(user_id, samples)
+
+    seeder = StyleSeeder(openai_api_key, store, embedding_cache=embedding_cache, client=clients.openai if clients else None)
+    logging.info(f"Seeding style for user '{user_id}' with {len(samples)} samples.")
+    return seeder.seed_user_style(user_id, samples)
+
+
+def generate_email(user_id: str, subject: str, prompt: str, store: UserVectorStore, openai_api_key: str, embedding_cache: Optional[EmbeddingCache] = None, clients: Optional[ClientRegistry] = None, response_cache: Optional[ResponseCache] = None, top_k: Optional[int] = None, mmr_lambda: Optional[float] = None, style_tokens: Optional[int] = None) -> Dict[str, str]:
+    """
+    Generate a personalized email using the user's writing style and a given prompt.
+    Returns a dictionary with 'subject' and 'body'. With a response_cache, near-duplicate
+    prompts reuse an earlier result and the dictionary also has 'cache': 'hit' or 'miss'.
+
+    top_k, mmr_lambda and style_tokens override how many style samples are retrieved,
+    the MMR relevance/diversity trade-off and the style samples' token budget. The
+    response cache is bypassed for requests that set any of them.
+    """
+    _validate_generate(user_id, subject, prompt)
+    settings = _retrieval_settings(top_k, mmr_lambda, style_tokens)
+
+    generator = EmailGenerator(openai_api_key, store, embedding_cache=embedding_cache, client=clients.openai if clients else None, response_cache=None if settings else response_cache, **settings)
+    logging.info(f"[generate_email] user='{user_id}' prompt_chars={len(prompt)}")
+    return generator.generate_email(user_id, subject, prompt)
+
+
+def stream_email(user_id: str, subject: str, prompt: str, store: UserVectorStore, openai_api_key: str, embedding_cache: Optional[EmbeddingCache] = None, clients: Optional[ClientRegistry] = None, top_k: Optional[int] = None, mmr_lambda: Optional[float] = None, style_tokens: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Stream a personalized email as ("subject" | "body", text) events.
+    """
+    _validate_generate(user_id, subject, prompt)
+    settings = _retrieval_settings(top_k, mmr_lambda, style_tokens)
+
+    generator = EmailGenerator(openai_api_key, store, embedding_cache=embedding_cache, client=clients.openai if clients else None, **settings)
+    logging.info(f"[stream_email] user='{user_id}' prompt_chars={len(prompt)}")
+    return generator.stream_email(user_id, subject, prompt)
+
+
+def generate_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: UserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> Dict[str, str]:
+    """
+    Generate an email for a list of nudges based on a given prompt.
+    """
+    _validate_nudges(user_id, prompt, nudges)
+
+    generator = NudgeEmailGenerator(openai_api_key, store, client=clients.openai if clients else None)
+    logging.info(f"[generate_nudge_email] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
     return generator.generate_email(user_id, prompt, nudges)
-def generate_nudge_summary(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: UserVectorStore, openai_api_key: str) -> Dict[str, str]:
+
+
+def stream_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: UserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Stream an email for a list of nudges as ("subject" | "body", text) events.
+    """
+    _validate_nudges(user_id, prompt, nudges)
+
+    generator = NudgeEmailGenerator(openai_api_key, store, client=clients.openai if clients else None)
+    logging.info(f"[stream_nudge_email] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
+    return generator.stream_email(user_id, prompt, nudges)
+
+
+def generate_nudge_emails_batch(user_id: str, prompt: str, nudges_by_employee: Dict[str, List[Dict[str, str]]], store: UserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None, max_concurrency: int = 8) -> Dict[str, Dict[str, str]]:
+    """
+    Generate nudge emails for many employees with at most max_concurrency calls
+    in flight. Returns {employee_id: {"subject", "body"} or {"error"}}.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    generator = NudgeEmailGenerator(openai_api_key, store, client=clients.openai if clients else None)
+    logging.info(f"[generate_nudge_emails_batch] user='{user_id}' employees={len(nudges_by_employee)} concurrency={max_concurrency}")
+
+    def generate_one(nudges: List[Dict[str, str]]) -> Dict[str, str]:
+        if not nudges:
+            return {"error": "No active nudges found"}
+        try:
+            _validate_nudges(user_id, prompt, nudges)
+            return generator.generate_email(user_id, prompt, nudges)
+        except Exception as e:
+            return {"error": str(e)}
+
+    employee_ids = list(nudges_by_employee)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        results = list(pool.map(generate_one, (nudges_by_employee[e] for e in employee_ids)))
+    return dict(zip(employee_ids, results))
+
+
+def generate_nudge_summary(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: UserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> Dict[str, str]:
     """
     Generate a summary for a list of nudges based on a given prompt.
     """
-    if not user_id or not isinstance(user_id, str):
-        raise ValueError("user_id must be a non-empty string")
-    if not prompt or not isinstance(prompt, str):
-        raise ValueError("prompt must be a non-empty string")
-    if not nudges or not all(isinstance(n, dict) for n in nudges):
-        raise ValueError("nudges must be a list of dictionaries with 'title', 'instructions', and 'metrics' keys")
+    _validate_nudges(user_id, prompt, nudges)
 
-    generator = NudgeSummaryGenerator(openai_api_key, store)
-    logging.info(f"[generate_nudge_summary] user='{user_id}' prompt='{prompt}' nudges='{nudges}'")
+    generator = NudgeSummaryGenerator(openai_api_key, store, client=clients.openai if clients else None)
+    logging.info(f"[generate_nudge_summary] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
     return generator.generate_summary(user_id, prompt, nudges)
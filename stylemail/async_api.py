@@ -0,0 +1,113 @@
+"""
+Async variants of the stylemail.api functions, backed by AsyncOpenAI and
+redis.asyncio so an event loop can keep many LLM calls in flight at once.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from stylemail.api import _retrieval_settings, _validate_seed, _validate_generate, _validate_nudges
+from stylemail.async_vectorstore import AsyncUserVectorStore
+from stylemail.async_seeder import AsyncStyleSeeder
+from stylemail.async_generator import AsyncEmailGenerator, AsyncNudgeSummaryGenerator, AsyncNudgeEmailGenerator
+from stylemail.clients import ClientRegistry
+from stylemail.cache import AsyncEmbeddingCache, AsyncResponseCache
+
+
+async def seed_user_style(user_id: str, samples: List[str], store: AsyncUserVectorStore, openai_api_key: str, embedding_cache: Optional[AsyncEmbeddingCache] = None, clients: Optional[ClientRegistry] = None) -> int:
+    """
+    Store a user's writing style by embedding sample texts and saving them to Redis.
+    Returns the number of new samples stored.
+    """
+    _validate_seed(user_id, samples)
+
+    seeder = AsyncStyleSeeder(openai_api_key, store, embedding_cache=embedding_cache, client=clients.async_openai if clients else None)
+    logging.info(f"Seeding style for user '{user_id}' with {len(samples)} samples.")
+    return await seeder.seed_user_style(user_id, samples)
+
+
+async def generate_email(user_id: str, subject: str, prompt: str, store: AsyncUserVectorStore, openai_api_key: str, embedding_cache: Optional[AsyncEmbeddingCache] = None, clients: Optional[ClientRegistry] = None, response_cache: Optional[AsyncResponseCache] = None, top_k: Optional[int] = None, mmr_lambda: Optional[float] = None, style_tokens: Optional[int] = None) -> Dict[str, str]:
+    """
+    Generate a personalized email using the user's writing style and a given prompt.
+    Returns a dictionary with 'subject' and 'body'. With a response_cache, near-duplicate
+    prompts reuse an earlier result and the dictionary also has 'cache': 'hit' or 'miss'.
+    Retrieval overrides work as in stylemail.api.generate_email.
+    """
+    _validate_generate(user_id, subject, prompt)
+    settings = _retrieval_settings(top_k, mmr_lambda, style_tokens)
+
+    generator = AsyncEmailGenerator(openai_api_key, store, embedding_cache=embedding_cache, client=clients.async_openai if clients else None, response_cache=None if settings else response_cache, **settings)
+    logging.info(f"[generate_email] user='{user_id}' prompt_chars={len(prompt)}")
+    return await generator.generate_email(user_id, subject, prompt)
+
+
+def stream_email(user_id: str, subject: str, prompt: str, store: AsyncUserVectorStore, openai_api_key: str, embedding_cache: Optional[AsyncEmbeddingCache] = None, clients: Optional[ClientRegistry] = None, top_k: Optional[int] = None, mmr_lambda: Optional[float] = None, style_tokens: Optional[int] = None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Stream a personalized email as ("subject" | "body", text) events.
+    Inputs are validated eagerly, before the stream is consumed.
+    """
+    _validate_generate(user_id, subject, prompt)
+    settings = _retrieval_settings(top_k, mmr_lambda, style_tokens)
+
+    generator = AsyncEmailGenerator(openai_api_key, store, embedding_cache=embedding_cache, client=clients.async_openai if clients else None, **settings)
+    logging.info(f"[stream_email] user='{user_id}' prompt_chars={len(prompt)}")
+    return generator.stream_email(user_id, subject, prompt)
+
+
+async def generate_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: AsyncUserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> Dict[str, str]:
+    """
+    Generate an email for a list of nudges based on a given prompt.
+    """
+    _validate_nudges(user_id, prompt, nudges)
+
+    generator = AsyncNudgeEmailGenerator(openai_api_key, store, client=clients.async_openai if clients else None)
+    logging.info(f"[generate_nudge_email] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
+    return await generator.generate_email(user_id, prompt, nudges)
+
+
+def stream_nudge_email(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: AsyncUserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Stream an email for a list of nudges as ("subject" | "body", text) events.
+    """
+    _validate_nudges(user_id, prompt, nudges)
+
+    generator = AsyncNudgeEmailGenerator(openai_api_key, store, client=clients.async_openai if clients else None)
+    logging.info(f"[stream_nudge_email] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
+    return generator.stream_email(user_id, prompt, nudges)
+
+
+async def generate_nudge_emails_batch(user_id: str, prompt: str, nudges_by_employee: Dict[str, List[Dict[str, str]]], store: AsyncUserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None, max_concurrency: int = 8) -> Dict[str, Dict[str, str]]:
+    """
+    Generate nudge emails for many employees, running at most max_concurrency
+    LLM calls at once. Returns {employee_id: {"subject", "body"} or {"error"}};
+    one employee failing does not affect the others.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    generator = AsyncNudgeEmailGenerator(openai_api_key, store, client=clients.async_openai if clients else None)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    logging.info(f"[generate_nudge_emails_batch] user='{user_id}' employees={len(nudges_by_employee)} concurrency={max_concurrency}")
+
+    async def generate_one(nudges: List[Dict[str, str]]) -> Dict[str, str]:
+        if not nudges:
+            return {"error": "No active nudges found"}
+        try:
+            _validate_nudges(user_id, prompt, nudges)
+            async with semaphore:
+                return await generator.generate_email(user_id, prompt, nudges)
+        except Exception as e:
+            return {"error": str(e)}
+
+    employee_ids = list(nudges_by_employee)
+    results = await asyncio.gather(*(generate_one(nudges_by_employee[e]) for e in employee_ids))
+    return dict(zip(employee_ids, results))
+
+
+async def generate_nudge_summary(user_id: str, prompt: str, nudges: List[Dict[str, str]], store: AsyncUserVectorStore, openai_api_key: str, clients: Optional[ClientRegistry] = None) -> Dict[str, str]:
+    """
+    Generate a summary for a list of nudges based on a given prompt.
+    """
+    _validate_nudges(user_id, prompt, nudges)
+
+    generator = AsyncNudgeSummaryGenerator(openai_api_key, store, client=clients.async_openai if clients else None)
+    logging.info(f"[generate_nudge_summary] user='{user_id}' prompt_chars={len(prompt)} nudges={len(nudges)}")
+    return await generator.generate_summary(user_id, prompt, nudges)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from openai import AsyncOpenAI
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from stylemail.async_vectorstore import AsyncUserVectorStore
+from stylemail.cache import AsyncEmbeddingCache, AsyncResponseCache
+from stylemail.config import EMBEDDING_MODEL
+from stylemail.metrics import record_usage, span
+from stylemail.prompting import PromptBudget
+from stylemail.generator import (
+    DEFAULT_TOP_K,
+    EmailGenerator,
+    NudgeEmailGenerator,
+    NudgeSummaryGenerator,
+    SubjectLineParser,
+    chat_kwargs,
+    log_prompt,
+    stream_deltas,
+    parse_subject_and_body,
+    rank_style_context,
+)
+from stylemail.upstream import CHAT_UPSTREAM, EMBEDDINGS_UPSTREAM
+
+
+class AsyncEmailGenerator(EmailGenerator):
+    def __init__(self, openai_api_key: str, vector_store: AsyncUserVectorStore, embedding_cache: Optional[AsyncEmbeddingCache] = None, client: Optional[AsyncOpenAI] = None, response_cache: Optional[AsyncResponseCache] = None, prompt_budget: Optional[PromptBudget] = None, top_k: int = DEFAULT_TOP_K, mmr_lambda: Optional[float] = None):
+        """
+        Initialize the AsyncEmailGenerator with OpenAI API key and an async vector store.
+
+        Args:
+            openai_api_key (str): The API key for OpenAI.
+            vector_store (AsyncUserVectorStore): The async vector store instance for user embeddings.
+            embedding_cache (Optional[AsyncEmbeddingCache]): Shared prompt-embedding cache.
+            client (Optional[AsyncOpenAI]): Shared async OpenAI client.
+            response_cache (Optional[AsyncResponseCache]): Semantic cache of earlier results. Disabled when None.
+            prompt_budget (Optional[PromptBudget]): Token budgets of the prompt sections.
+            top_k (int): Style samples retrieved per email.
+            mmr_lambda (Optional[float]): Relevance/diversity trade-off in [0, 1] for maximal
+                marginal relevance retrieval. Plain top-k when None.
+        """
+        self.client = client or AsyncOpenAI(api_key=openai_api_key, max_retries=0)
+        self.vector_store = vector_store
+        self.embedding_cache = embedding_cache or AsyncEmbeddingCache(vector_store.redis, namespace=vector_store.namespace)
+        self.response_cache = response_cache
+        self.prompt_budget = prompt_budget or PromptBudget()
+        self.top_k = top_k
+        self.mmr_lambda = mmr_lambda
+
+    async def embed_prompt(self, prompt: str) -> List[float]:
+        try:
+            with span("embed"):
+                return (await self.embedding_cache.embed(EMBEDDING_MODEL, [prompt], self._fetch_embeddings))[0]
+        except Exception as e:
+            raise RuntimeError(f"Failed to embed prompt with OpenAI API: {e}")
+
+    async def _fetch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        response = await EMBEDDINGS_UPSTREAM.acall(
+            self.client.embeddings,
+            input=texts,
+            model=EMBEDDING_MODEL
+        )
+        record_usage(response, api="embeddings")
+        return [d.embedding for d in response.data]
+
+    async def retrieve_style_context(self, user_id: str, prompt_embedding: List[float], top_k: int = DEFAULT_TOP_K, mmr_lambda: Optional[float] = None) -> List[str]:
+        texts, matrix, index = await self.vector_store.get_search_index(user_id)
+        with span("rank"):
+            # One matmul over a large corpus would stall every other request on the loop.
+            return await asyncio.to_thread(rank_style_context, texts, matrix, prompt_embedding, top_k, index=index, mmr_lambda=mmr_lambda)
+
+    async def generate_email(self, user_id: str, subject: str, user_prompt: str) -> Dict[str, str]:
+        full_input = f"Subject: {subject}\n\n{user_prompt}"
+        prompt_embedding = await self.embed_prompt(full_input)
+        if self.response_cache is not None:
+            try:
+                with span("response_cache"):
+                    cached = await self.response_cache.lookup(user_id, prompt_embedding)
+            except Exception as e:
+                logging.warning(f"[generate_email] Response cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                return {**cached, "cache": "hit"}
+
+        context = await self.retrieve_style_context(user_id, prompt_embedding, top_k=self.top_k, mmr_lambda=self.mmr_lambda)
+        full_prompt = self._prepare_prompt(user_id, context, full_input)
+
+        try:
+            response = await CHAT_UPSTREAM.acall(self.client.chat.completions, **chat_kwargs(full_prompt))
+            record_usage(response)
+            content = response.choices[0].message.content
+            result = {"subject": "Generated Email", "body": content}
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate email with OpenAI API: {e}")
+
+        if self.response_cache is not None:
+            try:
+                await self.response_cache.put(user_id, full_input, prompt_embedding, result)
+            except Exception as e:
+                logging.warning(f"[generate_email] Response cache write failed: {e}")
+            return {**result, "cache": "miss"}
+        return result
+
+    async def stream_email(self, user_id: str, subject: str, user_prompt: str) -> AsyncIterator[Tuple[str, str]]:
+        full_input = f"Subject: {subject}\n\n{user_prompt}"
+        prompt_embedding = await self.embed_prompt(full_input)
+        context = await self.retrieve_style_context(user_id, prompt_embedding, top_k=self.top_k, mmr_lambda=self.mmr_lambda)
+        full_prompt = self._prepare_prompt(user_id, context, full_input)
+
+        try:
+            async with CHAT_UPSTREAM.astream(self.client.chat.completions, **chat_kwargs(full_prompt, stream=True)) as stream:
+                yield ("subject", "Generated Email")
+                async for chunk in stream:
+                    delta = stream_deltas(chunk)
+                    if delta:
+                        yield ("body", delta)
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate email with OpenAI API: {e}")
+
+
+class AsyncNudgeSummaryGenerator(NudgeSummaryGenerator):
+    def __init__(self, openai_api_key: str, vector_store: AsyncUserVectorStore, client: Optional[AsyncOpenAI] = None, prompt_budget: Optional[PromptBudget] = None):
+        self.client = client or AsyncOpenAI(api_key=openai_api_key, max_retries=0)
+        self.vector_store = vector_store
+        self.prompt_budget = prompt_budget or PromptBudget()
+
+    async def generate_summary(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> Dict[str, str]:
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("generate_summary", full_prompt)
+
+        try:
+            response = await CHAT_UPSTREAM.acall(self.client.chat.completions, **chat_kwargs(full_prompt.text))
+            record_usage(response)
+            content = response.choices[0].message.content
+            return {"summary": content}
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate summary with OpenAI API: {e}")
+
+
+class AsyncNudgeEmailGenerator(NudgeEmailGenerator):
+    def __init__(self, openai_api_key: str, vector_store: AsyncUserVectorStore, client: Optional[AsyncOpenAI] = None, prompt_budget: Optional[PromptBudget] = None):
+        self.client = client or AsyncOpenAI(api_key=openai_api_key, max_retries=0)
+        self.vector_store = vector_store
+        self.prompt_budget = prompt_budget or PromptBudget()
+
+    async def generate_email(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> Dict[str, str]:
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("generate_nudge_email", full_prompt)
+
+        try:
+            response = await CHAT_UPSTREAM.acall(self.client.chat.completions, **chat_kwargs(full_prompt.text))
+            record_usage(response)
+            content = response.choices[0].message.content
+            return parse_subject_and_body(content)
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate nudge email with OpenAI API: {e}")
+
+    async def stream_email(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> AsyncIterator[Tuple[str, str]]:
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("stream_nudge_email", full_prompt)
+
+        try:
+            async with CHAT_UPSTREAM.astream(self.client.chat.completions, **chat_kwargs(full_prompt.text, stream=True)) as stream:
+                parser = SubjectLineParser()
+                async for chunk in stream:
+                    for event in parser.feed(stream_deltas(chunk)):
+                        yield event
+                for event in parser.finish():
+                    yield event
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate nudge email with OpenAI API: {e}")
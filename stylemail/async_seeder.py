@@ -0,0 +1,64 @@
+import asyncio
+from openai import AsyncOpenAI
+from typing import List, Optional
+from stylemail.async_vectorstore import AsyncUserVectorStore
+from stylemail.cache import AsyncEmbeddingCache
+from stylemail.config import EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MODEL
+from stylemail.metrics import record_usage, span
+from stylemail.seeder import StyleSeeder
+from stylemail.tokens import truncate_to_tokens
+from stylemail.upstream import EMBEDDINGS_UPSTREAM
+
+
+class AsyncStyleSeeder(StyleSeeder):
+    def __init__(
+        self,
+        openai_api_key: str,
+        vector_store: AsyncUserVectorStore,
+        embedding_cache: Optional[AsyncEmbeddingCache] = None,
+        client: Optional[AsyncOpenAI] = None,
+        max_request_tokens: int = 50_000,
+        max_request_inputs: int = 512,
+        max_concurrency: int = 4,
+    ):
+        self.client = client or AsyncOpenAI(api_key=openai_api_key, max_retries=0)
+        self.vector_store = vector_store
+        self.embedding_cache = embedding_cache or AsyncEmbeddingCache(vector_store.redis, namespace=vector_store.namespace)
+        self.max_request_tokens = max_request_tokens
+        self.max_request_inputs = max_request_inputs
+        self.max_concurrency = max_concurrency
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        try:
+            return await self.embedding_cache.embed(EMBEDDING_MODEL, texts, self._fetch_embeddings)
+        except Exception as e:
+            raise RuntimeError(f"Failed to embed texts with OpenAI API: {e}")
+
+    async def _fetch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        response = await EMBEDDINGS_UPSTREAM.acall(
+            self.client.embeddings,
+            input=[truncate_to_tokens(t, EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MODEL) for t in texts],
+            model=EMBEDDING_MODEL
+        )
+        record_usage(response, api="embeddings")
+        return [d.embedding for d in response.data]
+
+    async def seed_user_style(self, user_id: str, samples: List[str]) -> int:
+        """
+        Embed and store a user's writing samples in the Redis vector store,
+        skipping samples already stored. Returns the number of samples stored.
+        """
+        samples = list(dict.fromkeys(samples))
+        with span("seed_dedupe"):
+            stored = await self.vector_store.has_samples(user_id, samples)
+        pending, chunks = self._plan_chunks(samples, stored)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def seed_chunk(chunk: List[str]) -> None:
+            async with semaphore:
+                embeddings = await self.embed_texts(chunk)
+            with span("seed_store"):
+                await self.vector_store.store_embeddings(user_id, chunk, embeddings)
+
+        await asyncio.gather(*(seed_chunk(chunk) for chunk in chunks))
+        return len(pending)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+import redis.asyncio as aioredis
+from stylemail.cache import UserMatrixCache
+from stylemail.metrics import MATRIX_CACHE, span
+from stylemail.ann import IVFIndex
+from stylemail.vectorstore import DEFAULT_ANN_THRESHOLD, UserVectorStore
+
+
+class AsyncUserVectorStore(UserVectorStore):
+    """
+    redis.asyncio counterpart of UserVectorStore. Key layout, storage format,
+    version counters and the matrix cache are shared with the sync store, so
+    both can serve the same data side by side.
+
+    Only the sync store's pure helpers (key names, pipeline queueing, decoding)
+    are inherited; every method that talks to Redis is overridden with a
+    coroutine. stylemail/tests/test_async_api.py checks this.
+    """
+
+    def __init__(self, redis_url: str = None, host: str = "localhost", port: int = 6379, db: int = None, password: str = "", namespace: str = "style_mail_vector", matrix_cache: Optional[UserMatrixCache] = None, redis_client: Optional[aioredis.Redis] = None, ann_threshold: Optional[int] = DEFAULT_ANN_THRESHOLD, ann_n_probe: Optional[int] = None):
+        kwargs = {"host": host, "port": port, "password": password}
+        if db is not None:
+            kwargs["db"] = db
+        self.redis = redis_client or aioredis.Redis(**kwargs)
+        self.namespace = namespace
+        self.matrix_cache = matrix_cache
+        self.ann_threshold = ann_threshold
+        self.ann_n_probe = ann_n_probe
+        self._listener: Optional[asyncio.Task] = None
+        self._listening = False
+
+    async def store_embedding(self, user_id: str, text: str, embedding: List[float]) -> None:
+        await self.store_embeddings(user_id, [text], [embedding])
+
+    async def store_embeddings(self, user_id: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        if not texts:
+            return
+        pipe = self.redis.pipeline()
+        self._queue_store(pipe, user_id, texts, embeddings)
+        await pipe.execute()
+        self._invalidate_local(user_id)
+
+    async def has_samples(self, user_id: str, texts: Sequence[str]) -> List[bool]:
+        if not texts:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for text in texts:
+            pipe.hexists(self._user_key(user_id), self._hash_text(text))
+        return [bool(found) for found in await pipe.execute()]
+
+    async def _fetch_raw(self, user_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._user_key(user_id))
+        pipe.hgetall(self._texts_key(user_id))
+        pipe.get(self._version_key(user_id))
+        vectors, texts, version = await pipe.execute()
+        return vectors, texts, int(version or 0)
+
+    async def get_all_embeddings(self, user_id: str) -> List[dict]:
+        try:
+            vectors, texts, _ = await self._fetch_raw(user_id)
+            return self._decode_entries(vectors, texts)
+        except Exception as e:
+            raise RuntimeError(f"Failed to retrieve embeddings from Redis for user '{user_id}': {e}")
+
+    async def get_embedding_matrix(self, user_id: str) -> Tuple[List[str], np.ndarray]:
+        texts, matrix, _ = await self.get_search_index(user_id)
+        return texts, matrix
+
+    async def get_search_index(self, user_id: str) -> Tuple[List[str], np.ndarray, Optional[IVFIndex]]:
+        cache = self.matrix_cache
+        if cache is None:
+            _, texts, matrix, index = await self._load_matrix(user_id)
+            return texts, matrix, index
+
+        if self._listening:
+            cached = cache.get(user_id)
+            if cached is not None:
+                MATRIX_CACHE.inc(result="hit")
+                return cached.texts, cached.matrix, cached.index
+        else:
+            version = int(await self.redis.get(self._version_key(user_id)) or 0)
+            cached = cache.get(user_id)
+            if cached is not None and cached.version == version:
+                MATRIX_CACHE.inc(result="hit")
+                return cached.texts, cached.matrix, cached.index
+
+        MATRIX_CACHE.inc(result="miss")
+        generation = cache.generation
+        version, texts, matrix, index = await self._load_matrix(user_id)
+        cache.put(user_id, version, texts, matrix, generation=generation, index=index)
+        return texts, matrix, index
+
+    async def _load_matrix(self, user_id: str) -> Tuple[int, List[str], np.ndarray, Optional[IVFIndex]]:
+        try:
+            with span("redis_fetch"):
+                vectors, raw_texts, version = await self._fetch_raw(user_id)
+            # Decoding, stacking and indexing a large corpus is CPU work, so
+            # all of it runs off the event loop.
+            entries = await asyncio.to_thread(self._decode_entries, vectors, raw_texts)
+        except Exception as e:
+            raise RuntimeError(f"Failed to retrieve embeddings from Redis for user '{user_id}': {e}")
+        with span("decode"):
+            texts, matrix = await asyncio.to_thread(self._stack_entries, entries)
+        if not self._wants_index(len(entries)):
+            return version, texts, matrix, None
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._ivf_centroids_key(user_id))
+            pipe.hgetall(self._ivf_lists_key(user_id))
+            centroids, lists = await pipe.execute()
+            index, assigned, rebuilt = await asyncio.to_thread(self._sync_index, [e["doc_id"] for e in entries], matrix, centroids, lists)
+            if assigned:
+                pipe = self.redis.pipeline()
+                self._queue_index_writes(pipe, user_id, index, assigned, rebuilt)
+                await pipe.execute()
+        except Exception as e:
+            logging.warning(f"[vectorstore] IVF index unavailable for user '{user_id}', using exact search: {e}")
+            return version, texts, matrix, None
+        # Keep each list contiguous so searches score matrix slices.
+        texts = [texts[i] for i in index.order]
+        return version, texts, matrix[index.order], index.grouped()
+
+    async def clear_user_data(self, user_id: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.delete(self._user_key(user_id), self._texts_key(user_id), self._ivf_centroids_key(user_id), self._ivf_lists_key(user_id))
+        self._bump_version(pipe, user_id)
+        await pipe.execute()
+        self._invalidate_local(user_id)
+
+    async def migrate_user(self, user_id: str) -> int:
+        vectors, texts, _ = await self._fetch_raw(user_id)
+        pipe = self.redis.pipeline()
+        migrated = self._queue_migration(pipe, user_id, vectors, texts)
+        if migrated:
+            await pipe.execute()
+            self._invalidate_local(user_id)
+        return migrated
+
+    async def migrate_all(self) -> int:
+        migrated = 0
+        async for key in self.redis.scan_iter(match=self._vectors_pattern()):
+            migrated += await self.migrate_user(self._user_id_from_key(key))
+        return migrated
+
+    def start_invalidation_listener(self) -> None:
+        """
+        Subscribe to the invalidation channel from a task on the running loop.
+        """
+        if self.matrix_cache is None or self._listener is not None:
+            return
+        self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop_invalidation_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        self._listener = None
+        self._listening = False
+
+    async def _listen(self) -> None:
+        channel = self._invalidation_channel()
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    if message["type"] == "subscribe":
+                        self.matrix_cache.clear()
+                        self._listening = True
+                    elif message["type"] == "message":
+                        user_id = message["data"]
+                        self.matrix_cache.invalidate(user_id.decode("utf-8") if isinstance(user_id, bytes) else user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"[vectorstore] Invalidation listener error, falling back to version checks: {e}")
+                self._listening = False
+                self.matrix_cache.clear()
+                await asyncio.sleep(1.0)
+            finally:
+                self._listening = False
+                await pubsub.aclose()
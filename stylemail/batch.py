@@ -0,0 +1,230 @@
+"""
+Offline bulk jobs over the OpenAI Batch API (or a local stand-in).
+
+A job lives in its own directory:
+
+    state.json     stage, batch id and per-request metadata (rewritten atomically)
+    input.jsonl    one Batch API request per line
+    output.jsonl   one result per line, as returned by the backend
+
+Every stage is recorded before moving on, so run_job() can be called again
+after a crash and will pick up where the previous run stopped.
+"""
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+# Job stages, in order.
+COLLECTED = "collected"
+SUBMITTED = "submitted"
+DOWNLOADED = "downloaded"
+DONE = "done"
+
+TERMINAL_FAILURES = {"failed", "expired", "cancelled"}
+
+
+class BatchJob:
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        self.state_path = os.path.join(job_dir, "state.json")
+        self.input_path = os.path.join(job_dir, "input.jsonl")
+        self.output_path = os.path.join(job_dir, "output.jsonl")
+        self.state: Dict[str, Any] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    @property
+    def stage(self) -> Optional[str]:
+        return self.state.get("stage")
+
+    def save(self) -> None:
+        os.makedirs(self.job_dir, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def write_requests(self, requests: Iterable[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> int:
+        """
+        Write (custom_id, chat body, metadata) requests to input.jsonl and record
+        the metadata so results can be matched back after a restart.
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        metadata: Dict[str, Dict[str, Any]] = {}
+        tmp_path = self.input_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for custom_id, body, meta in requests:
+                line = {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+                f.write(json.dumps(line) + "\n")
+                metadata[custom_id] = meta
+        os.replace(tmp_path, self.input_path)
+        self.state = {"stage": COLLECTED, "requests": metadata, "written": []}
+        self.save()
+        return len(metadata)
+
+    def read_results(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Parse output.jsonl into {custom_id: {"content": str} | {"error": str}}.
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        with open(self.output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                results[record["custom_id"]] = parse_result(record)
+        return results
+
+
+def parse_result(record: Dict[str, Any]) -> Dict[str, Any]:
+    if record.get("error"):
+        return {"error": json.dumps(record["error"])}
+    response = record.get("response") or {}
+    if response.get("status_code", 200) != 200:
+        return {"error": json.dumps(response.get("body"))}
+    try:
+        return {"content": response["body"]["choices"][0]["message"]["content"]}
+    except (KeyError, IndexError, TypeError):
+        return {"error": f"Malformed batch result: {record}"}
+
+
+class OpenAIBatchBackend:
+    """Submits jobs to the OpenAI Batch API (50% cheaper, 24h completion window)."""
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        batch = self.client.batches.retrieve(batch_id)
+        lines: List[str] = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.append(self.client.files.content(file_id).text.strip())
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(line for line in lines if line) + "\n")
+
+
+class LocalBatchBackend:
+    """
+    Stand-in for the Batch API that runs each request through complete(body),
+    a function returning the reply text. Used for tests and for running jobs
+    against a plain chat endpoint.
+    """
+
+    def __init__(self, complete: Callable[[Dict[str, Any]], str]):
+        self.complete = complete
+        self._batches: Dict[str, str] = {}
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"local-{os.path.basename(os.path.dirname(os.path.abspath(input_path)))}"
+        self._batches[batch_id] = input_path
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return "completed"
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        input_path = self._batches.get(batch_id) or os.path.join(os.path.dirname(output_path), "input.jsonl")
+        tmp_path = output_path + ".tmp"
+        with open(input_path, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                request = json.loads(line)
+                try:
+                    content = self.complete(request["body"])
+                    record = {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}},
+                        "error": None,
+                    }
+                except Exception as e:
+                    record = {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+                dst.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, output_path)
+
+
+def run_job(
+    job: BatchJob,
+    backend,
+    collect: Callable[[], Iterable[Tuple[str, Dict[str, Any], Dict[str, Any]]]],
+    write: Callable[[List[Tuple[str, Dict[str, Any], Dict[str, Any]]]], None],
+    poll_interval: float = 30.0,
+    timeout: Optional[float] = None,
+    write_chunk_size: int = 500,
+) -> Dict[str, Any]:
+    """
+    Drive a job through collect -> submit -> poll -> download -> write.
+
+    collect() yields (custom_id, chat body, metadata) for every pending request.
+    write() receives chunks of (custom_id, result, metadata) and must persist
+    them; ids it has been given are recorded so a resumed job never writes the
+    same result twice. Returns a summary with counts.
+    """
+    if job.stage is None:
+        if job.write_requests(collect()) == 0:
+            job.state["stage"] = DONE
+            job.save()
+
+    if job.stage == COLLECTED:
+        job.state["batch_id"] = backend.submit(job.input_path)
+        job.state["stage"] = SUBMITTED
+        job.save()
+
+    if job.stage == SUBMITTED:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = backend.status(job.state["batch_id"])
+            if status == "completed":
+                break
+            if status in TERMINAL_FAILURES:
+                raise RuntimeError(f"Batch {job.state['batch_id']} ended with status '{status}'")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Batch {job.state['batch_id']} still '{status}' after {timeout}s")
+            time.sleep(poll_interval)
+        backend.download(job.state["batch_id"], job.output_path)
+        job.state["stage"] = DOWNLOADED
+        job.save()
+
+    errors: Dict[str, str] = {}
+    if job.stage == DOWNLOADED:
+        results = job.read_results()
+        written = set(job.state.get("written", []))
+        pending = []
+        for custom_id, meta in job.state["requests"].items():
+            result = results.get(custom_id, {"error": "missing from batch output"})
+            if "error" in result:
+                errors[custom_id] = result["error"]
+            elif custom_id not in written:
+                pending.append((custom_id, result, meta))
+        for start in range(0, len(pending), write_chunk_size):
+            chunk = pending[start:start + write_chunk_size]
+            write(chunk)
+            job.state.setdefault("written", []).extend(custom_id for custom_id, _, _ in chunk)
+            job.save()
+        job.state["errors"] = errors
+        job.state["stage"] = DONE
+        job.save()
+
+    return {
+        "batch_id": job.state.get("batch_id"),
+        "requests": len(job.state.get("requests", {})),
+        "written": len(job.state.get("written", [])),
+        "errors": job.state.get("errors", {}),
+    }
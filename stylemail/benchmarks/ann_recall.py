@@ -0,0 +1,97 @@
+"""
+Recall@k and latency of IVF search against the exact brute-force path.
+
+Corpora are synthetic. "clustered" draws unit vectors around a few hundred
+topic directions, roughly how a user's style samples group by subject, and
+queries are perturbed copies of corpus samples. "continuous" spreads samples
+over a 48-dimensional subspace with no cluster structure, the worst case for
+IVF, and queries are random points in that subspace.
+
+    python -m stylemail.benchmarks.ann_recall
+    python -m stylemail.benchmarks.ann_recall --sizes 5000 20000 --n-probe 4 8 16 --corpus continuous
+"""
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from stylemail.ann import IVFIndex, top_k_indices
+from stylemail.vectorstore import normalize_rows
+
+
+def clustered_corpus(n: int, dim: int, queries: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    centers = normalize_rows(rng.standard_normal((max(8, n // 50), dim)).astype(np.float32))
+    noise = rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+    matrix = normalize_rows(centers[rng.integers(0, len(centers), n)] + noise)
+    picks = rng.integers(0, n, queries)
+    query_rows = normalize_rows(matrix[picks] + rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim))
+    return matrix, query_rows
+
+
+def continuous_corpus(n: int, dim: int, queries: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    basis = rng.standard_normal((48, dim)).astype(np.float32)
+    noise = 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    matrix = normalize_rows(rng.standard_normal((n, 48)).astype(np.float32) @ basis + noise)
+    query_rows = normalize_rows(rng.standard_normal((queries, 48)).astype(np.float32) @ basis)
+    return matrix, query_rows
+
+
+CORPORA = {"clustered": clustered_corpus, "continuous": continuous_corpus}
+
+
+def run(n: int, corpus: str = "clustered", dim: int = 1536, queries: int = 200, top_k: int = 3, n_probe: Optional[int] = None, seed: int = 0) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    matrix, query_rows = CORPORA[corpus](n, dim, queries, rng)
+    texts = [f"sample {i}" for i in range(n)]
+
+    started = time.perf_counter()
+    index = IVFIndex.train(matrix, n_probe=n_probe)
+    train_s = time.perf_counter() - started
+    # Store rows grouped by list, as UserVectorStore does.
+    matrix = matrix[index.order]
+    texts = [texts[i] for i in index.order]
+    index = index.grouped()
+
+    exact: List[List[int]] = []
+    started = time.perf_counter()
+    for query in query_rows:
+        exact.append(top_k_indices(matrix @ query, texts, top_k))
+    exact_ms = (time.perf_counter() - started) * 1000 / queries
+
+    approx: List[List[int]] = []
+    started = time.perf_counter()
+    for query in query_rows:
+        approx.append(index.search(matrix, texts, query, top_k))
+    ivf_ms = (time.perf_counter() - started) * 1000 / queries
+
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return {
+        "corpus": corpus,
+        "n": n,
+        "n_lists": index.n_lists,
+        "n_probe": index.n_probe,
+        f"recall@{top_k}": round(hits / (queries * top_k), 4),
+        "exact_ms": round(exact_ms, 3),
+        "ivf_ms": round(ivf_ms, 3),
+        "train_s": round(train_s, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure IVF recall@k against exact search.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--n-probe", type=int, nargs="*", default=[], help="Probe counts to try (default: the index default, ~15%% of the lists)")
+    parser.add_argument("--corpus", choices=sorted(CORPORA), nargs="+", default=sorted(CORPORA))
+    args = parser.parse_args()
+
+    for corpus in args.corpus:
+        for n in args.sizes:
+            for n_probe in args.n_probe or [None]:
+                print(json.dumps(run(n, corpus, args.dim, args.queries, args.top_k, n_probe)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Deterministic stand-in for the OpenAI HTTP API, for benchmarks and tests.
+
+Serves /v1/embeddings and /v1/chat/completions (streaming or not) on a local
+port with configurable latency. Embeddings are derived from a hash of each
+input, so the same text always gets the same vector. Chat replies are fixed
+text of a configurable length. Both report token usage like the real API. An
+optional per-minute request limit answers 429 with retry-after-ms and
+x-ratelimit-* headers.
+Point any OpenAI client at it:
+
+    with FakeOpenAIServer(FakeOpenAIConfig(chat_latency=0.2)) as fake:
+        client = OpenAI(api_key="sk-fake", base_url=fake.base_url)
+
+    python -m stylemail.benchmarks.fake_openai --port 8900 --chat-latency 0.3
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from stylemail.tokens import count_tokens
+
+
+@dataclass
+class FakeOpenAIConfig:
+    embedding_dim: int = 256
+    # Seconds per embeddings request, plus per input.
+    embedding_latency: float = 0.02
+    embedding_input_latency: float = 0.0
+    # Seconds before the first chat token, then per completion token.
+    chat_latency: float = 0.3
+    token_latency: float = 0.0
+    completion_tokens: int = 120
+    # Requests per minute per endpoint before answering 429, like an account
+    # rate limit; 0 means unlimited. Responses carry x-ratelimit-* headers.
+    requests_per_minute: int = 0
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def fake_completion(tokens: int) -> List[str]:
+    """The reply split into streamed pieces of about one token each."""
+    words = ["Thanks", " for", " the", " update", ",", " I", " will", " follow", " up", " soon", "."]
+    return ["Subject: Benchmark reply\n"] + [words[i % len(words)] for i in range(max(0, tokens - 1))]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeOpenAIServer"
+    protocol_version = "HTTP/1.1"
+    _rate_headers: Dict[str, str] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in self._rate_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        self.server.count(path)
+        allowed, self._rate_headers = self.server.take(path)
+        if not allowed:
+            self.server.count("429")
+            self._json(429, {"error": {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}})
+            return
+        if path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif path.endswith("/chat/completions"):
+            self._chat(request)
+        else:
+            self._json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _embeddings(self, request: Dict) -> None:
+        config = self.server.config
+        inputs = request.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        time.sleep(config.embedding_latency + config.embedding_input_latency * len(inputs))
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(str(text), config.embedding_dim)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(count_tokens(str(text), request.get("model", "")) for text in inputs)
+        self._json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, request: Dict) -> None:
+        config = self.server.config
+        model = request.get("model", "")
+        prompt_tokens = sum(count_tokens(str(m.get("content", "")), model) for m in request.get("messages", []))
+        pieces = fake_completion(config.completion_tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces)}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": model}
+        time.sleep(config.chat_latency)
+        if not request.get("stream"):
+            time.sleep(config.token_latency * len(pieces))
+            self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(pieces)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in self._rate_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def send(data: str) -> None:
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+        for piece in pieces:
+            time.sleep(config.token_latency)
+            send(json.dumps({**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}))
+        send(json.dumps({**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, config: Optional[FakeOpenAIConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeOpenAIConfig()
+        self.requests: Dict[str, int] = {}
+        self._counter_lock = threading.Lock()
+        # path -> [available requests, time of last refill]
+        self._buckets: Dict[str, List[float]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, path: str) -> None:
+        with self._counter_lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def take(self, path: str) -> Tuple[bool, Dict[str, str]]:
+        """Spend one request from the path's rate limit; returns (allowed, rate-limit headers)."""
+        limit = self.config.requests_per_minute
+        if not limit:
+            return True, {}
+        rate = limit / 60.0
+        with self._counter_lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(path, [float(limit), now])
+            bucket[0] = min(float(limit), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            allowed = bucket[0] >= 1
+            if allowed:
+                bucket[0] -= 1
+            available = bucket[0]
+        headers = {
+            "x-ratelimit-limit-requests": str(limit),
+            "x-ratelimit-remaining-requests": str(int(available)),
+            "x-ratelimit-reset-requests": f"{(limit - available) / rate:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after-ms"] = str(math.ceil((1 - available) / rate * 1000))
+        return allowed, headers
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI API until interrupted.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Answer 429 beyond this rate per endpoint")
+    args = parser.parse_args()
+    config = FakeOpenAIConfig(
+        embedding_dim=args.embedding_dim,
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        completion_tokens=args.completion_tokens,
+        requests_per_minute=args.requests_per_minute,
+    )
+    server = FakeOpenAIServer(config, port=args.port)
+    print(f"Fake OpenAI API on {server.base_url} (OPENAI_BASE_URL={server.base_url})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
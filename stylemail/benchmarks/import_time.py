@@ -0,0 +1,86 @@
+"""
+Cold import cost of stylemail entry points, measured with `python -X importtime`.
+
+Each target is imported in a fresh interpreter. The report gives the total
+cumulative import time, the slowest modules by self time and which heavy
+dependencies (numpy, openai, redis, ...) the import pulled in.
+
+    python -m stylemail.benchmarks.import_time
+    python -m stylemail.benchmarks.import_time --targets stylemail stylemail.api --runs 5 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+DEFAULT_TARGETS = ["stylemail", "stylemail.config", "stylemail.cli", "stylemail.api", "stylemail.async_api"]
+HEAVY_MODULES = ["numpy", "openai", "httpx", "redis", "tiktoken", "langchain_community", "sqlalchemy"]
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    (module, self_us, cumulative_us) for every line of -X importtime output.
+    Module names keep their indentation, which gives the nesting depth.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(target: str) -> List[Tuple[str, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {target} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr)
+
+
+def report(target: str, runs: int = 3, top: int = 5) -> Dict:
+    samples = [measure(target) for _ in range(runs)]
+    rows = samples[-1]
+    modules = {name.strip() for name, _, _ in rows}
+    # Cumulative times of top-level imports add up to the whole import.
+    totals = [sum(c for name, _, c in sample if name == name.lstrip()) for sample in samples]
+    return {
+        "target": target,
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "modules": len(rows),
+        "heavy": [m for m in HEAVY_MODULES if m in modules],
+        "slowest": [
+            {"module": name.strip(), "self_ms": round(s / 1000, 1)}
+            for name, s, _ in sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+        ],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS)
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per target; the median is reported")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per target")
+    args = parser.parse_args()
+
+    for target in args.targets:
+        result = report(target, runs=args.runs)
+        if args.json:
+            print(json.dumps(result))
+            continue
+        print(f"{target:<22} {result['total_ms']:>8.1f} ms  {result['modules']:>4} modules  heavy: {', '.join(result['heavy']) or '-'}")
+        for row in result["slowest"]:
+            print(f"    {row['module']:<40} {row['self_ms']:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
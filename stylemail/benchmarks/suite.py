@@ -0,0 +1,363 @@
+"""
+Offline end-to-end benchmarks: no OpenAI account, Redis or Postgres needed.
+
+OpenAI is replaced by the local FakeOpenAIServer (fixed latency, hashed
+embeddings), Redis by fakeredis and Postgres by a temporary SQLite file.
+Scenarios:
+
+    seed         samples/s of StyleSeeder, and the cost of re-seeding the same samples
+    generate     /generate latency (p50/p99) and throughput at each concurrency level
+    retrieval    store, load and query time for users with 10, 1k and 100k samples
+    nudge_batch  emails/s of /nudge-email/batch
+
+The result is one JSON document, so two runs can be diffed:
+
+    python -m stylemail.benchmarks.suite --output before.json
+    python -m stylemail.benchmarks.suite --scenarios generate --concurrency 1 16 64 --chat-latency 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from stylemail.benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SCENARIOS = ["seed", "generate", "retrieval", "nudge_batch"]
+WORDS = (
+    "thanks team update project deadline review meeting quarter budget client follow "
+    "up please note schedule draft proposal feedback results numbers next week friday"
+).split()
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    """count plus mean/p50/p90/p99/max in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def synthetic_samples(n: int, seed: int = 0, words: int = 40) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [f"Sample {i}: " + " ".join(rng.choice(WORDS, words)) for i in range(n)]
+
+
+def _sync_store(**kwargs):
+    import fakeredis
+    from stylemail.cache import UserMatrixCache
+    from stylemail.vectorstore import UserVectorStore
+    return UserVectorStore(redis_client=fakeredis.FakeRedis(), matrix_cache=UserMatrixCache(max_bytes=1 << 30), **kwargs)
+
+
+def _fake_config(openai_base_url: str):
+    from stylemail.config import Config
+    return Config(openai_api_key="sk-fake", redis_host=None, redis_port=None, redis_db=None, redis_password=None, openai_base_url=openai_base_url)
+
+
+def scenario_seed(fake: FakeOpenAIServer, samples: int = 2000) -> Dict:
+    from stylemail.clients import ClientRegistry
+    from stylemail.seeder import StyleSeeder
+
+    store = _sync_store()
+    clients = ClientRegistry(_fake_config(fake.base_url))
+    seeder = StyleSeeder("sk-fake", store, client=clients.openai)
+    texts = synthetic_samples(samples)
+    before = fake.requests.get("/v1/embeddings", 0)
+
+    start = time.perf_counter()
+    stored = seeder.seed_user_style("bench_seed", texts)
+    seconds = time.perf_counter() - start
+    requests = fake.requests.get("/v1/embeddings", 0) - before
+
+    start = time.perf_counter()
+    reseeded = seeder.seed_user_style("bench_seed", texts)
+    reseed_seconds = time.perf_counter() - start
+    clients.close()
+    return {
+        "samples": samples,
+        "stored": stored,
+        "seconds": round(seconds, 3),
+        "samples_per_second": round(samples / seconds, 1),
+        "embedding_requests": requests,
+        "reseed_stored": reseeded,
+        "reseed_seconds": round(reseed_seconds, 3),
+    }
+
+
+def _timed(fn, repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def scenario_retrieval(sizes: Sequence[int] = (10, 1000, 100_000), dim: int = 256, queries: int = 200, top_k: int = 3) -> Dict:
+    from stylemail.cache import UserMatrixCache
+    from stylemail.generator import rank_style_context
+    from stylemail.vectorstore import normalize_rows
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for n in sizes:
+        store = _sync_store()
+        start = time.perf_counter()
+        for offset in range(0, n, 5000):
+            count = min(5000, n - offset)
+            vectors = normalize_rows(rng.standard_normal((count, dim)).astype(np.float32))
+            store.store_embeddings("bench_retrieval", [f"Sample {offset + i}" for i in range(count)], vectors)
+        store_seconds = time.perf_counter() - start
+
+        # The first load decodes the matrix and, above the ANN threshold,
+        # trains and saves the IVF index; the second only decodes both.
+        start = time.perf_counter()
+        store.get_search_index("bench_retrieval")
+        first_load = time.perf_counter() - start
+        store.matrix_cache = UserMatrixCache(max_bytes=1 << 30)
+        start = time.perf_counter()
+        texts, matrix, index = store.get_search_index("bench_retrieval")
+        reload = time.perf_counter() - start
+
+        query_rows = normalize_rows(rng.standard_normal((queries, dim)).astype(np.float32))
+        rows = iter(np.tile(query_rows, (3, 1)))
+        results[str(n)] = {
+            "store_seconds": round(store_seconds, 3),
+            "first_load_ms": round(first_load * 1000, 2),
+            "reload_ms": round(reload * 1000, 2),
+            "ann_index": index is not None,
+            "cached_load": latency_summary(_timed(lambda: store.get_search_index("bench_retrieval"), queries)),
+            "exact": latency_summary(_timed(lambda: rank_style_context(texts, matrix, next(rows), top_k), queries)),
+            "indexed": latency_summary(_timed(lambda: rank_style_context(texts, matrix, next(rows), top_k, index=index), queries)),
+            "mmr": latency_summary(_timed(lambda: rank_style_context(texts, matrix, next(rows), top_k, index=index, mmr_lambda=0.5), queries)),
+        }
+    return results
+
+
+def load_server():
+    """
+    Import server.py with database.py pointed at a temporary SQLite file
+    (unless DATABASE_URL is already set) and create its tables.
+    """
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="stylemail-bench-"), "bench.db")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    # database.py reports on stdout, which carries the JSON report.
+    with contextlib.redirect_stdout(sys.stderr):
+        import database
+        import server
+        database.init_db()
+    return server, database
+
+
+def install_server_state(server, openai_base_url: str) -> None:
+    """What server.lifespan sets up, with fakeredis and a fake OpenAI API."""
+    import fakeredis
+    from stylemail.async_vectorstore import AsyncUserVectorStore
+    from stylemail.cache import AsyncEmbeddingCache, UserMatrixCache
+    from stylemail.clients import ClientRegistry
+    from stylemail.concurrency import AsyncRequestCoalescer
+
+    server.config = _fake_config(openai_base_url)
+    server.clients = ClientRegistry(server.config)
+    server.store = AsyncUserVectorStore(redis_client=fakeredis.FakeAsyncRedis(), matrix_cache=UserMatrixCache())
+    server.embedding_cache = AsyncEmbeddingCache(server.store.redis, namespace=server.store.namespace)
+    server.response_cache = None
+    server.coalescer = AsyncRequestCoalescer(server.store.redis, namespace=server.store.namespace)
+
+
+async def _post_all(client, path: str, bodies: List[Dict], concurrency: int) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def post(body: Dict) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(post(body) for body in bodies))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": len(bodies),
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "requests_per_second": round(len(bodies) / wall, 1),
+        "latency": latency_summary(latencies),
+    }
+
+
+def scenario_generate(fake: FakeOpenAIServer, concurrency: Sequence[int] = (1, 8, 32), requests: int = 100, samples: int = 200) -> Dict:
+    import httpx
+    server, _ = load_server()
+
+    async def run() -> Dict:
+        install_server_state(server, fake.base_url)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            response = await client.post("/seed", json={"user_id": "bench_generate", "samples": synthetic_samples(samples)})
+            response.raise_for_status()
+            levels = []
+            for c in concurrency:
+                # Distinct prompts, so every request embeds and calls chat.
+                bodies = [
+                    {"user_id": "bench_generate", "subject": "Status", "prompt": f"Level {c} request {i}: " + " ".join(WORDS[i % 7:i % 7 + 12])}
+                    for i in range(requests)
+                ]
+                levels.append(await _post_all(client, "/generate", bodies, c))
+        await server.clients.aclose()
+        return {"samples": samples, "levels": levels}
+
+    return asyncio.run(run())
+
+
+def scenario_nudge_batch(fake: FakeOpenAIServer, employees: int = 100, nudges_per_employee: int = 5, concurrency: Sequence[int] = (8, 32)) -> Dict:
+    import httpx
+    server, database = load_server()
+
+    # Fresh ids per run, so an existing DATABASE_URL can be reused.
+    prefix = f"bench_{int(time.time() * 1000)}"
+    employee_ids = [f"{prefix}_{i}" for i in range(employees)]
+    db = database.SessionLocal()
+    try:
+        for i, employee_id in enumerate(employee_ids):
+            db.add(database.Employee(id=employee_id, name=f"Employee {i}", email=f"{employee_id}@example.com"))
+            for j in range(nudges_per_employee):
+                db.add(database.Nudge(
+                    employee_id=employee_id,
+                    nudge_type="performance",
+                    title=f"Metric {j} below target",
+                    message=f"Score {j} dropped this week",
+                    metric_name=f"metric_{j}",
+                    metric_value=float(j),
+                ))
+        db.commit()
+    finally:
+        db.close()
+
+    async def run() -> Dict:
+        install_server_state(server, fake.base_url)
+        transport = httpx.ASGITransport(app=server.app)
+        levels = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            response = await client.post("/seed", json={"user_id": "bench_nudge", "samples": synthetic_samples(50)})
+            response.raise_for_status()
+            for c in concurrency:
+                body = {"user_id": "bench_nudge", "prompt": "Send a friendly nudge", "employee_ids": employee_ids, "max_concurrency": c}
+                start = time.perf_counter()
+                response = await client.post("/nudge-email/batch", json=body)
+                seconds = time.perf_counter() - start
+                results = response.json().get("results", []) if response.status_code == 200 else []
+                emails = sum("error" not in r for r in results)
+                levels.append({
+                    "max_concurrency": c,
+                    "status": response.status_code,
+                    "emails": emails,
+                    "errors": employees - emails,
+                    "seconds": round(seconds, 3),
+                    "emails_per_second": round(emails / seconds, 1),
+                })
+        await server.clients.aclose()
+        return {"employees": employees, "nudges_per_employee": nudges_per_employee, "levels": levels}
+
+    return asyncio.run(run())
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run_suite(scenarios: Sequence[str], fake_config: FakeOpenAIConfig, args: argparse.Namespace) -> Dict:
+    results: Dict[str, Dict] = {}
+    with FakeOpenAIServer(fake_config) as fake:
+        for name in scenarios:
+            start = time.perf_counter()
+            if name == "seed":
+                results[name] = scenario_seed(fake, samples=args.seed_samples)
+            elif name == "generate":
+                results[name] = scenario_generate(fake, concurrency=args.concurrency, requests=args.requests, samples=args.generate_samples)
+            elif name == "retrieval":
+                results[name] = scenario_retrieval(sizes=args.retrieval_sizes, dim=fake_config.embedding_dim, queries=args.queries)
+            elif name == "nudge_batch":
+                results[name] = scenario_nudge_batch(fake, employees=args.employees, nudges_per_employee=args.nudges, concurrency=args.batch_concurrency)
+            print(f"[bench] {name} finished in {time.perf_counter() - start:.1f}s", file=sys.stderr, flush=True)
+        openai_requests = dict(fake.requests)
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "fake_openai": vars(fake_config),
+            "openai_requests": openai_requests,
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--seed-samples", type=int, default=2000)
+    parser.add_argument("--generate-samples", type=int, default=200, help="Style samples of the /generate user")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="/generate concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="/generate requests per concurrency level")
+    parser.add_argument("--retrieval-sizes", type=int, nargs="+", default=[10, 1000, 100_000])
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per retrieval size")
+    parser.add_argument("--employees", type=int, default=100)
+    parser.add_argument("--nudges", type=int, default=5, help="Active nudges per employee")
+    parser.add_argument("--batch-concurrency", type=int, nargs="+", default=[8, 32])
+    args = parser.parse_args()
+
+    fake_config = FakeOpenAIConfig(
+        embedding_dim=args.embedding_dim,
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        completion_tokens=args.completion_tokens,
+    )
+    report = json.dumps(run_suite(args.scenarios, fake_config, args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
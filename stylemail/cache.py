@@ -0,0 +1,393 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from redis.exceptions import RedisError
+
+
+@dataclass
+class CachedMatrix:
+    version: int
+    texts: List[str]
+    matrix: np.ndarray
+    nbytes: int
+    index: Optional[Any] = None  # stylemail.ann.IVFIndex for large corpora
+
+
+class UserMatrixCache:
+    """
+    In-process LRU of per-user normalized embedding matrices, bounded by the
+    approximate number of bytes held (matrix data plus sample texts).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        # Bumped on every invalidation so a loader can tell whether the user
+        # changed while it was reading from Redis.
+        self.generation = 0
+        self._entries: "OrderedDict[str, CachedMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[CachedMatrix]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id: str, version: int, texts: List[str], matrix: np.ndarray, generation: Optional[int] = None, index=None) -> None:
+        matrix.flags.writeable = False
+        nbytes = matrix.nbytes + sum(len(t) for t in texts) + (index.nbytes if index is not None else 0)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if nbytes > self.max_bytes:
+                return
+            self._pop(user_id)
+            self._entries[user_id] = CachedMatrix(version, texts, matrix, nbytes, index)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._pop(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _pop(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.current_bytes -= entry.nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by sha256(model + text).
+
+    Lookups go to a local LRU first (L1, with its own TTL), then to Redis (L2),
+    where vectors are stored as packed float32 with an expiry. Misses are
+    fetched in one batch and written back to both levels. Redis is only a
+    cache here: if it fails, reads count as misses and writes are skipped.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        namespace: str = "style_mail_vector",
+        ttl_seconds: int = 7 * 24 * 3600,
+        max_local_entries: int = 4096,
+        local_ttl_seconds: int = 3600,
+    ):
+        self.redis = redis_client
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_local_entries = max_local_entries
+        self.local_ttl_seconds = local_ttl_seconds
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, model: str, text: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}emb:{digest}"
+
+    def _get_local(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires_at, embedding = item
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return embedding
+
+    def _put_local(self, key: str, embedding: np.ndarray) -> None:
+        embedding.flags.writeable = False
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.local_ttl_seconds, embedding)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys, results, remote_idx = self._lookup_local(model, texts)
+        if remote_idx:
+            try:
+                raw = self.redis.mget([keys[i] for i in remote_idx])
+            except RedisError as e:
+                raw = self._remote_failed("read", remote_idx, e)
+            self._apply_remote(keys, results, remote_idx, raw)
+        return results
+
+    @staticmethod
+    def _remote_failed(action: str, items: Sequence, error: Exception) -> List[None]:
+        logging.warning(f"[embedding_cache] Redis {action} of {len(items)} embeddings failed: {error}")
+        return [None] * len(items)
+
+    def _lookup_local(self, model: str, texts: Sequence[str]):
+        keys = [self._key(model, t) for t in texts]
+        results: List[Optional[np.ndarray]] = [self._get_local(k) for k in keys]
+        remote_idx = [i for i, r in enumerate(results) if r is None]
+        with self._lock:
+            self.hits_local += len(keys) - len(remote_idx)
+        return keys, results, remote_idx
+
+    def _apply_remote(self, keys: List[str], results: List[Optional[np.ndarray]], remote_idx: List[int], raw: List[Optional[bytes]]) -> None:
+        hits_redis = 0
+        for i, value in zip(remote_idx, raw):
+            if value is not None:
+                embedding = np.frombuffer(value, dtype="<f4")
+                self._put_local(keys[i], embedding)
+                results[i] = embedding
+                hits_redis += 1
+        with self._lock:
+            self.hits_redis += hits_redis
+            self.misses += len(remote_idx) - hits_redis
+
+    def _queue_put(self, pipe, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        for text, embedding in zip(texts, embeddings):
+            key = self._key(model, text)
+            packed = np.asarray(embedding, dtype="<f4")
+            pipe.set(key, packed.tobytes(), ex=self.ttl_seconds)
+            self._put_local(key, packed)
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_put(pipe, model, texts, embeddings)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            self._remote_failed("write", texts, e)
+
+    @staticmethod
+    def _missing(texts: Sequence[str], results: List[Optional[np.ndarray]]) -> List[str]:
+        return list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+
+    @staticmethod
+    def _merge(texts: Sequence[str], results: List[Optional[np.ndarray]], missing: List[str], fetched) -> List[np.ndarray]:
+        by_text = {t: np.asarray(e, dtype="<f4") for t, e in zip(missing, fetched)}
+        return [r if r is not None else by_text[t] for t, r in zip(texts, results)]
+
+    def embed(self, model: str, texts: Sequence[str], fetch: Callable[[List[str]], List[List[float]]]) -> List[np.ndarray]:
+        """
+        Return embeddings for texts, calling fetch only for the ones not cached.
+        Duplicate texts within one call are fetched once.
+        """
+        results = self.get_many(model, texts)
+        missing = self._missing(texts, results)
+        if not missing:
+            return results
+        fetched = fetch(missing)
+        self.put_many(model, missing, fetched)
+        return self._merge(texts, results, missing, fetched)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits_local": self.hits_local,
+                "hits_redis": self.hits_redis,
+                "misses": self.misses,
+                "local_entries": len(self._local),
+            }
+
+
+class AsyncEmbeddingCache(EmbeddingCache):
+    """
+    EmbeddingCache over a redis.asyncio client. The local level and counters
+    behave exactly as in the sync cache.
+    """
+
+    async def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys, results, remote_idx = self._lookup_local(model, texts)
+        if remote_idx:
+            try:
+                raw = await self.redis.mget([keys[i] for i in remote_idx])
+            except RedisError as e:
+                raw = self._remote_failed("read", remote_idx, e)
+            self._apply_remote(keys, results, remote_idx, raw)
+        return results
+
+    async def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_put(pipe, model, texts, embeddings)
+        try:
+            await pipe.execute()
+        except RedisError as e:
+            self._remote_failed("write", texts, e)
+
+    async def embed(self, model: str, texts: Sequence[str], fetch: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[np.ndarray]:
+        results = await self.get_many(model, texts)
+        missing = self._missing(texts, results)
+        if not missing:
+            return results
+        fetched = await fetch(missing)
+        await self.put_many(model, missing, fetched)
+        return self._merge(texts, results, missing, fetched)
+
+
+class ResponseCache:
+    """
+    Per-user semantic cache of generated emails. A request whose prompt
+    embedding has cosine similarity >= threshold with an earlier request by
+    the same user gets that request's result back without a chat call.
+
+    Each user has three Redis keys: a hash of normalized float32 prompt
+    embeddings, a hash of JSON results and a sorted set of entry ids scored by
+    creation time. Entries older than ttl_seconds are ignored and pruned, and
+    only the newest max_entries_per_user are kept.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        namespace: str = "style_mail_vector",
+        threshold: float = 0.95,
+        ttl_seconds: int = 24 * 3600,
+        max_entries_per_user: int = 50,
+    ):
+        self.redis = redis_client
+        self.namespace = namespace
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_user = max_entries_per_user
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _keys(self, user_id: str) -> Tuple[str, str, str]:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        base = f"{prefix}resp:{user_id}"
+        return f"{base}:vectors", f"{base}:entries", f"{base}:order"
+
+    @staticmethod
+    def _entry_id(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _queue_candidates(self, pipe, user_id: str) -> None:
+        vectors_key, _, order_key = self._keys(user_id)
+        pipe.zrangebyscore(order_key, time.time() - self.ttl_seconds, "+inf")
+        pipe.hgetall(vectors_key)
+
+    def _best_match(self, live_ids: List[bytes], vectors: Dict[bytes, bytes], embedding: Sequence[float]) -> Optional[bytes]:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        ids = [i for i in live_ids if i in vectors and len(vectors[i]) == query.nbytes]
+        if not ids or norm == 0:
+            self._count(hit=False)
+            return None
+        matrix = np.vstack([np.frombuffer(vectors[i], dtype="<f4") for i in ids])
+        scores = matrix @ (query / norm)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self._count(hit=False)
+            return None
+        return ids[best]
+
+    def _decode_hit(self, raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        # The entry can vanish between the two round trips if it was pruned.
+        self._count(hit=raw is not None)
+        return json.loads(raw) if raw is not None else None
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _queue_put(self, pipe, user_id: str, text: str, embedding: Sequence[float], result: Dict[str, Any]) -> None:
+        vectors_key, entries_key, order_key = self._keys(user_id)
+        entry_id = self._entry_id(text)
+        query = np.asarray(embedding, dtype=np.float32)
+        normalized = (query / (np.linalg.norm(query) or 1.0)).astype("<f4")
+        pipe.hset(vectors_key, entry_id, normalized.tobytes())
+        pipe.hset(entries_key, entry_id, json.dumps(result))
+        pipe.zadd(order_key, {entry_id: time.time()})
+        for key in (vectors_key, entries_key, order_key):
+            pipe.expire(key, self.ttl_seconds)
+        pipe.zrange(order_key, 0, -1, withscores=True)
+
+    def _queue_prune(self, pipe, user_id: str, ordered: List[Tuple[bytes, float]]) -> bool:
+        """Queue removal of expired entries and of the oldest ones over the limit."""
+        cutoff = time.time() - self.ttl_seconds
+        stale = [entry_id for entry_id, score in ordered if score < cutoff]
+        live = len(ordered) - len(stale)
+        if live > self.max_entries_per_user:
+            stale += [entry_id for entry_id, score in ordered if score >= cutoff][:live - self.max_entries_per_user]
+        if not stale:
+            return False
+        vectors_key, entries_key, order_key = self._keys(user_id)
+        pipe.hdel(vectors_key, *stale)
+        pipe.hdel(entries_key, *stale)
+        pipe.zrem(order_key, *stale)
+        return True
+
+    def lookup(self, user_id: str, embedding: Sequence[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached result closest to embedding, if it clears the threshold."""
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_candidates(pipe, user_id)
+        live_ids, vectors = pipe.execute()
+        entry_id = self._best_match(live_ids, vectors, embedding)
+        if entry_id is None:
+            return None
+        return self._decode_hit(self.redis.hget(self._keys(user_id)[1], entry_id))
+
+    def put(self, user_id: str, text: str, embedding: Sequence[float], result: Dict[str, Any]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_put(pipe, user_id, text, embedding, result)
+        ordered = pipe.execute()[-1]
+        pipe = self.redis.pipeline(transaction=False)
+        if self._queue_prune(pipe, user_id, ordered):
+            pipe.execute()
+
+    def invalidate(self, user_id: str) -> None:
+        self.redis.delete(*self._keys(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class AsyncResponseCache(ResponseCache):
+    """ResponseCache over a redis.asyncio client."""
+
+    async def lookup(self, user_id: str, embedding: Sequence[float]) -> Optional[Dict[str, Any]]:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_candidates(pipe, user_id)
+        live_ids, vectors = await pipe.execute()
+        entry_id = self._best_match(live_ids, vectors, embedding)
+        if entry_id is None:
+            return None
+        return self._decode_hit(await self.redis.hget(self._keys(user_id)[1], entry_id))
+
+    async def put(self, user_id: str, text: str, embedding: Sequence[float], result: Dict[str, Any]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_put(pipe, user_id, text, embedding, result)
+        ordered = (await pipe.execute())[-1]
+        pipe = self.redis.pipeline(transaction=False)
+        if self._queue_prune(pipe, user_id, ordered):
+            await pipe.execute()
+
+    async def invalidate(self, user_id: str) -> None:
+        await self.redis.delete(*self._keys(user_id))
@@ -1,14 +1,59 @@
+import argparse
 import sys
 import os
-from .api import seed_user_style, generate_email, generate_nudge_email, generate_nudge_summary
-from .vectorstore import UserVectorStore
+from .config import Config
+from .ingest import FORMATS, import_corpus
+
+# numpy, redis and openai are imported by the commands that use them, so the
+# usage text and argument errors come back without loading them.
+
+
+def serve():
+    """Run the NDJSON worker over stdin/stdout, or a Unix socket with --socket PATH."""
+    from .cache import EmbeddingCache, UserMatrixCache
+    from .clients import ClientRegistry
+    from .vectorstore import UserVectorStore
+    from .worker import Worker, api_handlers
+
+    parser = argparse.ArgumentParser(prog="cli.py serve")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--max-workers", type=int, default=8, help="Requests handled concurrently")
+    args = parser.parse_args(sys.argv[2:])
+
+    config = Config(
+        openai_api_key=os.getenv("OPENAI_API_KEY", ""),
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_port=int(os.getenv("REDIS_PORT", 6379)),
+        redis_db=int(os.getenv("REDIS_DB", 0)),
+        redis_password=os.getenv("REDIS_PASSWORD", ""),
+    )
+    clients = ClientRegistry(config)
+    store = UserVectorStore(redis_client=clients.redis(), matrix_cache=UserMatrixCache())
+    store.start_invalidation_listener()
+    embedding_cache = EmbeddingCache(store.redis, namespace=store.namespace)
+    worker = Worker(api_handlers(store, config.openai_api_key, clients=clients, embedding_cache=embedding_cache), max_workers=args.max_workers)
+    try:
+        if args.socket:
+            worker.serve_unix(args.socket)
+        else:
+            worker.serve_stdio()
+    finally:
+        store.stop_invalidation_listener()
+        clients.close()
 
 
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        serve()
+        return
+
     if len(sys.argv) < 3:
         print("Usage:")
         print("  python cli.py seed <user_id> <sample1> [<sample2> ...]")
         print("  python cli.py generate <user_id> <subject> <prompt>")
+        print("  python cli.py migrate <user_id|--all>")
+        print("  python cli.py import <user_id> <path> [--format mbox|eml|jsonl] [--sender ADDRESS] [--field NAME] [--batch-size N]")
+        print("  python cli.py serve [--socket PATH] [--max-workers N]")
         sys.exit(1)
 
     command = sys.argv[1]
@@ -23,6 +68,7 @@ def main():
     auth_part = f":{redis_password}@" if redis_password else ""
     redis_url = f"redis://{auth_part}{redis_host}:{redis_port}/{redis_db}"
 
+    from .vectorstore import UserVectorStore
     store = UserVectorStore(
         redis_url=redis_url,
         host=redis_host,
@@ -36,6 +82,7 @@ def main():
         if not samples:
             print("Please provide at least one writing sample.")
             sys.exit(1)
+        from .api import seed_user_style
         seed_user_style(user_id, samples, store=store, openai_api_key=openai_api_key)
         print(f"Seeded style for user '{user_id}' with {len(samples)} samples.")
     elif command == "generate":
@@ -44,6 +91,7 @@ def main():
             sys.exit(1)
         subject = sys.argv[3]
         prompt = " ".join(sys.argv[4:])
+        from .api import generate_email
         result = generate_email(user_id, subject, prompt, store=store, openai_api_key=openai_api_key)
         print("Generated Email:")
         print("Subject:", result["subject"])
@@ -54,6 +102,7 @@ def main():
             sys.exit(1)
         prompt = sys.argv[3]
         nudges = sys.argv[4:]
+        from .api import generate_nudge_email, generate_nudge_summary
         if command == "nudge":
             result = generate_nudge_summary(user_id, prompt, nudges, store=store, openai_api_key=openai_api_key)
             print("Generated Nudge Summary:")
@@ -71,12 +120,39 @@ def main():
             sys.exit(1)
         prompt = sys.argv[3]
         nudges = sys.argv[4:]
+        from .api import generate_nudge_email
         result = generate_nudge_email(user_id, prompt, nudges, store=store, openai_api_key=openai_api_key)
         print("Generated Nudge Email:")
         print("Subject:", result["subject"])
         print("Body:\n", result["body"])
         store.clear_user_data(user_id)
         print(f"Cleared all cached embeddings for user '{user_id}'.")
+    elif command == "import":
+        parser = argparse.ArgumentParser(prog="cli.py import")
+        parser.add_argument("path", help="mbox file, directory of .eml files, or JSONL file")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to a guess from the path")
+        parser.add_argument("--sender", help="Only import messages sent from this address")
+        parser.add_argument("--field", default="body", help="JSONL key holding the message text")
+        parser.add_argument("--batch-size", type=int, default=500)
+        args = parser.parse_args(sys.argv[3:])
+        from .seeder import StyleSeeder
+        seeder = StyleSeeder(openai_api_key, store)
+
+        def report(stats):
+            print(f"... {stats.summary()}", flush=True)
+
+        stats = import_corpus(
+            seeder, user_id, args.path,
+            fmt=args.format, sender=args.sender, field_name=args.field,
+            batch_size=args.batch_size, progress=report,
+        )
+        print(f"Imported style for user '{user_id}': {stats.summary()}")
+    elif command == "migrate":
+        if user_id == "--all":
+            migrated = store.migrate_all()
+        else:
+            migrated = store.migrate_user(user_id)
+        print(f"Migrated {migrated} legacy embeddings to packed float32 format.")
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
@@ -0,0 +1,92 @@
+import httpx
+import redis
+import redis.asyncio as aioredis
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from typing import Optional
+from stylemail.config import Config
+
+
+class ClientRegistry:
+    """
+    Long-lived OpenAI and Redis clients shared across requests, so connections
+    (and their TLS sessions) are reused instead of rebuilt per call.
+
+    Clients are created lazily on first access; close()/aclose() release them.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._openai: Optional[OpenAI] = None
+        self._async_openai: Optional[AsyncOpenAI] = None
+        self._redis_pool: Optional[redis.ConnectionPool] = None
+        self._async_redis_pool: Optional[aioredis.ConnectionPool] = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.config.http_max_connections,
+            max_keepalive_connections=self.config.http_max_keepalive_connections,
+            keepalive_expiry=self.config.http_keepalive_expiry,
+        )
+
+    def _redis_kwargs(self) -> dict:
+        kwargs = {
+            "host": self.config.redis_host or "localhost",
+            "port": int(self.config.redis_port or 6379),
+            "password": self.config.redis_password or None,
+            "max_connections": self.config.redis_max_connections,
+        }
+        if self.config.redis_db is not None:
+            kwargs["db"] = self.config.redis_db
+        return kwargs
+
+    @property
+    def openai(self) -> OpenAI:
+        if self._openai is None:
+            self._openai = OpenAI(
+                api_key=self.config.openai_api_key,
+                base_url=self.config.openai_base_url,
+                timeout=self.config.http_timeout,
+                # Retries are done by stylemail.upstream, with pacing and a retry budget.
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=self._limits()),
+            )
+        return self._openai
+
+    @property
+    def async_openai(self) -> AsyncOpenAI:
+        if self._async_openai is None:
+            self._async_openai = AsyncOpenAI(
+                api_key=self.config.openai_api_key,
+                base_url=self.config.openai_base_url,
+                timeout=self.config.http_timeout,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=self._limits()),
+            )
+        return self._async_openai
+
+    def redis(self) -> redis.Redis:
+        if self._redis_pool is None:
+            self._redis_pool = redis.ConnectionPool(**self._redis_kwargs())
+        return redis.Redis(connection_pool=self._redis_pool)
+
+    def async_redis(self) -> aioredis.Redis:
+        if self._async_redis_pool is None:
+            self._async_redis_pool = aioredis.ConnectionPool(**self._redis_kwargs())
+        return aioredis.Redis(connection_pool=self._async_redis_pool)
+
+    def close(self) -> None:
+        if self._openai is not None:
+            self._openai.close()
+            self._openai = None
+        if self._redis_pool is not None:
+            self._redis_pool.disconnect()
+            self._redis_pool = None
+
+    async def aclose(self) -> None:
+        if self._async_openai is not None:
+            await self._async_openai.close()
+            self._async_openai = None
+        if self._async_redis_pool is not None:
+            await self._async_redis_pool.disconnect()
+            self._async_redis_pool = None
+        self.close()
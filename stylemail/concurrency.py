@@ -0,0 +1,245 @@
+"""
+Limits on upstream LLM work.
+
+AsyncRequestCoalescer runs one computation per key at a time ("single
+flight"). Concurrent callers in the same process share the leader's result.
+With Redis and cross_worker=True, callers in other workers wait on the
+leader's lock and then run the computation themselves, which finds what the
+leader stored (a nudge summary row, say) instead of calling the LLM again.
+Computations that do not reuse stored results pass cross_worker=False: a
+follower would call the LLM anyway, so waiting for the lock only delays it.
+
+LLM_LIMITER caps the OpenAI calls in flight per process at
+LLM_MAX_CONCURRENCY (default 32, 0 turns the cap off), counting coroutines
+on every event loop and threads together; further calls queue for a slot.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+from redis.exceptions import WatchError
+from stylemail.metrics import REGISTRY, span
+
+T = TypeVar("T")
+
+COALESCED = REGISTRY.counter(
+    "stylemail_coalesced_requests_total",
+    "Requests by single-flight role: leader, shared (joined an in-process flight) or waited (on another worker's lock).",
+    ["role"],
+)
+
+
+class AsyncRequestCoalescer:
+    def __init__(self, redis_client=None, namespace: str = "style_mail_vector", lock_ttl: float = 120.0, wait_timeout: float = 90.0, poll_interval: float = 0.05):
+        """
+        Args:
+            redis_client: Async Redis client for the cross-worker lock; None
+                coalesces within this process only.
+            lock_ttl (float): Seconds before a lock left by a crashed worker expires.
+            wait_timeout (float): Seconds to wait for another worker's lock
+                before computing anyway.
+        """
+        self.redis = redis_client
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[T]], cross_worker: bool = True) -> T:
+        """
+        Result of compute(), shared with every caller in this process that asks
+        for key while it runs. cross_worker=False skips the Redis lock.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            COALESCED.inc(role="shared")
+            return await asyncio.shield(flight)
+
+        COALESCED.inc(role="leader")
+        flight = asyncio.ensure_future(self._run_locked(key, compute) if cross_worker else compute())
+        self._flights[key] = flight
+        flight.add_done_callback(lambda f: self._finish(key, f))
+        # Shielded, so a caller that disconnects doesn't cancel the others' result.
+        return await asyncio.shield(flight)
+
+    def _finish(self, key: str, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            flight.exception()  # Retrieved even if every caller went away
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def _run_locked(self, key: str, compute: Callable[[], Awaitable[T]]) -> T:
+        if self.redis is None:
+            return await compute()
+        lock_key = f"{self.namespace}:lock:{key}"
+        token = await self._acquire(lock_key)
+        try:
+            return await compute()
+        finally:
+            if token:
+                await self._release(lock_key, token)
+
+    async def _acquire(self, lock_key: str) -> Optional[str]:
+        """
+        Take the lock, waiting while another worker holds it. Returns None when
+        Redis fails or the wait times out; the caller then computes unlocked.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        try:
+            while not await self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)):
+                if not waited:
+                    COALESCED.inc(role="waited")
+                    waited = True
+                if time.monotonic() >= deadline:
+                    logging.warning(f"[coalesce] Gave up waiting for {lock_key} after {self.wait_timeout}s")
+                    return None
+                await asyncio.sleep(self.poll_interval)
+        except Exception as e:
+            logging.warning(f"[coalesce] Redis lock {lock_key} unavailable: {e}")
+            return None
+        return token
+
+    async def _release(self, lock_key: str, token: str) -> None:
+        """Delete the lock only if it is still ours (it may have expired and been retaken)."""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(lock_key)
+                current = await pipe.get(lock_key)
+                if current is None or current.decode() != token:
+                    await pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.delete(lock_key)
+                await pipe.execute()
+        except WatchError:
+            pass
+        except Exception as e:
+            logging.warning(f"[coalesce] Releasing {lock_key} failed: {e}")
+
+
+class LLMLimiter:
+    """
+    Caps concurrent upstream LLM calls with one budget for the whole process:
+    slot() is for coroutines on any event loop and hold() for threads, and
+    both draw on the same slots. Waiters are served first come, first served.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self._free = limit or 0
+        # A waiter is (loop, future) for a coroutine or (None, event) for a thread.
+        self._waiters: "deque[Tuple[Optional[asyncio.AbstractEventLoop], Any]]" = deque()
+        self._lock = threading.Lock()
+
+    def _adjust(self, in_flight: int = 0, waiting: int = 0) -> None:
+        with self._lock:
+            self.in_flight += in_flight
+            self.waiting += waiting
+
+    def _try_acquire(self, waiter) -> bool:
+        """Take a free slot, or queue waiter for the next one released."""
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _release(self) -> None:
+        """Hand the slot to the longest waiter, or free it."""
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            loop, waiter = self._waiters.popleft()
+        if loop is None:
+            waiter.set()
+            return
+        try:
+            loop.call_soon_threadsafe(self._grant, waiter)
+        except RuntimeError:  # Its loop has closed
+            self._release()
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():  # Cancelled while the slot was on its way
+            self._release()
+        else:
+            future.set_result(None)
+
+    async def _acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        if self._try_acquire(waiter):
+            return
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and waiter[1].done() and not waiter[1].cancelled():
+                self._release()  # Granted just before the cancellation landed
+            raise
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.limit:
+            self._adjust(waiting=1)
+            try:
+                with span("llm_wait"):
+                    await self._acquire_async()
+            finally:
+                self._adjust(waiting=-1)
+        self._adjust(in_flight=1)
+        try:
+            yield
+        finally:
+            self._adjust(in_flight=-1)
+            if self.limit:
+                self._release()
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        if self.limit:
+            self._adjust(waiting=1)
+            try:
+                with span("llm_wait"):
+                    event = threading.Event()
+                    if not self._try_acquire((None, event)):
+                        event.wait()
+            finally:
+                self._adjust(waiting=-1)
+        self._adjust(in_flight=1)
+        try:
+            yield
+        finally:
+            self._adjust(in_flight=-1)
+            if self.limit:
+                self._release()
+
+
+DEFAULT_LLM_MAX_CONCURRENCY = 32
+
+LLM_LIMITER = LLMLimiter(int(os.getenv("LLM_MAX_CONCURRENCY", str(DEFAULT_LLM_MAX_CONCURRENCY))) or None)
+
+REGISTRY.register_callback(
+    "stylemail_llm_calls",
+    "Upstream LLM calls in flight and waiting for a slot.",
+    "gauge",
+    ["state"],
+    lambda: {("in_flight",): LLM_LIMITER.in_flight, ("waiting",): LLM_LIMITER.waiting},
+)
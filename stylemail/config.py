@@ -1,6 +1,10 @@
 from typing import Optional
 from dataclasses import dataclass
-import redis
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Longer inputs are rejected by the embeddings API, so they are truncated.
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+CHAT_MODEL = "gpt-4o"
 
 
 @dataclass
@@ -10,6 +14,14 @@ class Config:
     redis_port: int
     redis_db: Optional[int]
     redis_password: str
+    # Connection pool limits shared by every request in the process.
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_timeout: float = 60.0
+    redis_max_connections: int = 50
+    # Alternative OpenAI-compatible endpoint; None uses the client's default (or OPENAI_BASE_URL).
+    openai_base_url: Optional[str] = None
 
     @staticmethod
     def load(
@@ -18,33 +30,19 @@ class Config:
         redis_port: int,
         redis_db: Optional[int],
         redis_password: str,
+        **pool_settings,
     ) -> "Config":
         """
         Load configuration from provided arguments.
+
+        Connectivity is no longer probed here; the shared ClientRegistry owns
+        the Redis pool and callers ping through it when they need to.
         """
-        config = Config(
+        return Config(
             openai_api_key=openai_api_key,
             redis_host=redis_host,
             redis_port=redis_port,
             redis_db=redis_db,
             redis_password=redis_password,
+            **pool_settings,
         )
-
-        # Attempt Redis connection to validate config
-        try:
-            r = None
-            if redis_db is not None:
-                r = redis.Redis(
-                    host=redis_host,
-                    port=redis_port,
-                    db=redis_db,
-                    password=redis_password,
-                )
-            else:
-                r = redis.Redis(host=redis_host, port=redis_port, password=redis_password)
-            r.ping()
-            print("[config] Redis connection successful.")
-        except Exception as e:
-            print(f"[config] Redis connection failed: {e}")
-
-        return config
@@ -1,20 +1,185 @@
-from langchain_community.llms import OpenAI
+import logging
 from openai import OpenAI
 import numpy as np
-from typing import List, Dict, Any
-from stylemail.vectorstore import UserVectorStore
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from stylemail.ann import IVFIndex, mmr_select, top_k_indices
+from stylemail.cache import EmbeddingCache, ResponseCache
+from stylemail.config import CHAT_MODEL, EMBEDDING_MODEL
+from stylemail.metrics import PROMPT_TOKENS, prompt_logger, record_usage, should_log_prompt, span
+from stylemail.prompting import BuiltPrompt, PromptBudget, PromptBuilder, prompt_stats
+from stylemail.upstream import CHAT_UPSTREAM, EMBEDDINGS_UPSTREAM
+from stylemail.vectorstore import UserVectorStore, normalize_rows
+
+
+DEFAULT_TOP_K = 3
+
+
+def mmr_fetch_k(top_k: int) -> int:
+    """Relevance candidates re-ranked by MMR for a top_k selection."""
+    return max(4 * top_k, 20)
+
+
+def rank_style_context(texts: List[str], matrix: np.ndarray, prompt_embedding: List[float], top_k: int, index: Optional[IVFIndex] = None, mmr_lambda: Optional[float] = None) -> List[str]:
+    """
+    Rank a user's samples against the prompt embedding with one matmul over the
+    row-normalized matrix and return the top-k texts. With an IVF index only
+    the samples in the lists nearest the prompt are scored.
+
+    With mmr_lambda the top-k are instead picked by maximal marginal relevance
+    from the mmr_fetch_k(top_k) most similar samples, skipping near-duplicates
+    of samples already picked.
+    """
+    if not texts:
+        return []
+    query = normalize_rows(np.asarray(prompt_embedding, dtype=np.float32))
+    fetch_k = top_k if mmr_lambda is None else mmr_fetch_k(top_k)
+    if index is not None:
+        candidates = index.search(matrix, texts, query, fetch_k)
+    else:
+        candidates = top_k_indices(matrix @ query, texts, fetch_k)
+    if mmr_lambda is not None:
+        candidates = mmr_select(matrix, query, candidates, top_k, mmr_lambda)
+    return [texts[i] for i in candidates]
+
+
+def chat_kwargs(full_prompt: str, stream: bool = False) -> Dict[str, Any]:
+    kwargs = {
+        "model": CHAT_MODEL,
+        "messages": [{"role": "user", "content": full_prompt}],
+        "temperature": 0.7,
+    }
+    if stream:
+        kwargs["stream"] = True
+    return kwargs
+
+
+def log_prompt(tag: str, prompt: BuiltPrompt) -> None:
+    """
+    Record the prompt's token counts, and log its full text at DEBUG on the
+    stylemail.prompts logger for a sample of requests.
+    """
+    for section, count in prompt.tokens.items():
+        PROMPT_TOKENS.observe(count, kind=tag, section=section)
+    logging.info(f"[{tag}] Prompt tokens: {prompt_stats(prompt)}")
+    if should_log_prompt():
+        prompt_logger.debug(f"[{tag}] Full prompt sent to OpenAI:\n{prompt.text}")
+
+
+def stream_deltas(chunk) -> str:
+    """Text carried by one streamed chat completion chunk (may be empty)."""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def parse_subject_and_body(content: str) -> Dict[str, str]:
+    """
+    Split a model reply into a subject (from the first "Subject:" line) and a
+    body made of every other line.
+    """
+    lines = content.split("\n")
+    subject_line = next((line for line in lines if line.lower().startswith("subject:")), "Subject: No Subject")
+    subject = subject_line.split(":", 1)[1].strip() if ":" in subject_line else "No Subject"
+    body = "\n".join(line for line in lines if not line.lower().startswith("subject:"))
+    return {"subject": subject, "body": body}
+
+
+class SubjectLineParser:
+    """
+    Incremental version of parse_subject_and_body for streamed replies.
+
+    feed() returns ("subject", text) and ("body", text) events as soon as they
+    are known. Only a line that could still turn out to be a "Subject:" line is
+    held back, so body tokens flow through with no extra latency. Concatenating
+    the body events yields exactly what parse_subject_and_body would return.
+    """
+
+    _PREFIX = "subject:"
+
+    def __init__(self):
+        self.subject: Optional[str] = None
+        self._buf = ""
+        self._mode: Optional[str] = None  # None (undecided), "body" or "subject"
+        self._body_lines = 0
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        events: List[Tuple[str, str]] = []
+        while text:
+            newline = text.find("\n")
+            if newline < 0:
+                self._consume(text, events)
+                break
+            self._consume(text[:newline], events)
+            self._end_line(events)
+            text = text[newline + 1:]
+        return events
+
+    def finish(self) -> List[Tuple[str, str]]:
+        events: List[Tuple[str, str]] = []
+        self._end_line(events)
+        if self.subject is None:
+            self.subject = "No Subject"
+            events.append(("subject", self.subject))
+        return events
+
+    def _start_body_line(self, events: List[Tuple[str, str]]) -> None:
+        if self._body_lines:
+            events.append(("body", "\n"))
+        self._body_lines += 1
+
+    def _consume(self, piece: str, events: List[Tuple[str, str]]) -> None:
+        if self._mode == "body":
+            if piece:
+                events.append(("body", piece))
+            return
+        self._buf += piece
+        if self._mode is None:
+            lowered = self._buf.lower()
+            if lowered.startswith(self._PREFIX):
+                self._mode = "subject"
+            elif not self._PREFIX.startswith(lowered):
+                self._mode = "body"
+                self._start_body_line(events)
+                events.append(("body", self._buf))
+                self._buf = ""
+
+    def _end_line(self, events: List[Tuple[str, str]]) -> None:
+        if self._mode == "subject":
+            if self.subject is None:
+                self.subject = self._buf.split(":", 1)[1].strip()
+                events.append(("subject", self.subject))
+        elif self._mode is None:
+            self._start_body_line(events)
+            if self._buf:
+                events.append(("body", self._buf))
+        self._buf = ""
+        self._mode = None
+
 
 class EmailGenerator:
-    def __init__(self, openai_api_key: str, vector_store: UserVectorStore):
+    def __init__(self, openai_api_key: str, vector_store: UserVectorStore, embedding_cache: Optional[EmbeddingCache] = None, client: Optional[OpenAI] = None, response_cache: Optional[ResponseCache] = None, prompt_budget: Optional[PromptBudget] = None, top_k: int = DEFAULT_TOP_K, mmr_lambda: Optional[float] = None):
         """
         Initialize the EmailGenerator with OpenAI API key and a vector store for user embeddings.
         
         Args:
             openai_api_key (str): The API key for OpenAI.
             vector_store (UserVectorStore): The vector store instance for user embeddings.
+            embedding_cache (Optional[EmbeddingCache]): Shared prompt-embedding cache. Defaults to a
+                Redis-backed cache in the vector store's namespace.
+            client (Optional[OpenAI]): Shared OpenAI client. Defaults to a new client for the key.
+            response_cache (Optional[ResponseCache]): Semantic cache of earlier results. Disabled when None.
+            prompt_budget (Optional[PromptBudget]): Token budgets of the prompt sections.
+            top_k (int): Style samples retrieved per email.
+            mmr_lambda (Optional[float]): Relevance/diversity trade-off in [0, 1] for maximal
+                marginal relevance retrieval. Plain top-k when None.
         """
-        self.client = OpenAI(api_key=openai_api_key)
+        self.client = client or OpenAI(api_key=openai_api_key, max_retries=0)
         self.vector_store = vector_store
+        self.embedding_cache = embedding_cache or EmbeddingCache(vector_store.redis, namespace=vector_store.namespace)
+        self.response_cache = response_cache
+        self.prompt_budget = prompt_budget or PromptBudget()
+        self.top_k = top_k
+        self.mmr_lambda = mmr_lambda
 
     def embed_prompt(self, prompt: str) -> List[float]:
         """
@@ -30,14 +195,20 @@ class EmailGenerator:
             RuntimeError: If the embedding request fails.
         """
         try:
-            response = self.client.embeddings.create(
-                input=[prompt],
-                model="text-embedding-ada-002"
-            )
-            return response.data[0].embedding
+            with span("embed"):
+                return self.embedding_cache.embed(EMBEDDING_MODEL, [prompt], self._fetch_embeddings)[0]
         except Exception as e:
             raise RuntimeError(f"Failed to embed prompt with OpenAI API: {e}")
 
+    def _fetch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        response = EMBEDDINGS_UPSTREAM.call(
+            self.client.embeddings,
+            input=texts,
+            model=EMBEDDING_MODEL
+        )
+        record_usage(response, api="embeddings")
+        return [d.embedding for d in response.data]
+
     def cosine_similarity(self, a: List[float], b: List[float]) -> float:
         """
         Compute the cosine similarity between two embedding vectors.
@@ -53,31 +224,43 @@ class EmailGenerator:
         b_np = np.array(b)
         return float(np.dot(a_np, b_np) / (np.linalg.norm(a_np) * np.linalg.norm(b_np)))
 
-    def retrieve_style_context(self, user_id: str, prompt_embedding: List[float], top_k: int = 3) -> List[str]:
+    def retrieve_style_context(self, user_id: str, prompt_embedding: List[float], top_k: int = DEFAULT_TOP_K, mmr_lambda: Optional[float] = None) -> List[str]:
         """
-        Retrieve top-k most similar writing samples from Redis based on prompt embedding.
+        Retrieve top-k most similar writing samples from Redis based on prompt embedding,
+        or a diverse top-k by maximal marginal relevance when mmr_lambda is set.
         """
-        entries = self.vector_store.get_all_embeddings(user_id)
-        scored = [
-            (self.cosine_similarity(prompt_embedding, e["embedding"]), e["text"])
-            for e in entries
-        ]
-        scored.sort(reverse=True)
-        return [text for _, text in scored[:top_k]]
+        texts, matrix, index = self.vector_store.get_search_index(user_id)
+        with span("rank"):
+            return rank_style_context(texts, matrix, prompt_embedding, top_k, index=index, mmr_lambda=mmr_lambda)
 
-    def build_prompt(self, context_samples: List[str], user_prompt: str) -> str:
+    def compose_prompt(self, context_samples: List[str], user_prompt: str) -> BuiltPrompt:
         """
-        Construct a prompt for the LLM using retrieved style samples and the user prompt.
+        Construct a prompt for the LLM using retrieved style samples and the user prompt,
+        keeping each within its token budget. Samples are expected most similar first.
         """
-        context_block = "\n\n".join(context_samples)
+        budget = self.prompt_budget
         return (
-            "You are an assistant that writes emails in the user's personal style.\n\n"
-            "Here are some examples of the user's writing style:\n\n"
-            f"{context_block}\n\n"
-            "Now write an email based on the following prompt:\n\n"
-            f"{user_prompt}"
+            PromptBuilder()
+            .template(
+                "You are an assistant that writes emails in the user's personal style.\n\n"
+                "Here are some examples of the user's writing style:\n\n"
+            )
+            .items("style", context_samples, budget.style_tokens, budget.sample_tokens)
+            .template("\n\nNow write an email based on the following prompt:\n\n")
+            .text("instructions", user_prompt, budget.instruction_tokens)
+            .build()
         )
 
+    def build_prompt(self, context_samples: List[str], user_prompt: str) -> str:
+        return self.compose_prompt(context_samples, user_prompt).text
+
+    def _prepare_prompt(self, user_id: str, context: List[str], full_input: str) -> str:
+        if not context:
+            raise RuntimeError(f"No style data found for user '{user_id}'. Please seed user style first.")
+        prompt = self.compose_prompt(context, full_input)
+        log_prompt("generate_email", prompt)
+        return prompt.text
+
     def generate_email(self, user_id: str, subject: str, user_prompt: str) -> Dict[str, str]:
         """
         Generate an email in the user's style based on the subject and user prompt.
@@ -88,40 +271,102 @@ class EmailGenerator:
             user_prompt (str): The prompt or content for the email.
         
         Returns:
-            Dict[str, str]: A dictionary containing the generated email subject and body.
+            Dict[str, str]: A dictionary containing the generated email subject and body. With a
+                response cache, it also has "cache": "hit" or "miss".
         
         Raises:
             RuntimeError: If no style data is found or the OpenAI API call fails.
         """
         full_input = f"Subject: {subject}\n\n{user_prompt}"
         prompt_embedding = self.embed_prompt(full_input)
-        context = self.retrieve_style_context(user_id, prompt_embedding)
-        if not context:
-            raise RuntimeError(f"No style data found for user '{user_id}'. Please seed user style first.")
-        full_prompt = self.build_prompt(context, f"Subject: {subject}\n\n{user_prompt}")
-        print("[generate_email] Full prompt sent to OpenAI:\n", full_prompt)
+        if self.response_cache is not None:
+            try:
+                with span("response_cache"):
+                    cached = self.response_cache.lookup(user_id, prompt_embedding)
+            except Exception as e:
+                logging.warning(f"[generate_email] Response cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                return {**cached, "cache": "hit"}
+
+        context = self.retrieve_style_context(user_id, prompt_embedding, top_k=self.top_k, mmr_lambda=self.mmr_lambda)
+        full_prompt = self._prepare_prompt(user_id, context, full_input)
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.7,
-            )
+            response = CHAT_UPSTREAM.call(self.client.chat.completions, **chat_kwargs(full_prompt))
+            record_usage(response)
             content = response.choices[0].message.content
-            return {"subject": "Generated Email", "body": content}
+            result = {"subject": "Generated Email", "body": content}
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate email with OpenAI API: {e}")
+
+        if self.response_cache is not None:
+            try:
+                self.response_cache.put(user_id, full_input, prompt_embedding, result)
+            except Exception as e:
+                logging.warning(f"[generate_email] Response cache write failed: {e}")
+            return {**result, "cache": "miss"}
+        return result
+
+    def stream_email(self, user_id: str, subject: str, user_prompt: str) -> Iterator[Tuple[str, str]]:
+        """
+        Stream an email in the user's style as ("subject" | "body", text) events.
+
+        Raises:
+            RuntimeError: If no style data is found or the OpenAI API call fails.
+        """
+        full_input = f"Subject: {subject}\n\n{user_prompt}"
+        prompt_embedding = self.embed_prompt(full_input)
+        context = self.retrieve_style_context(user_id, prompt_embedding, top_k=self.top_k, mmr_lambda=self.mmr_lambda)
+        full_prompt = self._prepare_prompt(user_id, context, full_input)
+
+        try:
+            with CHAT_UPSTREAM.stream(self.client.chat.completions, **chat_kwargs(full_prompt, stream=True)) as stream:
+                yield ("subject", "Generated Email")
+                for chunk in stream:
+                    delta = stream_deltas(chunk)
+                    if delta:
+                        yield ("body", delta)
         except Exception as e:
             raise RuntimeError(f"Failed to generate email with OpenAI API: {e}")
+
+
+def format_nudge(nudge: Dict[str, str], separator: str) -> str:
+    return separator.join([f"Title: {nudge['title']}", f"Instructions: {nudge['instructions']}", f"Metrics: {nudge['metrics']}"])
+
+
 class NudgeSummaryGenerator:
-    def __init__(self, openai_api_key: str, vector_store: UserVectorStore):
+    def __init__(self, openai_api_key: str, vector_store: UserVectorStore, client: Optional[OpenAI] = None, prompt_budget: Optional[PromptBudget] = None):
         """
         Initialize the NudgeSummaryGenerator with OpenAI API key and a vector store for user embeddings.
         
         Args:
             openai_api_key (str): The API key for OpenAI.
             vector_store (UserVectorStore): The vector store instance for user embeddings.
+            client (Optional[OpenAI]): Shared OpenAI client. Defaults to a new client for the key.
+            prompt_budget (Optional[PromptBudget]): Token budgets of the prompt sections.
         """
-        self.client = OpenAI(api_key=openai_api_key)
+        self.client = client or OpenAI(api_key=openai_api_key, max_retries=0)
         self.vector_store = vector_store
+        self.prompt_budget = prompt_budget or PromptBudget()
+
+    def compose_prompt(self, prompt: str, nudges: List[Dict[str, str]]) -> BuiltPrompt:
+        """
+        Construct the summary prompt from the manager's prompt and the nudge list,
+        dropping the nudges at the end of the list once the nudge budget is spent.
+        """
+        budget = self.prompt_budget
+        return (
+            PromptBuilder()
+            .template("Prompt: ")
+            .text("instructions", prompt, budget.instruction_tokens)
+            .template("\n\nNudges:\n")
+            .items("nudges", [format_nudge(n, ", ") for n in nudges], budget.nudge_tokens, budget.item_nudge_tokens, separator="\n")
+            .build()
+        )
+
+    def build_prompt(self, prompt: str, nudges: List[Dict[str, str]]) -> str:
+        return self.compose_prompt(prompt, nudges).text
 
     def generate_summary(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> Dict[str, str]:
         """
@@ -138,34 +383,55 @@ class NudgeSummaryGenerator:
         Raises:
             RuntimeError: If the OpenAI API call fails.
         """
-        # Example implementation, adjust as needed
-        full_prompt = f"Prompt: {prompt}\n\nNudges:\n" + "\n".join(
-            f"Title: {n['title']}, Instructions: {n['instructions']}, Metrics: {n['metrics']}"
-            for n in nudges
-        )
-        print("[generate_summary] Full prompt sent to OpenAI:\n", full_prompt)
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("generate_summary", full_prompt)
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.7,
-            )
+            response = CHAT_UPSTREAM.call(self.client.chat.completions, **chat_kwargs(full_prompt.text))
+            record_usage(response)
             content = response.choices[0].message.content
             return {"summary": content}
         except Exception as e:
             raise RuntimeError(f"Failed to generate summary with OpenAI API: {e}")
+
+
 class NudgeEmailGenerator:
-    def __init__(self, openai_api_key: str, vector_store: UserVectorStore):
+    def __init__(self, openai_api_key: str, vector_store: UserVectorStore, client: Optional[OpenAI] = None, prompt_budget: Optional[PromptBudget] = None):
         """
         Initialize the NudgeEmailGenerator with OpenAI API key and a vector store for user embeddings.
         
         Args:
             openai_api_key (str): The API key for OpenAI.
             vector_store (UserVectorStore): The vector store instance for user embeddings.
+            client (Optional[OpenAI]): Shared OpenAI client. Defaults to a new client for the key.
+            prompt_budget (Optional[PromptBudget]): Token budgets of the prompt sections.
         """
-        self.client = OpenAI(api_key=openai_api_key)
+        self.client = client or OpenAI(api_key=openai_api_key, max_retries=0)
         self.vector_store = vector_store
+        self.prompt_budget = prompt_budget or PromptBudget()
+
+    def compose_prompt(self, prompt: str, nudges: List[Dict[str, str]]) -> BuiltPrompt:
+        """
+        Construct the nudge email prompt from the manager's prompt and the nudge list,
+        dropping the nudges at the end of the list once the nudge budget is spent.
+        """
+        budget = self.prompt_budget
+        return (
+            PromptBuilder()
+            .text("instructions", prompt, budget.instruction_tokens)
+            .template("\n\nNudges for the Employee Sally:\n")
+            .items("nudges", [format_nudge(n, "\n") for n in nudges], budget.nudge_tokens, budget.item_nudge_tokens)
+            .template(
+                "\n\n"
+                "Write a complete and polished email to the employee addressing the nudges. "
+                "The email should be professional, concise, and provide clear next steps."
+                "The nudges are things the writer needs to do for their team member and this email is them addressing them and reaching out to their team member."
+            )
+            .build()
+        )
+
+    def build_prompt(self, prompt: str, nudges: List[Dict[str, str]]) -> str:
+        return self.compose_prompt(prompt, nudges).text
 
     def generate_email(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> Dict[str, str]:
         """
@@ -182,31 +448,34 @@ class NudgeEmailGenerator:
         Raises:
             RuntimeError: If the OpenAI API call fails.
         """
-        nudge_texts = "\n\n".join(
-            f"Title: {n['title']}\nInstructions: {n['instructions']}\nMetrics: {n['metrics']}"
-            for n in nudges
-        )
-        full_prompt = (
-            f"{prompt}\n\n"
-            f"Nudges for the Employee Sally:\n{nudge_texts}\n\n"
-            "Write a complete and polished email to the employee addressing the nudges. "
-            "The email should be professional, concise, and provide clear next steps."
-            "The nudges are things the writer needs to do for their team member and this email is them addressing them and reaching out to their team member."
-        )
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("generate_nudge_email", full_prompt)
 
-        print("[generate_email] Full prompt sent to OpenAI:\n", full_prompt)
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.7,
-            )
+            response = CHAT_UPSTREAM.call(self.client.chat.completions, **chat_kwargs(full_prompt.text))
+            record_usage(response)
             content = response.choices[0].message.content
             # Assuming the response content is structured with a subject and body
-            lines = content.split("\n")
-            subject_line = next((line for line in lines if line.lower().startswith("subject:")), "Subject: No Subject")
-            subject = subject_line.split(":", 1)[1].strip() if ":" in subject_line else "No Subject"
-            body = "\n".join(line for line in lines if not line.lower().startswith("subject:"))
-            return {"subject": subject, "body": body}
+            return parse_subject_and_body(content)
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate nudge email with OpenAI API: {e}")
+
+    def stream_email(self, user_id: str, prompt: str, nudges: List[Dict[str, str]]) -> Iterator[Tuple[str, str]]:
+        """
+        Stream a nudge email as ("subject" | "body", text) events. The subject
+        line is parsed incrementally and never appears in the body.
+
+        Raises:
+            RuntimeError: If the OpenAI API call fails.
+        """
+        full_prompt = self.compose_prompt(prompt, nudges)
+        log_prompt("stream_nudge_email", full_prompt)
+
+        try:
+            with CHAT_UPSTREAM.stream(self.client.chat.completions, **chat_kwargs(full_prompt.text, stream=True)) as stream:
+                parser = SubjectLineParser()
+                for chunk in stream:
+                    yield from parser.feed(stream_deltas(chunk))
+                yield from parser.finish()
         except Exception as e:
             raise RuntimeError(f"Failed to generate nudge email with OpenAI API: {e}")
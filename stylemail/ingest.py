@@ -0,0 +1,260 @@
+"""
+Streaming import of writing samples from mail exports.
+
+Sources are read one message at a time, so memory is bounded by the batch
+size plus a 16-byte digest per unique sample, however large the export is:
+
+    mbox    a single mbox file (e.g. a Google Takeout "Sent" export)
+    eml     a directory tree of .eml files
+    jsonl   one JSON object per line with the text under "body" (or --field)
+
+Each message body is reduced to what the user actually wrote: quoted
+replies, forwarded headers and signatures are stripped. Samples are deduped
+by content hash before they reach StyleSeeder, which also skips samples the
+user already has.
+"""
+import hashlib
+import html
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.utils import parseaddr
+from typing import Callable, Iterable, Iterator, List, Optional, Set
+
+FORMATS = ("mbox", "eml", "jsonl")
+
+# A line that starts the quoted part of a reply or forward; it and everything
+# after it are dropped.
+_REPLY_MARKERS = [
+    re.compile(r"^On .{0,200}wrote:\s*$"),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+]
+# A quoted Outlook-style header block also starts the quoted part, but only a
+# "From:" line followed by "Sent:"/"Date:" and "To:" lines: the sender's own
+# text can start a line with "From:".
+_HEADER_FROM = re.compile(r"^From: .+$")
+_HEADER_FIELD = re.compile(r"^(Sent|Date|To|Cc|Subject):", re.IGNORECASE)
+# A line that starts the signature.
+_SIGNATURE_MARKERS = [
+    re.compile(r"^-- ?$"),
+    re.compile(r"^Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^Get Outlook for \w+", re.IGNORECASE),
+]
+_ESCAPED_FROM = re.compile(rb"^>+From ")
+_TAGS = re.compile(r"<[^>]+>")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+@dataclass
+class ImportStats:
+    messages: int = 0
+    samples: int = 0
+    duplicates: int = 0
+    skipped: int = 0
+    stored: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Messages read per second."""
+        return self.messages / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.messages} messages, {self.samples} samples "
+            f"({self.duplicates} duplicates, {self.skipped} skipped), {self.stored} stored "
+            f"in {self.elapsed:.1f}s ({self.rate:.0f} msg/s)"
+        )
+
+
+def detect_format(path: str) -> str:
+    if os.path.isdir(path):
+        return "eml"
+    lower = path.lower()
+    if lower.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if lower.endswith(".eml"):
+        return "eml"
+    return "mbox"
+
+
+def iter_mbox(path: str) -> Iterator[EmailMessage]:
+    """
+    Yield messages from an mbox file, reading it line by line instead of
+    indexing the whole file like mailbox.mbox does.
+    """
+    parser = BytesParser(policy=policy.default)
+    lines: Optional[List[bytes]] = None
+    previous_blank = True
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From ") and previous_blank:
+                if lines:
+                    yield parser.parsebytes(b"".join(lines))
+                lines = []
+            elif lines is not None:
+                # mboxrd escapes body lines starting with "From " as ">From ".
+                lines.append(line[1:] if _ESCAPED_FROM.match(line) else line)
+            previous_blank = not line.strip()
+    if lines:
+        yield parser.parsebytes(b"".join(lines))
+
+
+def iter_eml(path: str) -> Iterator[EmailMessage]:
+    parser = BytesParser(policy=policy.default)
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            yield parser.parse(f)
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".eml"):
+                with open(os.path.join(root, name), "rb") as f:
+                    yield parser.parse(f)
+
+
+def message_text(message: EmailMessage) -> Optional[str]:
+    """The message's plain-text body, falling back to de-tagged HTML."""
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return None
+    try:
+        content = part.get_content()
+    except (LookupError, ValueError):
+        return None
+    if part.get_content_subtype() == "html":
+        content = html.unescape(_TAGS.sub("", re.sub(r"(?i)<br\s*/?>|</p>", "\n", content)))
+    return content
+
+
+def _starts_header_block(lines: List[str], i: int) -> bool:
+    if not _HEADER_FROM.match(lines[i].strip()):
+        return False
+    fields = set()
+    for line in lines[i + 1:i + 5]:
+        match = _HEADER_FIELD.match(line.strip())
+        if match is None:
+            break
+        fields.add(match.group(1).lower())
+    return bool(fields & {"sent", "date"}) and "to" in fields
+
+
+def clean_body(text: str) -> str:
+    """
+    Keep only the text the sender wrote: drop ">" quoted lines, everything
+    from a reply/forward header on, and the signature.
+    """
+    kept: List[str] = []
+    lines = text.replace("\r\n", "\n").split("\n")
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if any(marker.match(stripped) for marker in _REPLY_MARKERS) or _starts_header_block(lines, i):
+            break
+        if any(marker.match(stripped) for marker in _SIGNATURE_MARKERS):
+            break
+        if stripped.startswith(">"):
+            continue
+        kept.append(line.rstrip())
+    return _BLANK_RUNS.sub("\n\n", "\n".join(kept)).strip()
+
+
+def iter_bodies(path: str, fmt: str, sender: Optional[str] = None, field_name: str = "body", stats: Optional[ImportStats] = None) -> Iterator[str]:
+    """Raw message bodies from a source, optionally only those sent by sender."""
+    stats = stats or ImportStats()
+    sender = sender.lower() if sender else None
+    if fmt == "jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                stats.messages += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    stats.skipped += 1
+                    continue
+                body = record.get(field_name) if isinstance(record, dict) else None
+                if not isinstance(body, str) or (sender and str(record.get("from", "")).lower() != sender):
+                    stats.skipped += 1
+                    continue
+                yield body
+        return
+
+    messages = iter_mbox(path) if fmt == "mbox" else iter_eml(path)
+    for message in messages:
+        stats.messages += 1
+        if sender and parseaddr(str(message.get("From", "")))[1].lower() != sender:
+            stats.skipped += 1
+            continue
+        body = message_text(message)
+        if body is None:
+            stats.skipped += 1
+            continue
+        yield body
+
+
+def iter_samples(bodies: Iterable[str], stats: ImportStats, min_chars: int = 20) -> Iterator[str]:
+    """Cleaned, deduplicated samples of at least min_chars characters."""
+    seen: Set[bytes] = set()
+    for body in bodies:
+        sample = clean_body(body)
+        if len(sample) < min_chars:
+            stats.skipped += 1
+            continue
+        digest = hashlib.sha256(sample.encode("utf-8")).digest()[:16]
+        if digest in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(digest)
+        stats.samples += 1
+        yield sample
+
+
+def batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_corpus(
+    seeder,
+    user_id: str,
+    path: str,
+    fmt: Optional[str] = None,
+    sender: Optional[str] = None,
+    field_name: str = "body",
+    batch_size: int = 500,
+    min_chars: int = 20,
+    progress: Optional[Callable[[ImportStats], None]] = None,
+) -> ImportStats:
+    """
+    Stream samples from path into seeder.seed_user_style in batches of
+    batch_size, calling progress(stats) after every batch.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    stats = ImportStats()
+    bodies = iter_bodies(path, fmt, sender=sender, field_name=field_name, stats=stats)
+    for batch in batched(iter_samples(bodies, stats, min_chars=min_chars), batch_size):
+        stats.stored += seeder.seed_user_style(user_id, batch)
+        if progress:
+            progress(stats)
+    return stats
@@ -1,22 +1,88 @@
 const { spawn } = require("child_process");
 const path = require("path");
+const readline = require("readline");
 
-function runPythonCommand(args, callback) {
-  const script = path.join(__dirname, "../stylemail/cli.py");
-  const proc = spawn("python3", [script, ...args]);
+// One long-lived `python -m stylemail.cli serve` process answers every call
+// over newline-delimited JSON, so calls don't pay for interpreter start-up and
+// reconnecting to Redis and OpenAI. It is started on first use, restarted after
+// it exits, and unref'd while idle so it never keeps Node alive on its own.
 
-  let output = "";
-  proc.stdout.on("data", (data) => (output += data.toString()));
+let worker = null;
+let nextId = 1;
+const pending = new Map();
+
+function setRef(proc, ref) {
+  for (const target of [proc, proc.stdin, proc.stdout, proc.stderr]) {
+    if (target) ref ? target.ref() : target.unref();
+  }
+}
+
+function startWorker() {
+  const proc = spawn(process.env.STYLEMAIL_PYTHON || "python3", ["-m", "stylemail.cli", "serve"], {
+    cwd: path.join(__dirname, "..", ".."),
+    stdio: ["pipe", "pipe", "pipe"],
+  });
+
+  readline.createInterface({ input: proc.stdout }).on("line", (line) => {
+    let response;
+    try {
+      response = JSON.parse(line);
+    } catch (err) {
+      console.error("[stylemail] Unparseable worker output:", line);
+      return;
+    }
+    const request = pending.get(response.id);
+    if (!request) return;
+    pending.delete(response.id);
+    if (pending.size === 0) setRef(proc, false);
+    if (response.error !== undefined) request.reject(new Error(response.error));
+    else request.resolve(response.result);
+  });
   proc.stderr.on("data", (data) => console.error(data.toString()));
-  proc.on("close", () => callback(output.trim()));
+
+  const fail = (err) => {
+    if (worker === proc) worker = null;
+    for (const request of pending.values()) request.reject(err);
+    pending.clear();
+  };
+  proc.on("error", fail);
+  // Writing to a worker that has died emits EPIPE here; unhandled, it would crash Node.
+  proc.stdin.on("error", fail);
+  proc.on("exit", (code, signal) => fail(new Error(`stylemail worker exited (${signal || code})`)));
+
+  setRef(proc, false);
+  return proc;
+}
+
+function call(method, params) {
+  if (!worker) worker = startWorker();
+  const proc = worker;
+  const id = nextId++;
+  return new Promise((resolve, reject) => {
+    pending.set(id, { resolve, reject });
+    setRef(proc, true);
+    proc.stdin.write(JSON.stringify({ id, method, params }) + "\n");
+  });
+}
+
+function withCallback(promise, callback) {
+  if (callback) promise.then((result) => callback(null, result), (err) => callback(err));
+  return promise;
 }
 
 function seedUserStyle(userId, samples, callback) {
-  runPythonCommand(["seed", userId, ...samples], callback);
+  return withCallback(call("seed", { user_id: userId, samples }), callback);
+}
+
+function generateEmail(userId, subject, prompt, callback) {
+  return withCallback(call("generate", { user_id: userId, subject, prompt }), callback);
 }
 
-function generateEmail(userId, prompt, callback) {
-  runPythonCommand(["generate", userId, prompt], callback);
+function close() {
+  if (worker) {
+    worker.stdin.end();
+    worker = null;
+  }
 }
 
-module.exports = { seedUserStyle, generateEmail };
+module.exports = { seedUserStyle, generateEmail, call, close };
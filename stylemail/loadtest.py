@@ -0,0 +1,324 @@
+"""
+Open-loop load test of one server:app worker.
+
+Requests go out on a fixed schedule at the target rate whether or not earlier
+ones have finished, so a slow server builds a queue instead of slowing the
+client down. Latency is measured from each request's scheduled start. Every
+stage runs at one rate, and the report gives throughput, latency percentiles
+and error rate per stage, plus the first rate the worker could not sustain.
+
+Traffic is /generate for the demo_seed.DEMO_USERS personas and /nudge-summary
+for the seed_nudges employees. Every prompt is unique, so no request is
+answered from a cache. By default everything runs locally: the fake OpenAI
+API and one uvicorn worker (fakeredis, temporary SQLite database seeded by
+seed_nudges) are started as subprocesses.
+
+    python -m stylemail.loadtest --rps 2 5 10 20 40 --duration 20
+    python -m stylemail.loadtest --url http://localhost:8000 --mix generate=1 --rps 5 10
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import httpx
+from stylemail.benchmarks.suite import ROOT, latency_summary
+
+ENDPOINTS = {"generate": "/generate", "nudge_summary": "/nudge-summary"}
+SUBJECTS = ["Project Update", "Quick question", "Follow-up", "Meeting notes", "Deadline"]
+PROMPTS = [
+    "Tell the team the release moved to next Friday",
+    "Thank the client for the feedback on the proposal",
+    "Ask for the quarterly numbers before the review",
+    "Summarize what we agreed in today's meeting",
+]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """ "generate=0.8,nudge_summary=0.2" -> shares of traffic that sum to 1."""
+    mix: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0 or any(w < 0 for w in mix.values()):
+        raise ValueError("mix weights must be non-negative and not all zero")
+    return {name: weight / total for name, weight in mix.items() if weight}
+
+
+def arrival_times(rps: float, duration: float, poisson: bool = False, rng: Optional[random.Random] = None) -> List[float]:
+    """Request start offsets in seconds: evenly spaced, or Poisson arrivals at the same mean rate."""
+    if not poisson:
+        return [i / rps for i in range(int(rps * duration))]
+    rng = rng or random.Random()
+    times, t = [], rng.expovariate(rps)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rps)
+    return times
+
+
+def request_body(kind: str, n: int, users: Sequence[str], employees: Sequence[str], rng: random.Random) -> Dict:
+    prompt = f"{rng.choice(PROMPTS)} (load test request {n})"
+    if kind == "generate":
+        return {"user_id": rng.choice(users), "subject": rng.choice(SUBJECTS), "prompt": prompt}
+    return {"user_id": rng.choice(users), "prompt": prompt, "email": "loadtest@example.com", "password": "", "employee_id": rng.choice(employees)}
+
+
+def saturation_reasons(stage: Dict, p99_slo_ms: float, max_error_rate: float) -> List[str]:
+    """Why a stage counts as saturated; empty when the worker kept up."""
+    reasons = []
+    if stage["throughput_rps"] < 0.9 * stage["target_rps"]:
+        reasons.append(f"throughput {stage['throughput_rps']} < 90% of {stage['target_rps']} rps")
+    if stage["latency"].get("p99_ms", 0) > p99_slo_ms:
+        reasons.append(f"p99 {stage['latency']['p99_ms']} ms > {p99_slo_ms} ms")
+    if stage["error_rate"] > max_error_rate:
+        reasons.append(f"error rate {stage['error_rate']:.1%} > {max_error_rate:.1%}")
+    if stage["dropped"]:
+        reasons.append(f"{stage['dropped']} requests over the in-flight limit")
+    return reasons
+
+
+async def run_stage(
+    client: httpx.AsyncClient,
+    rps: float,
+    duration: float,
+    mix: Dict[str, float],
+    users: Sequence[str],
+    employees: Sequence[str],
+    poisson: bool = False,
+    max_in_flight: int = 256,
+    seed: int = 0,
+) -> Dict:
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    latencies: Dict[str, List[float]] = {kind: [] for kind in kinds}
+    errors: Dict[str, int] = {kind: 0 for kind in kinds}
+    statuses: Dict[str, int] = {}
+    tasks = []
+    dropped = 0
+    max_lag = 0.0
+    loop = asyncio.get_running_loop()
+
+    async def send(kind: str, body: Dict, scheduled: float) -> None:
+        try:
+            response = await client.post(ENDPOINTS[kind], json=body)
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        latencies[kind].append(loop.time() - scheduled)
+        statuses[status] = statuses.get(status, 0) + 1
+        errors[kind] += status != "200"
+
+    start = loop.time()
+    for n, offset in enumerate(arrival_times(rps, duration, poisson, rng)):
+        scheduled = start + offset
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        max_lag = max(max_lag, loop.time() - scheduled)
+        kind = rng.choices(kinds, weights)[0]
+        if sum(not t.done() for t in tasks) >= max_in_flight:
+            dropped += 1
+            continue
+        tasks.append(asyncio.create_task(send(kind, request_body(kind, n, users, employees, rng), scheduled)))
+    await asyncio.gather(*tasks)
+    wall = loop.time() - start
+
+    sent = len(tasks)
+    failed = sum(errors.values())
+    return {
+        "target_rps": rps,
+        "duration": duration,
+        "sent": sent,
+        "ok": sent - failed,
+        "dropped": dropped,
+        "error_rate": round((failed + dropped) / max(1, sent + dropped), 4),
+        "throughput_rps": round((sent - failed) / wall, 2),
+        "seconds": round(wall, 2),
+        # How late the client fired compared to the schedule; large values
+        # mean the load generator, not the server, was the bottleneck.
+        "max_dispatch_lag_ms": round(max_lag * 1000, 1),
+        "status_codes": statuses,
+        "latency": latency_summary([t for kind in kinds for t in latencies[kind]]),
+        "endpoints": {kind: {"errors": errors[kind], "latency": latency_summary(latencies[kind])} for kind in kinds},
+    }
+
+
+def _demo_data() -> Tuple[List[Dict], List[str]]:
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from demo_seed import DEMO_USERS
+    from seed_nudges import DEMO_EMPLOYEES
+    return DEMO_USERS, [employee["id"] for employee in DEMO_EMPLOYEES]
+
+
+async def run_load(url: str, args: argparse.Namespace, mix: Dict[str, float]) -> Dict:
+    demo_users, employees = _demo_data()
+    users = [user["user_id"] for user in demo_users]
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    stages, saturation = [], None
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        if not args.no_seed:
+            for user in demo_users:
+                response = await client.post("/seed", json={"user_id": user["user_id"], "samples": user["samples"]})
+                response.raise_for_status()
+        for i, rps in enumerate(args.rps):
+            stage = await run_stage(client, rps, args.duration, mix, users, employees, args.poisson, args.max_in_flight, seed=i)
+            stage["saturated"] = saturation_reasons(stage, args.p99_slo_ms, args.max_error_rate)
+            stages.append(stage)
+            latency = stage["latency"]
+            print(
+                f"[loadtest] {rps:>6} rps: {stage['throughput_rps']:>7} ok/s  p50 {latency.get('p50_ms', '-')} ms  "
+                f"p99 {latency.get('p99_ms', '-')} ms  errors {stage['error_rate']:.1%}"
+                + (f"  SATURATED ({'; '.join(stage['saturated'])})" if stage["saturated"] else ""),
+                file=sys.stderr,
+                flush=True,
+            )
+            if stage["saturated"] and saturation is None:
+                saturation = {"rps": rps, "reasons": stage["saturated"]}
+                if not args.keep_going:
+                    break
+    sustained = [s["target_rps"] for s in stages if not s["saturated"]]
+    return {
+        "url": url,
+        "mix": mix,
+        "stages": stages,
+        "max_sustained_rps": max(sustained) if sustained else None,
+        "saturation": saturation,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Local server exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Local server did not answer {url} within {timeout:.0f}s")
+
+
+@contextlib.contextmanager
+def local_server(args: argparse.Namespace) -> Iterator[str]:
+    """Start the fake OpenAI API and one server worker; yields the server URL."""
+    openai_port, server_port = _free_port(), _free_port()
+    openai_url = f"http://127.0.0.1:{openai_port}/v1"
+    # Set here too: reading seed_nudges in this process imports database.py.
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="stylemail-loadtest-"), "loadtest.db")
+    env = {**os.environ, "OPENAI_BASE_URL": openai_url}
+    output = None if args.server_log else subprocess.DEVNULL
+    processes = [subprocess.Popen(
+        [sys.executable, "-m", "stylemail.benchmarks.fake_openai", "--port", str(openai_port),
+         "--chat-latency", str(args.chat_latency), "--embedding-latency", str(args.embedding_latency),
+         "--token-latency", str(args.token_latency)],
+        cwd=ROOT, env=env, stdout=output, stderr=output,
+    )]
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "stylemail.loadtest", "--serve-local", "--port", str(server_port)],
+            cwd=ROOT, env=env, stdout=output, stderr=output,
+        ))
+        url = f"http://127.0.0.1:{server_port}"
+        _wait_ready(url + "/health", processes[-1])
+        yield url
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def serve_local(port: int) -> None:
+    """
+    One uvicorn worker of server:app backed by fakeredis, the SQLite file in
+    DATABASE_URL (seeded with the seed_nudges data) and the OpenAI API at
+    OPENAI_BASE_URL.
+    """
+    import uvicorn
+    from stylemail.benchmarks.suite import install_server_state, load_server
+
+    server, database = load_server()
+    import seed_nudges
+    db = database.SessionLocal()
+    try:
+        seed_nudges.seed_employees(db)
+        seed_nudges.seed_nudges(db)
+    finally:
+        db.close()
+    install_server_state(server, os.environ["OPENAI_BASE_URL"])
+    # lifespan would replace the state above with real Redis connections.
+    uvicorn.run(server.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning", access_log=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server to load; by default a local worker with the fake OpenAI API is started")
+    parser.add_argument("--rps", type=float, nargs="+", default=[2, 5, 10, 20, 40], help="Target rate of each stage")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per stage")
+    parser.add_argument("--mix", default="generate=0.8,nudge_summary=0.2", help="Traffic shares per endpoint")
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals instead of evenly spaced requests")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Requests beyond this many outstanding are dropped and counted")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--p99-slo-ms", type=float, default=2000.0, help="A stage whose p99 exceeds this is saturated")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--keep-going", action="store_true", help="Run every stage even after saturation")
+    parser.add_argument("--no-seed", action="store_true", help="Don't POST the demo users to /seed first")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="Fake OpenAI latency (local mode)")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Fake OpenAI latency (local mode)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Fake OpenAI latency (local mode)")
+    parser.add_argument("--server-log", action="store_true", help="Show the local server's output")
+    parser.add_argument("--serve-local", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_local:
+        serve_local(args.port)
+        return
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.url:
+        report = asyncio.run(run_load(args.url, args, mix))
+    else:
+        with local_server(args) as url:
+            report = asyncio.run(run_load(url, args, mix))
+    report["args"] = {k: v for k, v in vars(args).items() if k not in ("output", "serve_local", "port")}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Stages of a request are timed with span():
+
+    with span("embed"):
+        ...
+
+and land in the stylemail_stage_seconds histogram under their stage label.
+REGISTRY.render() produces the exposition text served on /metrics. Values
+that already live elsewhere (cache hit counters) are read at scrape time via
+REGISTRY.register_callback.
+"""
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[n]) for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: one count per bucket plus the +Inf bucket, not cumulative.
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts.setdefault(key, [0] * (len(self.buckets) + 1))[slot] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(tuple(str(labels[n]) for n in self.labelnames), ()))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(self._sums[key])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._callbacks: List[Tuple[str, str, str, Sequence[str], Callable[[], Dict[LabelValues, float]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def register_callback(self, name: str, help: str, kind: str, labelnames: Sequence[str], collect: Callable[[], Dict[LabelValues, float]]) -> None:
+        """
+        Expose values computed at scrape time. collect() returns
+        {label values: value}; kind is "counter" or "gauge". Registering the
+        same name again replaces the callback.
+        """
+        with self._lock:
+            self._callbacks = [c for c in self._callbacks if c[0] != name]
+            self._callbacks.append((name, help, kind, tuple(labelnames), collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for name, help, kind, labelnames, collect in list(self._callbacks):
+            try:
+                values = collect()
+            except Exception as e:
+                logging.warning(f"[metrics] Collecting {name} failed: {e}")
+                continue
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stylemail_stage_seconds",
+    "Time spent in each stage of a request (embed, redis_fetch, rank, chat, db_commit, ...).",
+    ["stage"],
+)
+STAGE_ERRORS = REGISTRY.counter("stylemail_stage_errors_total", "Stages that raised.", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram("stylemail_request_seconds", "HTTP request latency by route.", ["method", "route", "status"])
+PROMPT_TOKENS = REGISTRY.histogram("stylemail_prompt_tokens", "Locally counted prompt tokens per request, by prompt section.", ["kind", "section"], buckets=TOKEN_BUCKETS)
+USAGE_TOKENS = REGISTRY.counter("stylemail_usage_tokens_total", "Tokens billed by the OpenAI API, from response usage.", ["api", "kind"])
+MATRIX_CACHE = REGISTRY.counter("stylemail_matrix_cache_requests_total", "In-process style matrix cache lookups.", ["result"])
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block into stylemail_stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_usage(response, api: str = "chat") -> None:
+    """Count the prompt and completion tokens reported on a chat or embeddings response."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int):
+            USAGE_TOKENS.inc(value, api=api, kind=kind.split("_")[0])
+
+
+# Full prompts are logged at DEBUG on the "stylemail.prompts" logger, and only
+# for this fraction of requests (PROMPT_LOG_SAMPLE_RATE, default 0.01).
+prompt_logger = logging.getLogger("stylemail.prompts")
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("PROMPT_LOG_SAMPLE_RATE", "0.01"))
+
+
+def should_log_prompt(sample_rate: Optional[float] = None) -> bool:
+    rate = PROMPT_LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    return prompt_logger.isEnabledFor(logging.DEBUG) and random.random() < rate
@@ -0,0 +1,113 @@
+"""
+Token-budgeted prompt assembly shared by the email and nudge generators.
+
+A prompt is built from sections. Fixed template text is kept as is; the
+user's request, the style samples and the nudges each get a token budget.
+Items are taken in priority order (most similar sample first, nudges in the
+order given), each one is cut to its per-item budget, and once the next item
+no longer fits in the section budget it and everything after it are dropped.
+The same inputs therefore always produce the same prompt.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+from stylemail.config import CHAT_MODEL
+from stylemail.tokens import count_tokens, exact_counts, truncate_to_tokens
+
+TRUNCATION_MARK = " [...]"
+
+
+@dataclass
+class PromptBudget:
+    instruction_tokens: int = 1000
+    style_tokens: int = 1800
+    sample_tokens: int = 600
+    nudge_tokens: int = 3000
+    item_nudge_tokens: int = 300
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    # Tokens per section plus "total" for the whole prompt.
+    tokens: Dict[str, int] = field(default_factory=dict)
+    dropped: Dict[str, int] = field(default_factory=dict)
+    truncated: Dict[str, int] = field(default_factory=dict)
+
+
+class PromptBuilder:
+    def __init__(self, model: str = CHAT_MODEL):
+        self.model = model
+        self._parts: List[str] = []
+        self._tokens: Dict[str, int] = {}
+        self._dropped: Dict[str, int] = {}
+        self._truncated: Dict[str, int] = {}
+
+    def _cut(self, text: str, max_tokens: int) -> str:
+        if count_tokens(text, self.model) <= max_tokens:
+            return text
+        mark_tokens = count_tokens(TRUNCATION_MARK, self.model)
+        return truncate_to_tokens(text, max(0, max_tokens - mark_tokens), self.model).rstrip() + TRUNCATION_MARK
+
+    def template(self, text: str) -> "PromptBuilder":
+        """Fixed wording, never truncated."""
+        self._parts.append(text)
+        self._tokens["template"] = self._tokens.get("template", 0) + count_tokens(text, self.model)
+        return self
+
+    def text(self, section: str, text: str, max_tokens: int) -> "PromptBuilder":
+        """
+        Free text such as the user's request, cut to max_tokens. Without
+        tiktoken it is kept whole: the fallback estimate overcounts too much
+        to cut what the user asked for on it.
+        """
+        fitted = self._cut(text, max_tokens) if exact_counts(self.model) else text
+        if fitted != text:
+            logging.warning(f"[prompt] Truncated {section} to {max_tokens} tokens")
+        self._parts.append(fitted)
+        self._tokens[section] = self._tokens.get(section, 0) + count_tokens(fitted, self.model)
+        self._truncated[section] = self._truncated.get(section, 0) + (fitted != text)
+        return self
+
+    def items(self, section: str, items: Sequence[str], max_tokens: int, item_tokens: int, separator: str = "\n\n") -> "PromptBuilder":
+        """
+        Priority-ordered items joined by separator. Each item is cut to
+        item_tokens, and items are taken until the next one would push the
+        section past max_tokens.
+        """
+        kept: List[str] = []
+        total = 0
+        truncated = 0
+        separator_tokens = count_tokens(separator, self.model)
+        for item in items:
+            fitted = self._cut(item, item_tokens)
+            cost = count_tokens(fitted, self.model) + (separator_tokens if kept else 0)
+            if total + cost > max_tokens:
+                break
+            kept.append(fitted)
+            total += cost
+            truncated += fitted != item
+        self._parts.append(separator.join(kept))
+        self._tokens[section] = self._tokens.get(section, 0) + total
+        self._dropped[section] = self._dropped.get(section, 0) + len(items) - len(kept)
+        self._truncated[section] = self._truncated.get(section, 0) + truncated
+        return self
+
+    def build(self) -> BuiltPrompt:
+        text = "".join(self._parts)
+        return BuiltPrompt(
+            text=text,
+            tokens={**self._tokens, "total": count_tokens(text, self.model)},
+            dropped=dict(self._dropped),
+            truncated=dict(self._truncated),
+        )
+
+
+def prompt_stats(prompt: BuiltPrompt) -> str:
+    """One-line summary of a prompt's token use for the request log."""
+    parts = [f"{name}={count}" for name, count in prompt.tokens.items()]
+    for label, counts in (("dropped", prompt.dropped), ("truncated", prompt.truncated)):
+        nonzero = [f"{name}:{count}" for name, count in counts.items() if count]
+        if nonzero:
+            parts.append(f"{label}=" + ",".join(nonzero))
+    return " ".join(parts)
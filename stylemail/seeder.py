@@ -1,27 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
-from typing import List
+from typing import List, Optional, Tuple
+from stylemail.cache import EmbeddingCache
+from stylemail.config import EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MODEL
+from stylemail.metrics import record_usage, span
+from stylemail.tokens import chunk_by_tokens, count_tokens, truncate_to_tokens
+from stylemail.upstream import EMBEDDINGS_UPSTREAM
 from stylemail.vectorstore import UserVectorStore
 
 
 class StyleSeeder:
-    def __init__(self, openai_api_key: str, vector_store: UserVectorStore):
-        self.client = OpenAI(api_key=openai_api_key)
+    def __init__(
+        self,
+        openai_api_key: str,
+        vector_store: UserVectorStore,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        client: Optional[OpenAI] = None,
+        max_request_tokens: int = 50_000,
+        max_request_inputs: int = 512,
+        max_concurrency: int = 4,
+    ):
+        """
+        Args:
+            max_request_tokens (int): Token budget of one embeddings request.
+            max_request_inputs (int): Samples per embeddings request.
+            max_concurrency (int): Embeddings requests in flight at once.
+        """
+        self.client = client or OpenAI(api_key=openai_api_key, max_retries=0)
         self.vector_store = vector_store
+        self.embedding_cache = embedding_cache or EmbeddingCache(vector_store.redis, namespace=vector_store.namespace)
+        self.max_request_tokens = max_request_tokens
+        self.max_request_inputs = max_request_inputs
+        self.max_concurrency = max_concurrency
 
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
         try:
-            response = self.client.embeddings.create(
-                input=texts,
-                model="text-embedding-ada-002"
-            )
-            return [d.embedding for d in response.data]
+            return self.embedding_cache.embed(EMBEDDING_MODEL, texts, self._fetch_embeddings)
         except Exception as e:
             raise RuntimeError(f"Failed to embed texts with OpenAI API: {e}")
 
-    def seed_user_style(self, user_id: str, samples: List[str]) -> None:
+    def _fetch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        response = EMBEDDINGS_UPSTREAM.call(
+            self.client.embeddings,
+            input=[truncate_to_tokens(t, EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MODEL) for t in texts],
+            model=EMBEDDING_MODEL
+        )
+        record_usage(response, api="embeddings")
+        return [d.embedding for d in response.data]
+
+    def _plan_chunks(self, samples: List[str], stored: List[bool]) -> Tuple[List[str], List[List[str]]]:
+        """
+        Drop duplicates and samples the user already has, then split the rest
+        into chunks that fit one embeddings request each.
+        """
+        pending = [s for s, found in zip(samples, stored) if not found]
+        counts = [min(count_tokens(s, EMBEDDING_MODEL), EMBEDDING_MAX_INPUT_TOKENS) for s in pending]
+        chunks = [[pending[i] for i in chunk] for chunk in chunk_by_tokens(counts, self.max_request_tokens, self.max_request_inputs)]
+        return pending, chunks
+
+    def seed_user_style(self, user_id: str, samples: List[str]) -> int:
         """
         Embed and store a user's writing samples in the Redis vector store.
+
+        Samples already stored for the user are skipped. The rest are embedded
+        in token-budgeted chunks, up to max_concurrency at a time, and every
+        chunk is written with one pipeline as soon as it is embedded.
+        Returns the number of samples stored.
         """
-        embeddings = self.embed_texts(samples)
-        for text, emb in zip(samples, embeddings):
-            self.vector_store.store_embedding(user_id, text, emb)
+        samples = list(dict.fromkeys(samples))
+        with span("seed_dedupe"):
+            stored = self.vector_store.has_samples(user_id, samples)
+        pending, chunks = self._plan_chunks(samples, stored)
+        if not chunks:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(chunks))) as pool:
+            futures = {pool.submit(self.embed_texts, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                embeddings = future.result()
+                with span("seed_store"):
+                    self.vector_store.store_embeddings(user_id, futures[future], embeddings)
+        return len(pending)
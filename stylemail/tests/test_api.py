@@ -1,60 +1,62 @@
-import os
+import fakeredis
 import pytest
 from stylemail.api import seed_user_style, generate_email
+from stylemail.benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from stylemail.clients import ClientRegistry
 from stylemail.config import Config
+from stylemail.vectorstore import UserVectorStore
+
+
+@pytest.fixture(scope="module")
+def fake_openai():
+    with FakeOpenAIServer(FakeOpenAIConfig(embedding_dim=32, embedding_latency=0, chat_latency=0, completion_tokens=12)) as fake:
+        yield fake
+
+
+@pytest.fixture
+def clients(fake_openai):
+    registry = ClientRegistry(Config(
+        openai_api_key="sk-test",
+        redis_host=None,
+        redis_port=None,
+        redis_db=None,
+        redis_password=None,
+        openai_base_url=fake_openai.base_url,
+    ))
+    yield registry
+    registry.close()
 
 
 @pytest.fixture
-def config():
-    return Config.load(
-        redis_url=os.getenv("REDIS_URL", "redis://localhost:6379"),
-        openai_api_key=os.getenv("OPENAI_API_KEY", "sk-test")
-    )
+def store():
+    return UserVectorStore(redis_client=fakeredis.FakeRedis())
 
 
-def test_seed_and_generate(monkeypatch, config):
+def test_seed_and_generate(store, clients, fake_openai):
     """Test happy path for seeding and generating an email."""
     user_id = "test_user"
     samples = ["Hi there!", "Thanks for your message."]
-    prompt = "Follow up on the proposal"
-
-    # Mock OpenAI embedding and chat
-    monkeypatch.setattr("openai.Embedding.create", lambda **kwargs: {
-        "data": [{"embedding": [0.1] * 1536} for _ in kwargs["input"]]
-    })
-    monkeypatch.setattr("openai.ChatCompletion.create", lambda **kwargs: {
-        "choices": [{"message": {"content": "This is a test email."}}]
-    })
 
-    # Mock Redis vector store methods
-    monkeypatch.setattr("stylemail.vectorstore.UserVectorStore.store_embedding", lambda self, uid, text, emb: None)
-    monkeypatch.setattr("stylemail.vectorstore.UserVectorStore.get_all_embeddings", lambda self, uid: [
-        {"text": s, "embedding": [0.1] * 1536} for s in samples
-    ])
+    assert seed_user_style(user_id, samples, store=store, openai_api_key="sk-test", clients=clients) == 2
+    assert seed_user_style(user_id, samples, store=store, openai_api_key="sk-test", clients=clients) == 0
+    result = generate_email(user_id, "Proposal", "Follow up on the proposal", store=store, openai_api_key="sk-test", clients=clients)
 
-    seed_user_style(user_id, samples, config=config)
-    result = generate_email(user_id, prompt, config=config)
+    assert result["subject"] == "Generated Email"
+    assert "Thanks for the update" in result["body"]
+    assert fake_openai.requests["/v1/chat/completions"] >= 1
 
-    assert "body" in result
-    assert "test email" in result["body"].lower()
 
-
-def test_invalid_inputs():
+def test_invalid_inputs(store):
     with pytest.raises(ValueError):
-        seed_user_style("", ["sample"])
+        seed_user_style("", ["sample"], store=store, openai_api_key="sk-test")
     with pytest.raises(ValueError):
-        seed_user_style("user", [])
+        seed_user_style("user", [], store=store, openai_api_key="sk-test")
     with pytest.raises(ValueError):
-        generate_email("", "prompt")
+        generate_email("", "subject", "prompt", store=store, openai_api_key="sk-test")
     with pytest.raises(ValueError):
-        generate_email("user", "")
-
+        generate_email("user", "subject", "", store=store, openai_api_key="sk-test")
 
-def test_missing_style(monkeypatch, config):
-    monkeypatch.setattr("openai.Embedding.create", lambda **kwargs: {
-        "data": [{"embedding": [0.1] * 1536}]
-    })
-    monkeypatch.setattr("stylemail.vectorstore.UserVectorStore.get_all_embeddings", lambda self, uid: [])
 
+def test_missing_style(store, clients):
     with pytest.raises(RuntimeError, match="No style data found"):
-        generate_email("user123", "prompt", config=config)
+        generate_email("user123", "subject", "prompt", store=store, openai_api_key="sk-test", clients=clients)
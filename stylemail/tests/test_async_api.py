@@ -0,0 +1,158 @@
+import asyncio
+import importlib
+import inspect
+import json
+import threading
+from types import SimpleNamespace
+import fakeredis
+import pytest
+from stylemail import async_api, async_generator
+from stylemail.async_vectorstore import AsyncUserVectorStore
+from stylemail.cache import AsyncResponseCache, UserMatrixCache
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, **kwargs):
+        async def create_embeddings(input, model):
+            return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0]) for t in input])
+
+        async def create_chat(**kwargs):
+            message = SimpleNamespace(content="Subject: Check-in\nHi there")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        self.embeddings = SimpleNamespace(create=create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create_chat))
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr("stylemail.async_generator.AsyncOpenAI", FakeAsyncOpenAI)
+    monkeypatch.setattr("stylemail.async_seeder.AsyncOpenAI", FakeAsyncOpenAI)
+    store = AsyncUserVectorStore(matrix_cache=UserMatrixCache())
+    store.redis = fakeredis.FakeAsyncRedis()
+    return store
+
+
+def test_async_seed_and_generate(store):
+    async def run():
+        await async_api.seed_user_style("u1", ["Hi!", "Thanks so much."], store=store, openai_api_key="sk-test")
+        return await async_api.generate_email("u1", "Follow up", "Proposal", store=store, openai_api_key="sk-test")
+
+    result = asyncio.run(run())
+    assert result["body"] == "Subject: Check-in\nHi there"
+
+
+def test_async_generate_decodes_and_ranks_off_the_event_loop(store, monkeypatch):
+
+    threads = {}
+
+    def record(name, fn):
+        def wrapper(*args, **kwargs):
+            threads[name] = threading.current_thread()
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(store, "_decode_entries", record("decode", store._decode_entries))
+    monkeypatch.setattr(store, "_stack_entries", record("stack", store._stack_entries))
+    monkeypatch.setattr(async_generator, "rank_style_context", record("rank", async_generator.rank_style_context))
+
+    async def run():
+        await async_api.seed_user_style("u1", ["Hi!", "Thanks so much."], store=store, openai_api_key="sk-test")
+        return await async_api.generate_email("u1", "Follow up", "Proposal", store=store, openai_api_key="sk-test")
+
+    asyncio.run(run())
+    assert set(threads) == {"decode", "stack", "rank"}
+    assert threading.main_thread() not in threads.values()
+
+
+def test_async_generate_reuses_cached_response(store):
+    response_cache = AsyncResponseCache(store.redis, threshold=0.99)
+
+    async def run():
+        await async_api.seed_user_style("u1", ["Hi!"], store=store, openai_api_key="sk-test")
+        first = await async_api.generate_email("u1", "Follow up", "Proposal", store=store, openai_api_key="sk-test", response_cache=response_cache)
+        second = await async_api.generate_email("u1", "Follow up", "Proposal", store=store, openai_api_key="sk-test", response_cache=response_cache)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["cache"] == "miss"
+    assert second == {**first, "cache": "hit"}
+
+
+def test_async_nudge_email_parses_subject(store):
+    nudges = [{"title": "Late arrivals", "instructions": "Talk", "metrics": "6 late days"}]
+    result = asyncio.run(async_api.generate_nudge_email("m1", "Be kind", nudges, store=store, openai_api_key="sk-test"))
+    assert result == {"subject": "Check-in", "body": "Hi there"}
+
+
+def test_async_missing_style(store):
+    with pytest.raises(RuntimeError, match="No style data found"):
+        asyncio.run(async_api.generate_email("nobody", "s", "p", store=store, openai_api_key="sk-test"))
+
+
+def test_async_nudge_email_batch_bounds_concurrency(store, monkeypatch):
+    in_flight = {"now": 0, "peak": 0}
+
+    class SlowOpenAI(FakeAsyncOpenAI):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+
+            async def create_chat(**kwargs):
+                in_flight["now"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+                await asyncio.sleep(0.01)
+                in_flight["now"] -= 1
+                message = SimpleNamespace(content="Subject: Check-in\nHi there")
+                return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+            self.chat = SimpleNamespace(completions=SimpleNamespace(create=create_chat))
+
+    monkeypatch.setattr("stylemail.async_generator.AsyncOpenAI", SlowOpenAI)
+    nudge = {"title": "Late arrivals", "instructions": "Talk", "metrics": "6 late days"}
+    nudges_by_employee = {f"emp_{i}": [nudge] for i in range(10)}
+    nudges_by_employee["emp_none"] = []
+
+    results = asyncio.run(async_api.generate_nudge_emails_batch(
+        "m1", "Be kind", nudges_by_employee, store=store, openai_api_key="sk-test", max_concurrency=3,
+    ))
+
+    assert in_flight["peak"] == 3
+    assert results["emp_0"] == {"subject": "Check-in", "body": "Hi there"}
+    assert results["emp_none"] == {"error": "No active nudges found"}
+
+
+IO_MARKERS = ("self.redis.", ".execute(", "self.client.", "self.vector_store.", "self.embedding_cache.", "self.response_cache.", "_fetch_raw(", "_fetch_embeddings(", "self.get_many(", "self.put_many(")
+
+
+@pytest.mark.parametrize("cls", [
+    "stylemail.async_vectorstore.AsyncUserVectorStore",
+    "stylemail.async_generator.AsyncEmailGenerator",
+    "stylemail.async_generator.AsyncNudgeSummaryGenerator",
+    "stylemail.async_generator.AsyncNudgeEmailGenerator",
+    "stylemail.async_seeder.AsyncStyleSeeder",
+    "stylemail.cache.AsyncEmbeddingCache",
+    "stylemail.cache.AsyncResponseCache",
+])
+def test_async_classes_inherit_no_sync_io(cls):
+    """Sync methods inherited by the async classes would block the loop or return unawaited coroutines."""
+    module, name = cls.rsplit(".", 1)
+    cls = getattr(importlib.import_module(module), name)
+    for base in cls.__mro__[1:-1]:
+        for attr, value in vars(base).items():
+            if attr in ("__init__",) or not inspect.isfunction(value) or getattr(cls, attr) is not value:
+                continue
+            source = inspect.getsource(value)
+            assert not any(marker in source for marker in IO_MARKERS), f"{cls.__name__}.{attr} is inherited sync I/O"
+
+
+def test_async_migrate_legacy_entries(store):
+    async def main():
+        doc_id = store._hash_text("legacy")
+        await store.redis.hset(store._user_key("u1"), doc_id, json.dumps({"text": "legacy", "embedding": [1.0, 2.0]}))
+        await store.store_embedding("u1", "fresh", [3.0, 4.0])
+
+        assert await store.migrate_all() == 1
+        assert await store.migrate_user("u1") == 0
+        return sorted(e["text"] for e in await store.get_all_embeddings("u1"))
+
+    assert asyncio.run(main()) == ["fresh", "legacy"]
@@ -0,0 +1,64 @@
+import json
+import pytest
+from stylemail.batch import BatchJob, LocalBatchBackend, run_job
+
+
+def requests():
+    for employee_id in ("emp_1", "emp_2", "emp_3"):
+        body = {"model": "gpt-4o", "messages": [{"role": "user", "content": f"Summarize {employee_id}"}]}
+        yield employee_id, body, {"nudge_snippet": f"snippet {employee_id}"}
+
+
+def complete(body):
+    content = body["messages"][0]["content"]
+    if content.endswith("emp_3"):
+        raise RuntimeError("rate limited")
+    return content.upper()
+
+
+def test_local_job_writes_results_and_reports_errors(tmp_path):
+    written = []
+    summary = run_job(BatchJob(str(tmp_path)), LocalBatchBackend(complete), requests, written.extend, poll_interval=0)
+
+    assert [(cid, result["content"], meta["nudge_snippet"]) for cid, result, meta in written] == [
+        ("emp_1", "SUMMARIZE EMP_1", "snippet emp_1"),
+        ("emp_2", "SUMMARIZE EMP_2", "snippet emp_2"),
+    ]
+    assert summary["written"] == 2
+    assert set(summary["errors"]) == {"emp_3"}
+    lines = (tmp_path / "input.jsonl").read_text().splitlines()
+    assert json.loads(lines[0])["url"] == "/v1/chat/completions"
+
+
+def test_job_resumes_after_crash_without_rewriting(tmp_path):
+    written = []
+
+    def crash_after_first(chunk):
+        written.extend(chunk)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_job(BatchJob(str(tmp_path)), LocalBatchBackend(complete), requests, crash_after_first, write_chunk_size=1)
+    assert BatchJob(str(tmp_path)).stage == "downloaded"
+
+    def must_not_collect():
+        raise AssertionError("a resumed job must not collect again")
+
+    # The crash happened before the first chunk was recorded, so it is retried once.
+    resumed = []
+    summary = run_job(BatchJob(str(tmp_path)), LocalBatchBackend(complete), must_not_collect, resumed.extend, write_chunk_size=1)
+    assert [cid for cid, _, _ in resumed] == ["emp_1", "emp_2"]
+    assert summary["written"] == 2
+
+    again = []
+    run_job(BatchJob(str(tmp_path)), LocalBatchBackend(complete), must_not_collect, again.extend)
+    assert again == []
+
+
+def test_empty_job_finishes_without_submitting(tmp_path):
+    class NoSubmit:
+        def submit(self, path):
+            raise AssertionError("nothing to submit")
+
+    summary = run_job(BatchJob(str(tmp_path)), NoSubmit(), lambda: [], lambda chunk: None)
+    assert summary["requests"] == 0
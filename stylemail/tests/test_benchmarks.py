@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from stylemail.benchmarks.suite import ROOT, SCENARIOS, latency_summary
+
+
+def test_latency_summary_percentiles():
+    summary = latency_summary([i / 1000 for i in range(1, 101)])
+
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == pytest.approx(50.5)
+    assert summary["p99_ms"] == pytest.approx(99.01)
+    assert summary["max_ms"] == 100.0
+    assert latency_summary([]) == {"count": 0}
+
+
+def test_suite_runs_every_scenario_end_to_end(tmp_path):
+    # A separate process: the nudge scenario points the server module at its own database.
+    output = tmp_path / "bench.json"
+    tiny = [
+        "--embedding-dim", "8", "--embedding-latency", "0", "--chat-latency", "0", "--completion-tokens", "5",
+        "--seed-samples", "20", "--generate-samples", "10", "--concurrency", "2", "--requests", "4",
+        "--retrieval-sizes", "10", "--queries", "3", "--employees", "3", "--nudges", "2", "--batch-concurrency", "2",
+    ]
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    subprocess.run([sys.executable, "-m", "stylemail.benchmarks.suite", "--output", str(output), *tiny], cwd=ROOT, env=env, check=True, capture_output=True, timeout=120)
+    report = json.loads(output.read_text())
+
+    assert set(report) == {"meta", "results"}
+    assert set(report["results"]) == set(SCENARIOS)
+    assert report["meta"]["openai_requests"]
+    assert report["results"]["seed"]["stored"] == 20
+    assert report["results"]["generate"]["levels"][0]["errors"] == 0
+    assert report["results"]["retrieval"]["10"]["exact"]["count"] == 3
+    assert report["results"]["nudge_batch"]["levels"][0]["emails"] == 3
@@ -0,0 +1,99 @@
+import asyncio
+import time
+import fakeredis
+import fakeredis.aioredis
+import numpy as np
+from stylemail.cache import AsyncEmbeddingCache, EmbeddingCache, ResponseCache
+
+
+def test_embedding_cache_hits_local_then_redis():
+    server = fakeredis.FakeServer()
+    calls = []
+
+    def fetch(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    cache = EmbeddingCache(fakeredis.FakeRedis(server=server))
+    first = cache.embed("model-a", ["hi", "hello", "hi"], fetch)
+    assert calls == [["hi", "hello"]]
+    np.testing.assert_array_equal(first[2], [2.0, 1.0])
+
+    cache.embed("model-a", ["hello"], fetch)
+    assert len(calls) == 1
+    assert cache.stats()["hits_local"] == 1
+
+    # A fresh process shares the Redis level but not the local one.
+    other = EmbeddingCache(fakeredis.FakeRedis(server=server))
+    np.testing.assert_array_equal(other.embed("model-a", ["hello"], fetch)[0], [5.0, 1.0])
+    assert len(calls) == 1
+    assert other.stats() == {"hits_local": 0, "hits_redis": 1, "misses": 0, "local_entries": 1}
+
+
+def test_embedding_cache_is_keyed_by_model():
+    cache = EmbeddingCache(fakeredis.FakeRedis())
+    cache.embed("model-a", ["hi"], lambda texts: [[1.0]])
+    result = cache.embed("model-b", ["hi"], lambda texts: [[2.0]])
+
+    np.testing.assert_array_equal(result[0], [2.0])
+    assert cache.stats()["misses"] == 2
+
+
+def test_embedding_cache_local_lru_bound():
+    cache = EmbeddingCache(fakeredis.FakeRedis(), max_local_entries=2)
+    cache.embed("m", ["a", "b", "c"], lambda texts: [[0.0] for _ in texts])
+
+    assert cache.stats()["local_entries"] == 2
+
+
+def test_embedding_cache_falls_back_to_fetch_when_redis_is_down():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    calls = []
+
+    def fetch(texts):
+        calls.append(list(texts))
+        return [[1.0] for _ in texts]
+
+    cache = EmbeddingCache(fakeredis.FakeRedis(server=server))
+    np.testing.assert_array_equal(cache.embed("m", ["a", "b"], fetch)[1], [1.0])
+    cache.embed("m", ["a"], fetch)
+    assert calls == [["a", "b"]]
+    assert cache.stats() == {"hits_local": 1, "hits_redis": 0, "misses": 2, "local_entries": 2}
+
+    async def fetch_async(texts):
+        return fetch(texts)
+
+    async_cache = AsyncEmbeddingCache(fakeredis.aioredis.FakeRedis(server=server))
+    result = asyncio.run(async_cache.embed("m", ["c"], fetch_async))
+    np.testing.assert_array_equal(result[0], [1.0])
+    assert calls[-1] == ["c"]
+
+
+def test_response_cache_matches_similar_prompts_per_user():
+    cache = ResponseCache(fakeredis.FakeRedis(), threshold=0.95)
+    cache.put("u1", "follow up on proposal", [1.0, 0.0, 0.0], {"subject": "S", "body": "B"})
+
+    assert cache.lookup("u1", [0.99, 0.05, 0.0]) == {"subject": "S", "body": "B"}
+    assert cache.lookup("u1", [0.5, 0.5, 0.0]) is None
+    assert cache.lookup("u2", [1.0, 0.0, 0.0]) is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+    cache.invalidate("u1")
+    assert cache.lookup("u1", [1.0, 0.0, 0.0]) is None
+
+
+def test_response_cache_ttl_and_per_user_limit(monkeypatch):
+    cache = ResponseCache(fakeredis.FakeRedis(), ttl_seconds=60, max_entries_per_user=2)
+    now = time.time()
+    for i, vector in enumerate(([1.0, 0.0], [0.0, 1.0], [-1.0, 0.0])):
+        monkeypatch.setattr(time, "time", lambda: now + i)
+        cache.put("u1", f"prompt {i}", vector, {"body": str(i)})
+
+    # The oldest entry was evicted to stay within the limit.
+    assert cache.redis.zcard(cache._keys("u1")[2]) == 2
+    assert cache.lookup("u1", [1.0, 0.0]) is None
+    assert cache.lookup("u1", [0.0, 1.0]) == {"body": "1"}
+
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert cache.lookup("u1", [-1.0, 0.0]) is None
@@ -0,0 +1,46 @@
+import asyncio
+import httpx
+from stylemail import clients as clients_module
+from stylemail.clients import ClientRegistry
+from stylemail.config import Config
+
+
+def make_config(**overrides):
+    return Config.load(
+        openai_api_key="sk-test",
+        redis_host="localhost",
+        redis_port=6379,
+        redis_db=0,
+        redis_password="",
+        **overrides,
+    )
+
+
+def test_registry_reuses_clients_and_pools():
+    clients = ClientRegistry(make_config(redis_max_connections=7))
+    try:
+        assert clients.openai is clients.openai
+        assert clients.redis().connection_pool is clients.redis().connection_pool
+        assert clients.redis().connection_pool.max_connections == 7
+    finally:
+        clients.close()
+
+
+def test_registry_applies_http_limits(monkeypatch):
+    limits = []
+
+    def recording(client_class):
+        def build(**kwargs):
+            limits.append(kwargs["limits"])
+            return client_class(**kwargs)
+        return build
+
+    monkeypatch.setattr(clients_module, "DefaultHttpxClient", recording(clients_module.DefaultHttpxClient))
+    monkeypatch.setattr(clients_module, "DefaultAsyncHttpxClient", recording(clients_module.DefaultAsyncHttpxClient))
+    clients = ClientRegistry(make_config(http_max_connections=3, http_max_keepalive_connections=2, http_keepalive_expiry=10.0))
+    try:
+        clients.openai, clients.async_openai
+        expected = httpx.Limits(max_connections=3, max_keepalive_connections=2, keepalive_expiry=10.0)
+        assert limits == [expected, expected]
+    finally:
+        asyncio.run(clients.aclose())
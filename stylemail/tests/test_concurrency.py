@@ -0,0 +1,208 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+import fakeredis
+import pytest
+from stylemail.concurrency import DEFAULT_LLM_MAX_CONCURRENCY, AsyncRequestCoalescer, LLMLimiter
+
+
+def test_concurrent_identical_requests_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"summary": "done"}
+
+    async def main():
+        coalescer = AsyncRequestCoalescer()
+        results = await asyncio.gather(*(coalescer.run("emp_001", compute) for _ in range(5)), coalescer.run("emp_002", compute))
+        assert coalescer.in_flight() == 0
+        return results
+
+    results = asyncio.run(main())
+    assert len(calls) == 2
+    assert all(r == {"summary": "done"} for r in results)
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        coalescer = AsyncRequestCoalescer()
+        results = await asyncio.gather(*(coalescer.run("k", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await coalescer.run("k", fail)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_workers_sharing_redis_take_turns_and_the_follower_finds_the_result():
+    redis = fakeredis.FakeAsyncRedis()
+    stored = {}
+    llm_calls = []
+
+    async def summarize():
+        # What the /nudge-summary handler does: reuse a saved row, else generate and save.
+        if "emp_001" in stored:
+            return stored["emp_001"]
+        llm_calls.append(1)
+        await asyncio.sleep(0.1)
+        stored["emp_001"] = {"summary": "generated"}
+        return stored["emp_001"]
+
+    async def main():
+        worker_a = AsyncRequestCoalescer(redis, poll_interval=0.01)
+        worker_b = AsyncRequestCoalescer(redis, poll_interval=0.01)
+        results = await asyncio.gather(worker_a.run("emp_001", summarize), worker_b.run("emp_001", summarize))
+        assert await redis.keys("*lock*") == []
+        return results
+
+    assert asyncio.run(main()) == [{"summary": "generated"}] * 2
+    assert len(llm_calls) == 1
+
+
+def test_workers_without_cross_worker_do_not_wait_for_each_other():
+    redis = fakeredis.FakeAsyncRedis()
+
+    async def generate():
+        await asyncio.sleep(0.2)
+        return {"subject": "new email"}
+
+    async def main():
+        worker_a = AsyncRequestCoalescer(redis, poll_interval=0.01)
+        worker_b = AsyncRequestCoalescer(redis, poll_interval=0.01)
+        start = time.monotonic()
+        results = await asyncio.gather(
+            worker_a.run("k", generate, cross_worker=False),
+            worker_b.run("k", generate, cross_worker=False),
+        )
+        assert time.monotonic() - start < 0.35
+        assert await redis.keys("*lock*") == []
+        return results
+
+    assert asyncio.run(main()) == [{"subject": "new email"}] * 2
+
+
+def test_lock_wait_times_out_and_someone_elses_lock_is_left_alone():
+    redis = fakeredis.FakeAsyncRedis()
+
+    async def main():
+        await redis.set("style_mail_vector:lock:k", "other-worker")
+        coalescer = AsyncRequestCoalescer(redis, wait_timeout=0.05, poll_interval=0.01)
+
+        async def compute():
+            return "computed anyway"
+
+        assert await coalescer.run("k", compute) == "computed anyway"
+        assert await redis.get("style_mail_vector:lock:k") == b"other-worker"
+
+    asyncio.run(main())
+
+
+def test_llm_limiter_caps_concurrent_coroutines():
+    limiter = LLMLimiter(2)
+    peak = []
+
+    async def call():
+        async with limiter.slot():
+            peak.append(limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(8)))
+
+    asyncio.run(main())
+    # The slots outlive the event loop.
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+
+
+def test_llm_limiter_caps_threads_and_unlimited_only_counts():
+    limiter = LLMLimiter(3)
+    peak = []
+
+    def call():
+        with limiter.hold():
+            peak.append(limiter.in_flight)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 3
+
+    unlimited = LLMLimiter()
+    with unlimited.hold():
+        assert unlimited.in_flight == 1
+    assert unlimited.in_flight == 0
+
+
+def test_llm_limiter_is_one_budget_for_threads_and_event_loops():
+    limiter = LLMLimiter(2)
+    peak = []
+
+    def record():
+        peak.append(limiter.in_flight)
+        time.sleep(0.01)
+
+    async def coroutine_calls():
+        async def call():
+            async with limiter.slot():
+                record()
+                await asyncio.sleep(0.01)
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    def thread_calls():
+        for _ in range(3):
+            with limiter.hold():
+                record()
+
+    threads = [threading.Thread(target=asyncio.run, args=(coroutine_calls(),)) for _ in range(2)]
+    threads += [threading.Thread(target=thread_calls) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(peak) == 18
+    assert max(peak) == 2
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+
+
+def test_llm_limiter_passes_on_slots_of_cancelled_waiters():
+    limiter = LLMLimiter(1)
+
+    async def main():
+        async with limiter.slot():
+            waiter = asyncio.ensure_future(limiter.slot().__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        async with limiter.slot():
+            assert limiter.in_flight == 1
+
+    asyncio.run(asyncio.wait_for(main(), 1))
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+
+
+def test_llm_limiter_is_capped_by_default():
+    code = "from stylemail.concurrency import LLM_LIMITER; print(LLM_LIMITER.limit)"
+    env = {k: v for k, v in os.environ.items() if k != "LLM_MAX_CONCURRENCY"}
+    assert subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout.strip() == str(DEFAULT_LLM_MAX_CONCURRENCY)
+    env["LLM_MAX_CONCURRENCY"] = "0"
+    assert subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout.strip() == "None"
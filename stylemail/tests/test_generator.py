@@ -0,0 +1,94 @@
+import fakeredis
+import numpy as np
+import pytest
+from stylemail.ann import mmr_select
+from stylemail.api import _retrieval_settings
+from stylemail.generator import EmailGenerator, SubjectLineParser, parse_subject_and_body, rank_style_context
+from stylemail.vectorstore import UserVectorStore, normalize_rows
+
+
+@pytest.fixture
+def generator():
+    store = UserVectorStore()
+    store.redis = fakeredis.FakeRedis()
+    return EmailGenerator("sk-test", store)
+
+
+def test_retrieve_style_context_matches_pairwise_ranking(generator):
+    rng = np.random.default_rng(0)
+    samples = [f"sample {i}" for i in range(50)]
+    for text in samples:
+        generator.vector_store.store_embedding("u1", text, rng.normal(size=32).tolist())
+    query = rng.normal(size=32).tolist()
+
+    entries = generator.vector_store.get_all_embeddings("u1")
+    expected = sorted(
+        ((generator.cosine_similarity(query, e["embedding"]), e["text"]) for e in entries),
+        reverse=True,
+    )
+    for top_k in (1, 3, 10, 50, 80):
+        got = generator.retrieve_style_context("u1", query, top_k=top_k)
+        assert got == [text for _, text in expected[:top_k]]
+
+
+def test_retrieve_style_context_empty(generator):
+    assert generator.retrieve_style_context("nobody", [1.0, 0.0]) == []
+
+
+def test_mmr_with_lambda_one_is_plain_top_k():
+    rng = np.random.default_rng(1)
+    matrix = normalize_rows(rng.normal(size=(200, 16)).astype(np.float32))
+    texts = [f"s{i}" for i in range(200)]
+    query = rng.normal(size=16).tolist()
+
+    assert rank_style_context(texts, matrix, query, 5, mmr_lambda=1.0) == rank_style_context(texts, matrix, query, 5)
+
+
+def test_mmr_skips_near_duplicates():
+    rng = np.random.default_rng(2)
+    base = rng.normal(size=16)
+    other = rng.normal(size=16)
+    # Three near-copies of the closest sample, then a distinct but still relevant one.
+    rows = [base + rng.normal(scale=0.01, size=16) for _ in range(3)] + [base + other]
+    matrix = normalize_rows(np.array(rows, dtype=np.float32))
+    query = normalize_rows(base.astype(np.float32))
+
+    assert 3 not in mmr_select(matrix, query, [0, 1, 2, 3], 2, 1.0)
+    picked = mmr_select(matrix, query, [0, 1, 2, 3], 2, 0.3)
+    assert picked[0] in (0, 1, 2) and picked[1] == 3
+
+
+def test_retrieval_settings_validation():
+    assert _retrieval_settings(None, None, None) == {}
+    settings = _retrieval_settings(2, 0.5, 300)
+    assert settings["top_k"] == 2 and settings["mmr_lambda"] == 0.5
+    assert settings["prompt_budget"].style_tokens == 300
+    for bad in ((0, None, None), (None, 1.5, None), (None, None, 0)):
+        with pytest.raises(ValueError):
+            _retrieval_settings(*bad)
+
+
+@pytest.mark.parametrize("content", [
+    "Subject: Quarterly check-in\nHi Sam,\n\nThanks for the update.\n",
+    "Hello\nsubject: late one\nBody",
+    "No subject at all",
+    "Subj\nSubject: A\nSubject: B\n\nText",
+    "",
+])
+def test_subject_line_parser_matches_batch_parsing(content):
+    expected = parse_subject_and_body(content)
+    for chunk_size in (1, 2, 5, len(content) or 1):
+        parser = SubjectLineParser()
+        events = []
+        for i in range(0, len(content), chunk_size):
+            events.extend(parser.feed(content[i:i + chunk_size]))
+        events.extend(parser.finish())
+
+        assert [text for kind, text in events if kind == "subject"] == [expected["subject"]]
+        assert "".join(text for kind, text in events if kind == "body") == expected["body"]
+
+
+def test_subject_line_parser_streams_body_without_waiting_for_newline():
+    parser = SubjectLineParser()
+    assert parser.feed("Subject: Hi\nDear") == [("subject", "Hi"), ("body", "Dear")]
+    assert parser.feed(" team") == [("body", " team")]
@@ -0,0 +1,31 @@
+import pytest
+from stylemail.benchmarks.import_time import HEAVY_MODULES, measure, parse_importtime
+
+
+@pytest.mark.parametrize("target", ["stylemail", "stylemail.config", "stylemail.cli"])
+def test_light_entry_points_do_not_import_heavy_dependencies(target):
+    modules = {name.strip() for name, _, _ in measure(target)}
+    assert [m for m in HEAVY_MODULES if m in modules] == []
+
+
+def test_generator_does_not_import_langchain():
+    modules = {name.strip() for name, _, _ in measure("stylemail.generator")}
+    assert "langchain_community" not in modules
+
+
+def test_package_exports_load_on_first_access():
+    import stylemail
+    from stylemail.api import generate_email
+
+    assert stylemail.generate_email is generate_email
+    with pytest.raises(AttributeError):
+        stylemail.missing
+
+
+def test_parse_importtime_keeps_nesting():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   numpy.core\n"
+        "import time:        40 |        160 | numpy\n"
+    )
+    assert parse_importtime(stderr) == [("  numpy.core", 120, 120), ("numpy", 40, 160)]
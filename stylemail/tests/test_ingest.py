@@ -0,0 +1,82 @@
+import json
+from stylemail.ingest import ImportStats, clean_body, import_corpus, iter_bodies, iter_mbox
+
+MBOX = b"""From alice@example.com Mon Jan  1 00:00:00 2024
+From: Alice <alice@example.com>
+To: bob@example.com
+Subject: Proposal
+
+Hi Bob,
+
+Following up on the proposal we discussed.
+>From what I heard, the team liked it.
+
+--
+Alice
+
+From bob@example.com Mon Jan  1 01:00:00 2024
+From: Bob <bob@example.com>
+Subject: Re: Proposal
+
+Sounds good to me, thanks for the quick turnaround.
+
+On Mon, Jan 1, 2024 at 00:00 Alice <alice@example.com> wrote:
+> Hi Bob,
+
+"""
+
+
+class RecordingSeeder:
+    def __init__(self):
+        self.batches = []
+
+    def seed_user_style(self, user_id, samples):
+        self.batches.append(list(samples))
+        return len(samples)
+
+
+def test_clean_body_strips_quotes_and_signature():
+    text = "Thanks, will do.\n> quoted line\nSee you.\n\n-- \nAlice\nCEO"
+    assert clean_body(text) == "Thanks, will do.\nSee you."
+    assert clean_body("Short reply.\n\n-----Original Message-----\nFrom: x") == "Short reply."
+
+
+def test_clean_body_keeps_inline_from_lines_and_cuts_quoted_headers():
+    text = "Notes below.\nFrom: the team, a big thank you.\nSee you Monday."
+    assert clean_body(text) == text
+
+    reply = "Sounds good.\n\nFrom: Bob <bob@example.com>\nSent: Monday, June 3, 2024 9:00 AM\nTo: Alice <alice@example.com>\nSubject: Plan\n\nOld text"
+    assert clean_body(reply) == "Sounds good."
+
+
+def test_iter_mbox_splits_messages_and_unescapes_from(tmp_path):
+    path = tmp_path / "sent.mbox"
+    path.write_bytes(MBOX)
+
+    messages = list(iter_mbox(str(path)))
+    assert [m["Subject"] for m in messages] == ["Proposal", "Re: Proposal"]
+    assert "From what I heard" in messages[0].get_content()
+
+
+def test_import_filters_sender_dedupes_and_batches(tmp_path):
+    path = tmp_path / "sent.mbox"
+    path.write_bytes(MBOX + MBOX)
+    seeder = RecordingSeeder()
+
+    stats = import_corpus(seeder, "u1", str(path), sender="alice@example.com", batch_size=1)
+    assert seeder.batches == [["Hi Bob,\n\nFollowing up on the proposal we discussed.\nFrom what I heard, the team liked it."]]
+    assert (stats.messages, stats.samples, stats.duplicates, stats.skipped, stats.stored) == (4, 1, 1, 2, 1)
+
+
+def test_jsonl_and_eml_sources(tmp_path):
+    jsonl = tmp_path / "sent.jsonl"
+    jsonl.write_text("\n".join([json.dumps({"text": "A long enough sample of writing."}), "not json", json.dumps({"text": 3})]))
+    stats = ImportStats()
+    assert list(iter_bodies(str(jsonl), "jsonl", field_name="text", stats=stats)) == ["A long enough sample of writing."]
+    assert stats.skipped == 2
+
+    eml_dir = tmp_path / "eml"
+    (eml_dir / "nested").mkdir(parents=True)
+    (eml_dir / "nested" / "1.eml").write_bytes(MBOX.split(b"\n", 1)[1].split(b"\nFrom bob")[0])
+    seeder = RecordingSeeder()
+    assert import_corpus(seeder, "u1", str(eml_dir)).stored == 1
@@ -0,0 +1,44 @@
+import random
+import pytest
+from stylemail.loadtest import arrival_times, parse_mix, saturation_reasons
+
+
+def test_arrival_times_are_evenly_spaced_at_the_target_rate():
+    times = arrival_times(4, 2.5)
+
+    assert times == [i * 0.25 for i in range(10)]
+
+
+def test_poisson_arrivals_stay_in_the_stage_and_match_the_rate():
+    times = arrival_times(50, 20, poisson=True, rng=random.Random(3))
+
+    assert times == sorted(times)
+    assert all(0 <= t < 20 for t in times)
+    assert 900 < len(times) < 1100
+    assert times == arrival_times(50, 20, poisson=True, rng=random.Random(3))
+
+
+def test_parse_mix_normalizes_weights():
+    assert parse_mix("generate=3,nudge_summary=1") == {"generate": 0.75, "nudge_summary": 0.25}
+    assert parse_mix("generate") == {"generate": 1.0}
+    assert parse_mix("generate=1,nudge_summary=0") == {"generate": 1.0}
+    with pytest.raises(ValueError, match="Unknown endpoint"):
+        parse_mix("seed=1")
+    with pytest.raises(ValueError):
+        parse_mix("generate=0")
+
+
+def stage(**overrides):
+    return {"target_rps": 10, "throughput_rps": 9.8, "latency": {"p99_ms": 800.0}, "error_rate": 0.0, "dropped": 0, **overrides}
+
+
+def test_saturation_reasons():
+    assert saturation_reasons(stage(), p99_slo_ms=2000, max_error_rate=0.01) == []
+
+    reasons = saturation_reasons(
+        stage(throughput_rps=6.0, latency={"p99_ms": 4000.0}, error_rate=0.05, dropped=3),
+        p99_slo_ms=2000,
+        max_error_rate=0.01,
+    )
+    assert len(reasons) == 4
+    assert reasons[0].startswith("throughput 6.0")
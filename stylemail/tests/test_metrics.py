@@ -0,0 +1,64 @@
+import logging
+from types import SimpleNamespace
+import pytest
+from stylemail.metrics import Registry, STAGE_ERRORS, STAGE_SECONDS, USAGE_TOKENS, prompt_logger, record_usage, should_log_prompt, span
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    hist = registry.histogram("test_seconds", "Test latency.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        hist.observe(value, stage="embed")
+
+    lines = registry.render().splitlines()
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{stage="embed",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="embed",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="embed",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="embed"} 4' in lines
+    assert 'test_seconds_sum{stage="embed"} 4.25' in lines
+
+
+def test_counters_and_callbacks_escape_labels():
+    registry = Registry()
+    registry.counter("test_total", "Test counter.", ["route"]).inc(2, route='a"b')
+    registry.register_callback("test_cache_total", "Cache.", "counter", ["result"], lambda: {("hit",): 3})
+    registry.register_callback("test_broken", "Broken.", "gauge", [], lambda: 1 / 0)
+
+    text = registry.render()
+    assert 'test_total{route="a\\"b"} 2' in text
+    assert 'test_cache_total{result="hit"} 3' in text
+    assert "test_broken" not in text
+
+
+def test_span_times_stage_and_counts_errors():
+    before = STAGE_SECONDS.count(stage="unit")
+    errors = STAGE_ERRORS.value(stage="unit")
+    with span("unit"):
+        pass
+    with pytest.raises(ValueError):
+        with span("unit"):
+            raise ValueError("boom")
+
+    assert STAGE_SECONDS.count(stage="unit") == before + 2
+    assert STAGE_ERRORS.value(stage="unit") == errors + 1
+
+
+def test_record_usage_reads_response_usage():
+    before = USAGE_TOKENS.value(api="chat", kind="completion")
+    record_usage(SimpleNamespace(usage=SimpleNamespace(prompt_tokens=12, completion_tokens=30)))
+    record_usage(SimpleNamespace())
+
+    assert USAGE_TOKENS.value(api="chat", kind="completion") == before + 30
+
+
+def test_prompt_logging_is_level_gated_and_sampled():
+    level = prompt_logger.level
+    try:
+        prompt_logger.setLevel(logging.INFO)
+        assert not should_log_prompt(1.0)
+        prompt_logger.setLevel(logging.DEBUG)
+        assert should_log_prompt(1.0)
+        assert not should_log_prompt(0.0)
+    finally:
+        prompt_logger.setLevel(level)
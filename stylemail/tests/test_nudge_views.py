@@ -0,0 +1,148 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+import pytest
+
+if "database" not in sys.modules:
+    # database.py connects at import; keep these tests off the real Postgres.
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/nudge_views.db"
+database = pytest.importorskip("database")
+nudges = pytest.importorskip("nudges")
+from sqlalchemy import inspect, select, text
+
+
+@pytest.fixture
+def db():
+    if not database.DATABASE_URL.startswith("sqlite"):
+        pytest.skip("needs a scratch SQLite database")
+    database.Base.metadata.create_all(bind=database.engine)
+    session = database.SessionLocal()
+    yield session
+    session.close()
+    database.Base.metadata.drop_all(bind=database.engine)
+
+
+def view(db, employee_id):
+    rows = db.execute(nudges.nudge_views_query([employee_id])).all()
+    return nudges.NudgeBlock.from_view(rows[0]) if rows else None
+
+
+def add_nudge(db, employee_id, title, **fields):
+    nudge = database.Nudge(employee_id=employee_id, nudge_type="performance", title=title, message="m", **fields)
+    db.add(nudge)
+    return nudge
+
+
+def test_rendered_nudge_matches_prompt_and_api_formats():
+    row = database.Nudge(
+        id=7, nudge_type="attendance", title="Late arrivals", instructions=None, threshold=3.0,
+        date_range_from=datetime(2024, 5, 1), date_range_to=datetime(2024, 5, 31),
+        metric_name="late_arrivals", metric_value=6.0, unit="days", operator="greater_than",
+    )
+    rendered = nudges.RenderedNudge(row)
+
+    assert not hasattr(rendered, "__dict__")
+    assert rendered.for_prompt() == {
+        "title": "Late arrivals",
+        "instructions": "No Instructions",
+        "metrics": (
+            "Threshold: 3.0, Date Range: 2024-05-01T00:00:00 to 2024-05-31T00:00:00, "
+            "Prior Date Range: N/A to N/A, Metric: late_arrivals, Value: 6.0, Unit: days, Operator: greater_than"
+        ),
+    }
+    api = rendered.for_api()
+    assert api["id"] == 7
+    assert api["config"]["dateRange"] == {"from": "2024-05-01T00:00:00", "to": "2024-05-31T00:00:00"}
+    assert api["config"]["priorDateRange"] == {"from": None, "to": None}
+
+
+def test_flush_refreshes_the_employees_view(db):
+    db.add(database.Employee(id="emp_1", name="A", email="a@example.com"))
+    first = add_nudge(db, "emp_1", "Low score", metric_value=2.0)
+    add_nudge(db, "emp_1", "Late arrivals")
+    db.commit()
+
+    block = view(db, "emp_1")
+    assert block.snippet == "Low score, Late arrivals"
+    assert [n["title"] for n in block.prompt] == ["Low score", "Late arrivals"]
+    assert block.api[0]["metric_value"] == 2.0
+
+    first.metric_value = 5.0
+    db.commit()
+    assert view(db, "emp_1").api[0]["metric_value"] == 5.0
+
+    first.status = "resolved"
+    db.commit()
+    assert view(db, "emp_1").snippet == "Late arrivals"
+
+    db.delete(db.execute(select(database.Nudge).where(database.Nudge.title == "Late arrivals")).scalar_one())
+    db.commit()
+    assert view(db, "emp_1").prompt == []
+
+
+def test_rolled_back_writes_leave_the_view_alone(db):
+    db.add(database.Employee(id="emp_2", name="B", email="b@example.com"))
+    add_nudge(db, "emp_2", "Kept")
+    db.commit()
+
+    add_nudge(db, "emp_2", "Discarded")
+    db.flush()
+    db.rollback()
+
+    assert view(db, "emp_2").snippet == "Kept"
+
+
+def test_refresh_nudge_views_after_raw_sql(db):
+    db.add(database.Employee(id="emp_3", name="C", email="c@example.com"))
+    add_nudge(db, "emp_3", "Old title")
+    db.commit()
+
+    db.execute(text("UPDATE nudges SET title = 'New title' WHERE employee_id = 'emp_3'"))
+    assert view(db, "emp_3").snippet == "Old title"
+    blocks = nudges.refresh_nudge_views(db.connection(), ["emp_3"])
+    db.commit()
+
+    assert blocks["emp_3"].snippet == "New title"
+    assert view(db, "emp_3").snippet == "New title"
+
+
+def test_nudge_fingerprint_ignores_order_and_whitespace():
+    a = {"title": "Low score", "instructions": "Talk to  your manager", "metrics": "Value: 2"}
+    b = {"title": "Late", "instructions": "Arrive by 9", "metrics": "Value: 6"}
+    fingerprint = nudges.nudge_fingerprint([a, b], "Be kind", user_id="mgr_1")
+
+    assert len(fingerprint) == 64
+    assert nudges.nudge_fingerprint([b, dict(a, instructions="Talk to your manager ")], " Be  kind", user_id="mgr_1") == fingerprint
+    assert nudges.nudge_fingerprint([a, dict(b, metrics="Value: 7")], "Be kind", user_id="mgr_1") != fingerprint
+    assert nudges.nudge_fingerprint([a, b], "Be firm", user_id="mgr_1") != fingerprint
+    assert nudges.nudge_fingerprint([a, b], "Be kind", user_id="mgr_1", model="other-model") != fingerprint
+
+
+def test_nudge_fingerprint_depends_on_the_style_owner():
+    items = [{"title": "Low score", "instructions": "-", "metrics": "-"}]
+
+    assert nudges.nudge_fingerprint(items, "p", user_id="mgr_1") != nudges.nudge_fingerprint(items, "p", user_id="mgr_2")
+    assert nudges.nudge_fingerprint(items, "p") != nudges.nudge_fingerprint(items, "p", user_id="mgr_1")
+
+
+def test_migrate_db_adds_only_nullable_columns(db):
+    db.execute(text("DROP INDEX ix_nudge_summaries_employee_fingerprint"))
+    db.execute(text("ALTER TABLE nudge_summaries DROP COLUMN nudge_fingerprint"))
+    db.commit()
+
+    database.migrate_db()
+
+    inspector = inspect(database.engine)
+    assert "nudge_fingerprint" in {column["name"] for column in inspector.get_columns("nudge_summaries")}
+    assert "ix_nudge_summaries_employee_fingerprint" in {index["name"] for index in inspector.get_indexes("nudge_summaries")}
+
+    db.execute(text("ALTER TABLE nudge_views DROP COLUMN nudge_count"))
+    db.commit()
+    with pytest.raises(RuntimeError, match="nudge_views.nudge_count"):
+        database.migrate_db()
+
+
+def test_dashboard_requests_the_nightly_summary_prompt():
+    with open(os.path.join(os.path.dirname(database.__file__), "static", "demo.html"), encoding="utf-8") as f:
+        assert f'prompt: "{nudges.SUMMARY_PROMPT}"' in f.read()
@@ -0,0 +1,112 @@
+import fakeredis
+import pytest
+from stylemail.generator import EmailGenerator, NudgeEmailGenerator, NudgeSummaryGenerator
+from stylemail.prompting import TRUNCATION_MARK, PromptBudget, PromptBuilder, prompt_stats
+from stylemail import tokens
+from stylemail.tokens import count_tokens
+from stylemail.vectorstore import UserVectorStore
+
+MODEL = "gpt-4o"
+
+
+def store():
+    s = UserVectorStore()
+    s.redis = fakeredis.FakeRedis()
+    return s
+
+
+@pytest.fixture
+def exact_counts(monkeypatch):
+    """Cut instructions as if tiktoken were installed, whichever counter is in use."""
+    monkeypatch.setattr("stylemail.prompting.exact_counts", lambda model: True)
+
+
+def test_items_are_cut_and_dropped_in_priority_order():
+    items = ["short one", "x" * 4000, "a somewhat longer sample than the last", "tail"]
+    sep = count_tokens("\n\n", MODEL)
+    # Room for the first two items and "tail", but not the third item.
+    budget = count_tokens("short one", MODEL) + sep + 40 + sep + count_tokens("tail", MODEL)
+    prompt = PromptBuilder(MODEL).items("style", items, max_tokens=budget, item_tokens=40).build()
+
+    kept = prompt.text.split("\n\n")
+    assert kept[0] == "short one"
+    assert kept[1].endswith(TRUNCATION_MARK)
+    assert count_tokens(kept[1], MODEL) <= 40
+    assert prompt.tokens["style"] <= budget
+    assert prompt.truncated["style"] == 1
+    # Dropping stops at the first item that doesn't fit, even if a later one would.
+    assert prompt.dropped["style"] == len(items) - len(kept)
+    assert "tail" not in kept
+
+
+def test_build_is_deterministic_and_counts_every_section(exact_counts):
+    def build():
+        return (
+            PromptBuilder(MODEL)
+            .template("Examples:\n")
+            .items("style", ["a" * 300, "b" * 300, "c" * 300], 120, 60)
+            .template("\nRequest:\n")
+            .text("instructions", "y" * 1000, 50)
+            .build()
+        )
+
+    first, second = build(), build()
+    assert first == second
+    assert set(first.tokens) == {"template", "style", "instructions", "total"}
+    assert first.tokens["total"] == count_tokens(first.text, MODEL)
+    assert "instructions:1" in prompt_stats(first)
+
+
+def test_email_prompt_stays_within_budget(exact_counts):
+    budget = PromptBudget(instruction_tokens=50, style_tokens=200, sample_tokens=80)
+    generator = EmailGenerator("sk-test", store(), prompt_budget=budget)
+    samples = [f"sample {i} " + "word " * 500 for i in range(10)]
+
+    prompt = generator.compose_prompt(samples, "Subject: Hi\n\n" + "please " * 500)
+
+    assert prompt.tokens["style"] <= 200
+    assert prompt.tokens["instructions"] <= 50
+    assert prompt.text.startswith("You are an assistant that writes emails")
+    assert "sample 0" in prompt.text and "sample 9" not in prompt.text
+
+
+def test_small_inputs_are_left_untouched():
+    generator = EmailGenerator("sk-test", store())
+    text = generator.build_prompt(["Thanks!", "See you soon."], "Subject: Hi\n\nSay hi")
+    assert "Thanks!\n\nSee you soon.\n\nNow write an email" in text
+    assert text.endswith("Subject: Hi\n\nSay hi")
+
+
+def test_nudge_prompts_drop_trailing_nudges():
+    nudges = [{"title": f"Nudge {i}", "instructions": "do " * 50, "metrics": "m"} for i in range(40)]
+    budget = PromptBudget(nudge_tokens=300, item_nudge_tokens=100)
+
+    for generator in (NudgeEmailGenerator("sk-test", store(), prompt_budget=budget), NudgeSummaryGenerator("sk-test", store(), prompt_budget=budget)):
+        prompt = generator.compose_prompt("Check in with Sally", nudges)
+        assert prompt.tokens["nudges"] <= 300
+        assert "Nudge 0" in prompt.text and "Nudge 39" not in prompt.text
+        assert prompt.dropped["nudges"] > 0
+        assert generator.build_prompt("Check in with Sally", nudges) == prompt.text
+
+
+def test_fallback_counts_a_token_per_character(monkeypatch):
+    monkeypatch.setattr(tokens, "_tiktoken", False)
+    text = "Quarterly numbers: 1,234,567.89 (up 3.2%) https://example.com/a?b=c"
+
+    assert tokens.count_tokens(text, MODEL) == len(text)
+    assert tokens.truncate_to_tokens(text, 10, MODEL) == text[:10]
+    assert tokens.truncate_to_tokens(text, 1000, MODEL) == text
+
+
+def test_instructions_are_only_cut_with_exact_counts(monkeypatch, caplog):
+    request = "Please follow up on the proposal. " * 20
+    monkeypatch.setattr(tokens, "_tiktoken", False)
+
+    assert PromptBuilder(MODEL).text("instructions", request, max_tokens=50).build().text == request
+
+    monkeypatch.setattr("stylemail.prompting.exact_counts", lambda model: True)
+    with caplog.at_level("WARNING"):
+        prompt = PromptBuilder(MODEL).text("instructions", request, max_tokens=50).build()
+    assert prompt.text.endswith(TRUNCATION_MARK)
+    assert prompt.truncated == {"instructions": 1}
+    assert "Truncated instructions" in caplog.text
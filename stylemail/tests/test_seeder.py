@@ -0,0 +1,52 @@
+import threading
+from types import SimpleNamespace
+import fakeredis
+from stylemail.seeder import StyleSeeder
+from stylemail.tokens import chunk_by_tokens
+from stylemail.vectorstore import UserVectorStore
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def create(self, input, model):
+        with self._lock:
+            self.requests.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0]) for t in input])
+
+
+def make_seeder(**kwargs):
+    store = UserVectorStore()
+    store.redis = fakeredis.FakeRedis()
+    embeddings = FakeEmbeddings()
+    seeder = StyleSeeder("sk-test", store, client=SimpleNamespace(embeddings=embeddings), **kwargs)
+    return seeder, embeddings
+
+
+def test_seed_chunks_requests_and_writes_one_pipeline_per_chunk():
+    seeder, embeddings = make_seeder(max_request_inputs=100)
+    samples = [f"sample {i}" for i in range(1000)]
+
+    assert seeder.seed_user_style("u1", samples + samples[:10]) == 1000
+    assert len(embeddings.requests) == 10
+    assert all(len(r) == 100 for r in embeddings.requests)
+    assert len(seeder.vector_store.get_all_embeddings("u1")) == 1000
+    # One version bump per chunk rather than per sample.
+    assert int(seeder.vector_store.redis.get(seeder.vector_store._version_key("u1"))) == 10
+
+
+def test_seed_skips_samples_already_stored():
+    seeder, embeddings = make_seeder()
+    seeder.seed_user_style("u1", ["a", "b"])
+    seeder.embedding_cache = type(seeder.embedding_cache)(fakeredis.FakeRedis())
+
+    assert seeder.seed_user_style("u1", ["a", "b", "c"]) == 1
+    assert embeddings.requests[-1] == ["c"]
+    assert seeder.seed_user_style("u1", ["a"]) == 0
+
+
+def test_chunk_by_tokens_respects_budget_and_count():
+    assert list(chunk_by_tokens([5, 5, 5, 20, 1], max_tokens=10, max_items=10)) == [[0, 1], [2], [3], [4]]
+    assert list(chunk_by_tokens([1, 1, 1], max_tokens=10, max_items=2)) == [[0, 1], [2]]
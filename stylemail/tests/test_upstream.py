@@ -0,0 +1,251 @@
+import asyncio
+import random
+import time
+import httpx
+import openai
+import pytest
+from openai import OpenAI
+from stylemail.benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from stylemail.concurrency import LLMLimiter
+from stylemail.upstream import (
+    CircuitBreaker,
+    RateLimitBucket,
+    RetryPolicy,
+    UpstreamGuard,
+    UpstreamUnavailableError,
+    parse_duration,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def status_error(cls, status, headers=None, code=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "http://upstream/v1/chat/completions"))
+    return cls("upstream error", response=response, body={"code": code} if code else None)
+
+
+class FlakyResource:
+    """Stands in for client.chat.completions: raises the queued errors, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"ok": True}
+
+
+def guard(**policy):
+    return UpstreamGuard("test", RetryPolicy(base_delay=0.001, max_delay=0.002, **policy), rng=random.Random(0))
+
+
+def test_parse_duration():
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == pytest.approx(360.0)
+    assert parse_duration("1.5s") == pytest.approx(1.5)
+    assert parse_duration("2") == 2.0
+    assert parse_duration("") is None
+
+
+def test_bucket_paces_from_rate_limit_headers():
+    clock = FakeClock()
+    bucket = RateLimitBucket(clock)
+    assert bucket.reserve() == 0
+
+    # 60 per minute with none left: one request a second.
+    bucket.observe({"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "60s"})
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+    clock.now += 10
+    assert bucket.reserve() == 0
+
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5.0)
+
+
+def test_retries_rate_limit_then_succeeds():
+    resource = FlakyResource(status_error(openai.RateLimitError, 429, {"retry-after-ms": "5"}), status_error(openai.InternalServerError, 503))
+    upstream = guard()
+
+    assert upstream.call(resource, model="m") == {"ok": True}
+    assert resource.calls == 3
+    assert upstream.breaker.state == "closed"
+
+
+def test_does_not_retry_client_errors_or_exhausted_quota():
+    bad_request = FlakyResource(status_error(openai.BadRequestError, 400))
+    with pytest.raises(openai.BadRequestError):
+        guard().call(bad_request)
+    assert bad_request.calls == 1
+
+    no_quota = FlakyResource(status_error(openai.RateLimitError, 429, code="insufficient_quota"))
+    with pytest.raises(openai.RateLimitError):
+        guard().call(no_quota)
+    assert no_quota.calls == 1
+
+
+def test_gives_up_after_max_retries():
+    resource = FlakyResource(*(status_error(openai.InternalServerError, 500) for _ in range(5)))
+    with pytest.raises(UpstreamUnavailableError) as excinfo:
+        guard(max_retries=2).call(resource)
+    assert resource.calls == 3
+    assert isinstance(excinfo.value.__cause__, openai.InternalServerError)
+
+
+def test_retry_budget_limits_retries():
+    upstream = guard(budget_ratio=0.0, budget_burst=1.0)
+    resource = FlakyResource(*(status_error(openai.InternalServerError, 500) for _ in range(3)))
+
+    with pytest.raises(UpstreamUnavailableError, match="budget"):
+        upstream.call(resource)
+    assert resource.calls == 2
+
+
+def test_circuit_opens_and_recovers_after_trial_call():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_in() == pytest.approx(30)
+
+    clock.now += 30
+    assert breaker.allow()
+    assert not breaker.allow()  # Only one trial call at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_open_circuit_fails_fast():
+    upstream = guard(max_retries=0, failure_threshold=1)
+    with pytest.raises(UpstreamUnavailableError):
+        upstream.call(FlakyResource(status_error(openai.InternalServerError, 500)))
+
+    resource = FlakyResource()
+    with pytest.raises(UpstreamUnavailableError, match="circuit open") as excinfo:
+        upstream.call(resource)
+    assert resource.calls == 0
+    assert excinfo.value.retry_after > 0
+
+
+def test_rate_limited_server_is_paced_not_failed():
+    config = FakeOpenAIConfig(embedding_dim=8, embedding_latency=0, requests_per_minute=600)
+    with FakeOpenAIServer(config) as fake:
+        client = OpenAI(api_key="sk-fake", base_url=fake.base_url, max_retries=0)
+        upstream = guard(max_retries=5)
+        # Start with two requests left of the minute's 600.
+        fake._buckets["/v1/embeddings"] = [2.0, time.monotonic()]
+        for _ in range(5):
+            response = upstream.call(client.embeddings, input=["hi"], model="text-embedding-3-small")
+            assert len(response.data[0].embedding) == 8
+        client.close()
+    assert upstream.bucket.rate == pytest.approx(10, rel=0.5)
+
+
+def test_cancelled_trial_call_frees_the_half_open_circuit():
+    clock = FakeClock()
+    upstream = UpstreamGuard("test", RetryPolicy(max_retries=0, failure_threshold=1, reset_timeout=30), clock=clock)
+    with pytest.raises(UpstreamUnavailableError):
+        upstream.call(FlakyResource(status_error(openai.InternalServerError, 500)))
+    clock.now += 30
+
+    class AsyncResource:
+        def __init__(self, delay):
+            self.delay = delay
+
+        async def create(self, **kwargs):
+            await asyncio.sleep(self.delay)
+            return {"ok": True}
+
+    async def main():
+        trial = asyncio.ensure_future(upstream.acall(AsyncResource(10)))
+        await asyncio.sleep(0.01)
+        assert upstream.breaker.state == "half_open"
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await upstream.acall(AsyncResource(0))
+
+    assert asyncio.run(main()) == {"ok": True}
+    assert upstream.breaker.state == "closed"
+
+
+def test_backoff_does_not_hold_an_llm_slot():
+    limiter = LLMLimiter(1)
+    throttled = UpstreamGuard("test", RetryPolicy(base_delay=0.2, max_delay=0.2), rng=random.Random(0), limiter=limiter)
+    other = UpstreamGuard("other", limiter=limiter)
+    seen = []
+
+    class AsyncResource:
+        def __init__(self, *errors):
+            self.errors = list(errors)
+
+        async def create(self, **kwargs):
+            seen.append(limiter.in_flight)
+            if self.errors:
+                raise self.errors.pop(0)
+            return {"ok": True}
+
+    async def main():
+        retried = asyncio.ensure_future(throttled.acall(AsyncResource(status_error(openai.RateLimitError, 429, {"retry-after-ms": "200"}))))
+        await asyncio.sleep(0.05)
+        # The throttled call is waiting to retry; the slot is free meanwhile.
+        assert limiter.in_flight == 0
+        assert await asyncio.wait_for(other.acall(AsyncResource()), 0.1) == {"ok": True}
+        assert await retried == {"ok": True}
+
+    asyncio.run(main())
+    assert seen == [1, 1, 1]
+
+
+def test_stream_frees_its_slot_when_upstream_finishes():
+    limiter = LLMLimiter(1)
+    upstream = UpstreamGuard("test", limiter=limiter)
+
+    class StreamResource:
+        def create(self, **kwargs):
+            return iter(["a", "b", "c"])
+
+    with upstream.stream(StreamResource(), stream=True) as chunks:
+        deadline = time.monotonic() + 1
+        while limiter.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Nothing has been read yet, but the response is buffered.
+        assert limiter.in_flight == 0
+        assert list(chunks) == ["a", "b", "c"]
+
+    with pytest.raises(openai.BadRequestError):
+        with upstream.stream(FlakyResource(status_error(openai.BadRequestError, 400)), stream=True):
+            pass
+
+
+def test_astream_frees_its_slot_when_upstream_finishes():
+    limiter = LLMLimiter(1)
+    upstream = UpstreamGuard("test", limiter=limiter)
+
+    class AsyncStreamResource:
+        async def create(self, **kwargs):
+            async def chunks():
+                for chunk in ["a", "b", "c"]:
+                    yield chunk
+            return chunks()
+
+    async def main():
+        async with upstream.astream(AsyncStreamResource(), stream=True) as chunks:
+            await asyncio.sleep(0.01)
+            assert limiter.in_flight == 0
+            return [chunk async for chunk in chunks]
+
+    assert asyncio.run(main()) == ["a", "b", "c"]
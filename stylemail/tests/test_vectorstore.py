@@ -0,0 +1,177 @@
+import json
+import time
+import fakeredis
+import numpy as np
+import pytest
+from stylemail.ann import IVFIndex, top_k_indices
+from stylemail.cache import UserMatrixCache
+from stylemail.vectorstore import UserVectorStore
+
+
+@pytest.fixture
+def store():
+    store = UserVectorStore()
+    store.redis = fakeredis.FakeRedis()
+    return store
+
+
+def test_store_and_get_roundtrip(store):
+    store.store_embedding("u1", "Hello there", [0.25, -0.5, 1.0])
+    entries = store.get_all_embeddings("u1")
+
+    assert len(entries) == 1
+    assert entries[0]["text"] == "Hello there"
+    assert entries[0]["embedding"].dtype == np.float32
+    np.testing.assert_array_equal(entries[0]["embedding"], [0.25, -0.5, 1.0])
+
+
+def test_packed_payload_is_float32(store):
+    embedding = [0.1] * 1536
+    store.store_embedding("u1", "sample", embedding)
+    raw = store.redis.hget(store._user_key("u1"), store._hash_text("sample"))
+
+    assert len(raw) == 1536 * 4
+    assert len(raw) < len(json.dumps({"text": "sample", "embedding": embedding}))
+
+
+def test_legacy_json_entries_are_read_and_migrated(store):
+    doc_id = store._hash_text("legacy")
+    store.redis.hset(store._user_key("u1"), doc_id, json.dumps({"text": "legacy", "embedding": [1.0, 2.0]}))
+    store.store_embedding("u1", "fresh", [3.0, 4.0])
+
+    texts = sorted(e["text"] for e in store.get_all_embeddings("u1"))
+    assert texts == ["fresh", "legacy"]
+
+    assert store.migrate_all() == 1
+    assert store.migrate_user("u1") == 0
+    raw = store.redis.hget(store._user_key("u1"), doc_id)
+    np.testing.assert_array_equal(np.frombuffer(raw, dtype="<f4"), [1.0, 2.0])
+
+
+def test_clear_user_data(store):
+    store.store_embedding("u1", "sample", [1.0])
+    store.clear_user_data("u1")
+
+    assert store.get_all_embeddings("u1") == []
+    assert not store.redis.exists(store._texts_key("u1"))
+
+
+@pytest.fixture
+def cached_store():
+    server = fakeredis.FakeServer()
+    store = UserVectorStore(matrix_cache=UserMatrixCache())
+    store.redis = fakeredis.FakeRedis(server=server)
+    return store, server
+
+
+def test_matrix_cache_serves_hot_users_and_sees_other_writers(cached_store):
+    store, server = cached_store
+    other = UserVectorStore()
+    other.redis = fakeredis.FakeRedis(server=server)
+
+    store.store_embedding("u1", "first", [1.0, 0.0])
+    texts, matrix = store.get_embedding_matrix("u1")
+    assert texts == ["first"]
+    assert store.get_embedding_matrix("u1")[1] is matrix
+
+    # A write from another worker bumps the version counter.
+    other.store_embedding("u1", "second", [0.0, 2.0])
+    texts, matrix = store.get_embedding_matrix("u1")
+    assert sorted(texts) == ["first", "second"]
+    np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0)
+
+    other.clear_user_data("u1")
+    assert store.get_embedding_matrix("u1")[0] == []
+
+
+def test_matrix_cache_evicts_by_bytes():
+    cache = UserMatrixCache(max_bytes=100)
+    cache.put("a", 1, ["x"], np.zeros((2, 8), dtype=np.float32))
+    cache.put("b", 1, ["y"], np.zeros((2, 8), dtype=np.float32))
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.current_bytes <= 100
+
+
+def test_invalidation_listener_evicts_without_version_checks(cached_store):
+    store, server = cached_store
+    other = UserVectorStore()
+    other.redis = fakeredis.FakeRedis(server=server)
+    store.store_embedding("u1", "first", [1.0, 0.0])
+
+    store.start_invalidation_listener()
+    try:
+        deadline = time.time() + 5
+        while not store._listening and time.time() < deadline:
+            time.sleep(0.01)
+        assert store._listening
+        store.get_embedding_matrix("u1")
+        assert store.matrix_cache.get("u1") is not None
+
+        other.store_embedding("u1", "second", [0.0, 1.0])
+        deadline = time.time() + 5
+        while store.matrix_cache.get("u1") is not None and time.time() < deadline:
+            time.sleep(0.01)
+        assert sorted(store.get_embedding_matrix("u1")[0]) == ["first", "second"]
+    finally:
+        store.stop_invalidation_listener()
+
+
+def test_ivf_index_built_persisted_and_kept_in_sync():
+    store = UserVectorStore(matrix_cache=UserMatrixCache(), ann_threshold=100)
+    store.redis = fakeredis.FakeRedis()
+    rng = np.random.default_rng(0)
+    for i, vector in enumerate(rng.standard_normal((150, 8))):
+        store.store_embedding("u1", f"sample {i}", vector.tolist())
+
+    texts, matrix, index = store.get_search_index("u1")
+    assert index is not None and index.contiguous
+    assert store.redis.hlen(store._ivf_lists_key("u1")) == 150
+
+    # Probing every list is exact search.
+    index.n_probe = index.n_lists
+    query = matrix[7]
+    assert index.search(matrix, texts, query, 3)[0] == 7
+
+    # A new sample is filed under the existing centroids, not retrained.
+    store.store_embedding("u1", "fresh", rng.standard_normal(8).tolist())
+    value = store.redis.hget(store._ivf_lists_key("u1"), store._hash_text("fresh"))
+    assert value.decode().startswith(index.build_id + ":")
+    assert store.get_search_index("u1")[2].build_id == index.build_id
+
+    store.clear_user_data("u1")
+    assert not store.redis.exists(store._ivf_centroids_key("u1"), store._ivf_lists_key("u1"))
+
+
+def test_small_corpora_use_exact_search(store):
+    store.store_embedding("u1", "only", [1.0, 0.0])
+    assert store.get_search_index("u1")[2] is None
+
+
+def test_ivf_search_scans_everything_when_probed_lists_are_short():
+    # Two tight clusters, but four lists: the two lists nearest the query are
+    # empty, so probing them alone would find nothing.
+    rng = np.random.default_rng(0)
+    east = np.array([1.0, 0.0, 0.0]) + 0.01 * rng.standard_normal((20, 3))
+    north = np.array([0.0, 1.0, 0.0]) + 0.01 * rng.standard_normal((20, 3))
+    matrix = np.vstack([east, north]).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    texts = [f"sample {i}" for i in range(len(matrix))]
+    centroids = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 0.6, 0.8]], dtype=np.float32)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    index = IVFIndex(centroids, [0] * 20 + [1] * 20, n_probe=2)
+    query = np.array([0.0, 0.2, 1.0], dtype=np.float32)
+    query /= np.linalg.norm(query)
+
+    assert index.search(matrix, texts, query, 5) == top_k_indices(matrix @ query, texts, 5)
+    assert len(index.grouped().search(matrix, texts, query, 5)) == 5
+
+
+def test_top_k_matches_a_full_sort_when_scores_tie_at_the_boundary():
+    # Duplicate samples score the same; many of them straddle the top-k cut.
+    scores = np.array([0.9, 0.5, 0.5, 0.5, 0.5, 0.5, 0.1, 0.5], dtype=np.float32)
+    texts = ["a", "b", "f", "c", "e", "d", "g", "h"]
+    for top_k in range(1, len(texts) + 1):
+        expected = [text for _, text in sorted(zip(scores.tolist(), texts), reverse=True)[:top_k]]
+        assert [texts[i] for i in top_k_indices(scores, texts, top_k)] == expected
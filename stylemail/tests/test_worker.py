@@ -0,0 +1,88 @@
+import io
+import json
+import threading
+import pytest
+from stylemail.worker import Worker
+
+
+def run(worker, *lines):
+    out = io.StringIO()
+    worker.serve_stream(io.StringIO("".join(line + "\n" for line in lines)), out)
+    return {r["id"]: r for r in map(json.loads, out.getvalue().splitlines())}
+
+
+def fail(params):
+    raise ValueError("user_id must be a non-empty string")
+
+
+def test_serve_stream_answers_each_request_by_id():
+    worker = Worker({"echo": lambda params: params["value"], "fail": fail})
+    responses = run(
+        worker,
+        json.dumps({"id": 1, "method": "echo", "params": {"value": "a"}}),
+        "",
+        json.dumps({"id": 2, "method": "fail", "params": {}}),
+        json.dumps({"id": 3, "method": "missing"}),
+    )
+
+    assert responses[1] == {"id": 1, "result": "a"}
+    assert responses[2] == {"id": 2, "error": "user_id must be a non-empty string"}
+    assert responses[3]["error"] == "Unknown method: missing"
+
+
+def test_serve_stream_reports_invalid_json_and_keeps_serving():
+    worker = Worker({"ping": lambda params: "pong"})
+    responses = run(worker, "{not json", "[1, 2]", json.dumps({"id": 7, "method": "ping"}))
+
+    assert responses[7] == {"id": 7, "result": "pong"}
+    assert responses[None]["error"].startswith("Invalid request")
+
+
+def test_serve_stream_runs_requests_concurrently():
+    # The first request only finishes once the second has started, which
+    # times out unless requests run in parallel.
+    started = threading.Event()
+
+    def slow(params):
+        assert started.wait(timeout=5)
+        return "slow"
+
+    def fast(params):
+        started.set()
+        return "fast"
+
+    worker = Worker({"slow": slow, "fast": fast}, max_workers=2)
+    out = io.StringIO()
+    worker.serve_stream(io.StringIO('{"id": 1, "method": "slow"}\n{"id": 2, "method": "fast"}\n'), out)
+
+    results = {r["id"]: r["result"] for r in map(json.loads, out.getvalue().splitlines())}
+    assert results == {1: "slow", 2: "fast"}
+
+
+def test_serve_stream_reports_unserializable_and_uncaught_failures():
+    class Abort(BaseException):
+        pass
+
+    def abort(params):
+        raise Abort("stopped")
+
+    worker = Worker({"object": lambda params: object(), "abort": abort, "ping": lambda params: "pong"})
+    responses = run(
+        worker,
+        json.dumps({"id": 1, "method": "object"}),
+        json.dumps({"id": 2, "method": "abort"}),
+        json.dumps({"id": 3, "method": "ping"}),
+    )
+
+    assert responses[1]["error"].startswith("Unserializable result")
+    assert responses[2] == {"id": 2, "error": "stopped"}
+    assert responses[3] == {"id": 3, "result": "pong"}
+
+
+def test_serve_unix_does_not_delete_other_files(tmp_path):
+    path = tmp_path / "not-a-socket"
+    path.write_text("keep me")
+
+    with pytest.raises(OSError):
+        Worker({}).serve_unix(str(path))
+    assert path.read_text() == "keep me"
@@ -0,0 +1,76 @@
+"""
+Token counting for request budgets.
+
+Counts are exact with tiktoken (a listed requirement). Without it each
+character is counted as a token: an over-estimate for nearly all text, so
+budgets and the embedding input cap still hold, at the cost of using less
+of them.
+"""
+from typing import Iterator, List, Sequence
+
+# tiktoken is imported on first use: loading it and its encodings is the
+# slowest part of importing the seeders.
+_tiktoken = None
+_encodings = {}
+
+
+def _load_tiktoken():
+    global _tiktoken
+    if _tiktoken is None:
+        try:
+            import tiktoken
+        except ImportError:  # pragma: no cover - depends on the environment
+            tiktoken = False
+        _tiktoken = tiktoken
+    return _tiktoken
+
+
+def _encoding(model: str):
+    tiktoken = _load_tiktoken()
+    if not tiktoken:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def exact_counts(model: str) -> bool:
+    """True when counts for model come from tiktoken rather than the fallback estimate."""
+    return _encoding(model) is not None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Cut text down to at most max_tokens tokens."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max(0, max_tokens)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def chunk_by_tokens(counts: Sequence[int], max_tokens: int, max_items: int) -> Iterator[List[int]]:
+    """
+    Split items with the given token counts into runs of indices whose total
+    stays within max_tokens and whose length stays within max_items. An item
+    larger than max_tokens gets a chunk of its own.
+    """
+    chunk: List[int] = []
+    total = 0
+    for i, count in enumerate(counts):
+        if chunk and (total + count > max_tokens or len(chunk) >= max_items):
+            yield chunk
+            chunk, total = [], 0
+        chunk.append(i)
+        total += count
+    if chunk:
+        yield chunk
@@ -0,0 +1,472 @@
+"""
+Retries, pacing and circuit breaking for OpenAI calls.
+
+Chat and embeddings requests each go through their own UpstreamGuard
+(CHAT_UPSTREAM and EMBEDDINGS_UPSTREAM), because OpenAI rate-limits each
+model separately. For every attempt a guard:
+
+1. fails fast with UpstreamUnavailableError while its circuit is open;
+2. waits for its token bucket. The bucket's rate follows the x-ratelimit-*
+   headers of earlier responses, and a 429's retry-after pauses every caller;
+3. retries 429s, 5xx responses, timeouts and connection errors with
+   full-jitter exponential backoff, as long as the retry budget allows.
+
+Each attempt takes an LLM_LIMITER slot only once its pacing wait is over,
+so a throttled call doesn't keep other calls from running. stream() and
+astream() buffer a streamed response, so the slot is given back when OpenAI
+finishes sending rather than when the caller finishes reading.
+
+The OpenAI SDK's own retries are turned off (max_retries=0) on the clients
+this package creates, so each request is retried in exactly one place.
+"""
+import asyncio
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Mapping, Optional, Tuple
+import openai
+from stylemail.concurrency import LLM_LIMITER, LLMLimiter
+from stylemail.metrics import REGISTRY, span
+
+THROTTLE_SECONDS = REGISTRY.counter(
+    "stylemail_upstream_throttle_seconds_total",
+    "Seconds OpenAI calls waited before being sent: rate-limit pacing or retry backoff.",
+    ["api", "reason"],
+)
+UPSTREAM_RETRIES = REGISTRY.counter("stylemail_upstream_retries_total", "Retried OpenAI calls by error kind.", ["api", "reason"])
+UPSTREAM_FAILURES = REGISTRY.counter(
+    "stylemail_upstream_failures_total",
+    "OpenAI calls given up on: retries or retry budget exhausted, or rejected by the open circuit.",
+    ["api", "reason"],
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in an OpenAI reset header such as "20ms", "1s" or "6m0s"."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """OpenAI is failing or throttling us; retry_after is a hint in seconds for the caller's client."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    # Each call adds budget_ratio retry tokens (up to budget_burst) and each
+    # retry spends one, so retries stay a bounded share of traffic.
+    budget_ratio: float = 0.2
+    budget_burst: float = 10.0
+    # Consecutive 5xx/timeout/connection failures that open the circuit, and
+    # how long it stays open before one trial call is let through.
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+    def backoff(self, retry: int, rng: random.Random) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base_delay * 2**retry)]."""
+        return rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class RateLimitBucket:
+    """
+    Token bucket for requests, sized from the x-ratelimit-* response headers.
+    It doesn't pace anything until the first headers arrive.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.rate: Optional[float] = None  # requests per second
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.paused_until = 0.0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one request slot and return how long to wait before sending it."""
+        with self._lock:
+            now = self.clock()
+            wait = max(0.0, self.paused_until - now)
+            if self.rate:
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        limit = _header_int(headers, "x-ratelimit-limit-requests")
+        remaining = _header_int(headers, "x-ratelimit-remaining-requests")
+        reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        with self._lock:
+            now = self.clock()
+            if limit and remaining is not None:
+                self.capacity = float(limit)
+                self.tokens = float(remaining)
+                self._updated = now
+                # The reset header is the time until the used requests are
+                # back, which gives the refill rate. Limits are per minute.
+                used = limit - remaining
+                self.rate = used / reset if used > 0 and reset else self.rate or limit / 60.0
+            if _header_int(headers, "x-ratelimit-remaining-tokens") == 0:
+                tokens_reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                if tokens_reset:
+                    self.paused_until = max(self.paused_until, now + tokens_reset)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller, e.g. for a 429's retry-after."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class RetryBudget:
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """closed -> open after failure_threshold failures in a row -> half_open (one trial call) after reset_timeout."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+                return True
+            return self.state == "closed"
+
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+    def record_ignored(self) -> None:
+        """The trial call ended in an error that says nothing about upstream health."""
+        with self._lock:
+            self._trial_running = False
+
+
+def classify_error(error: BaseException) -> Tuple[Optional[str], Optional[float]]:
+    """
+    (reason, retry_after) for a retryable OpenAI error, (None, None) for one
+    that won't succeed on retry (bad request, auth, exhausted quota).
+    """
+    if isinstance(error, openai.RateLimitError):
+        if getattr(error, "code", None) == "insufficient_quota":
+            return None, None
+        reason = "rate_limited"
+    elif isinstance(error, openai.APITimeoutError):
+        reason = "timeout"
+    elif isinstance(error, openai.APIConnectionError):
+        reason = "connection"
+    elif isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code in (408, 409)):
+        reason = "server_error"
+    else:
+        return None, None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = None
+    if headers.get("retry-after-ms"):
+        retry_after = (parse_duration(headers["retry-after-ms"]) or 0) / 1000
+    elif headers.get("retry-after"):
+        retry_after = parse_duration(headers["retry-after"])
+    return reason, retry_after
+
+
+class UpstreamGuard:
+    def __init__(self, api: str, policy: Optional[RetryPolicy] = None, clock: Callable[[], float] = time.monotonic, rng: Optional[random.Random] = None, stage: Optional[str] = None, limiter: LLMLimiter = LLM_LIMITER):
+        """
+        Args:
+            stage (str): metrics span timing each attempt; defaults to api.
+            limiter (LLMLimiter): caps attempts in flight, see stylemail.concurrency.
+        """
+        self.api = api
+        self.stage = stage or api
+        self.limiter = limiter
+        self.policy = policy or RetryPolicy()
+        self.bucket = RateLimitBucket(clock)
+        self.budget = RetryBudget(self.policy.budget_ratio, self.policy.budget_burst)
+        self.breaker = CircuitBreaker(self.policy.failure_threshold, self.policy.reset_timeout, clock)
+        self.rng = rng or random.Random()
+
+    def _admit(self) -> float:
+        """Seconds to wait before sending, or raise if the circuit is open."""
+        if not self.breaker.allow():
+            UPSTREAM_FAILURES.inc(api=self.api, reason="circuit_open")
+            raise UpstreamUnavailableError(f"OpenAI {self.api} calls are failing; circuit open", retry_after=self.breaker.retry_in())
+        wait = self.bucket.reserve()
+        if wait > 0:
+            THROTTLE_SECONDS.inc(wait, api=self.api, reason="pacing")
+        return wait
+
+    def _parse(self, raw) -> Any:
+        self.bucket.observe(raw.headers)
+        self.breaker.record_success()
+        return raw.parse()
+
+    def _retry_delay(self, error: Exception, retry: int) -> float:
+        """Backoff before the next attempt; raises when the error isn't worth retrying."""
+        reason, retry_after = classify_error(error)
+        if reason is None:
+            self.breaker.record_ignored()
+            raise error
+        if reason == "rate_limited":
+            # Throttling isn't an outage, so it doesn't count towards opening the circuit.
+            self.breaker.record_ignored()
+            self.bucket.pause(retry_after or self.policy.base_delay)
+        else:
+            self.breaker.record_failure()
+        if retry >= self.policy.max_retries:
+            UPSTREAM_FAILURES.inc(api=self.api, reason="retries_exhausted")
+            raise UpstreamUnavailableError(f"OpenAI {self.api} call failed after {retry + 1} attempts: {error}", retry_after=retry_after or 1.0) from error
+        if not self.budget.withdraw():
+            UPSTREAM_FAILURES.inc(api=self.api, reason="budget_exhausted")
+            raise UpstreamUnavailableError(f"OpenAI {self.api} retry budget exhausted: {error}", retry_after=retry_after or 1.0) from error
+        UPSTREAM_RETRIES.inc(api=self.api, reason=reason)
+        delay = self.policy.backoff(retry, self.rng)
+        THROTTLE_SECONDS.inc(delay, api=self.api, reason="backoff")
+        return delay
+
+    @contextmanager
+    def open(self, resource, **kwargs) -> Iterator[Any]:
+        """
+        resource.create(**kwargs) for an OpenAI resource such as
+        client.chat.completions. An LLM slot is taken for each attempt only,
+        after pacing, and held for the with block; use stream() for
+        stream=True responses. Backoff between attempts holds no slot.
+        """
+        self.budget.deposit()
+        raw_api = getattr(resource, "with_raw_response", None)
+        retry = 0
+        while True:
+            wait = self._admit()
+            with ExitStack() as attempt:
+                try:
+                    time.sleep(wait)
+                    attempt.enter_context(self.limiter.hold())
+                    with span(self.stage):
+                        if raw_api is None:
+                            response = resource.create(**kwargs)
+                            self.breaker.record_success()
+                        else:
+                            response = self._parse(raw_api.create(**kwargs))
+                except Exception as e:
+                    delay = self._retry_delay(e, retry)
+                except BaseException:
+                    # Cancelled: free the half-open trial slot this call may hold.
+                    self.breaker.record_ignored()
+                    raise
+                else:
+                    yield response
+                    return
+            time.sleep(delay)
+            retry += 1
+
+    @asynccontextmanager
+    async def aopen(self, resource, **kwargs) -> AsyncIterator[Any]:
+        """Async version of open() for AsyncOpenAI resources."""
+        self.budget.deposit()
+        raw_api = getattr(resource, "with_raw_response", None)
+        retry = 0
+        while True:
+            wait = self._admit()
+            async with AsyncExitStack() as attempt:
+                try:
+                    await asyncio.sleep(wait)
+                    await attempt.enter_async_context(self.limiter.slot())
+                    with span(self.stage):
+                        if raw_api is None:
+                            response = await resource.create(**kwargs)
+                            self.breaker.record_success()
+                        else:
+                            response = self._parse(await raw_api.create(**kwargs))
+                except Exception as e:
+                    delay = self._retry_delay(e, retry)
+                except BaseException:
+                    # Cancelled: free the half-open trial slot this call may hold.
+                    self.breaker.record_ignored()
+                    raise
+                else:
+                    yield response
+                    return
+            await asyncio.sleep(delay)
+            retry += 1
+
+    @contextmanager
+    def stream(self, resource, **kwargs) -> Iterator[Iterator[Any]]:
+        """
+        open() for stream=True, yielding an iterator of chunks. A background
+        thread reads the response into a buffer, so the LLM slot is freed as
+        soon as OpenAI finishes sending, however slowly the caller reads.
+        """
+        chunks: "queue.Queue" = queue.Queue()
+        stop = threading.Event()
+
+        def pump():
+            try:
+                with self.open(resource, **kwargs) as response:
+                    chunks.put(_OPENED)
+                    for chunk in response:
+                        if stop.is_set():
+                            break
+                        chunks.put(chunk)
+                chunks.put(_END)
+            except BaseException as e:
+                chunks.put(_Failed(e))
+
+        threading.Thread(target=pump, name=f"{self.api}-stream", daemon=True).start()
+        try:
+            _check(chunks.get())  # Raises here if the call could not be made
+            yield _drain(chunks.get)
+        finally:
+            stop.set()
+
+    @asynccontextmanager
+    async def astream(self, resource, **kwargs) -> AsyncIterator[AsyncIterator[Any]]:
+        """Async version of stream(); the response is read by a task."""
+        chunks: "asyncio.Queue" = asyncio.Queue()
+
+        async def pump():
+            try:
+                async with self.aopen(resource, **kwargs) as response:
+                    chunks.put_nowait(_OPENED)
+                    async for chunk in response:
+                        chunks.put_nowait(chunk)
+                chunks.put_nowait(_END)
+            except Exception as e:
+                chunks.put_nowait(_Failed(e))
+
+        task = asyncio.ensure_future(pump())
+        try:
+            _check(await chunks.get())
+            yield _adrain(chunks.get)
+        finally:
+            # The caller stopped early: stop reading from OpenAI too.
+            task.cancel()
+
+    def call(self, resource, **kwargs) -> Any:
+        """open() for a response that is complete once returned."""
+        with self.open(resource, **kwargs) as response:
+            return response
+
+    async def acall(self, resource, **kwargs) -> Any:
+        async with self.aopen(resource, **kwargs) as response:
+            return response
+
+
+_OPENED = object()
+_END = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _check(item) -> bool:
+    """False at the end of a buffered stream; raises the error that ended it."""
+    if isinstance(item, _Failed):
+        raise item.error
+    return item is not _END
+
+
+def _drain(get: Callable[[], Any]) -> Iterator[Any]:
+    item = get()
+    while _check(item):
+        yield item
+        item = get()
+
+
+async def _adrain(get: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+    item = await get()
+    while _check(item):
+        yield item
+        item = await get()
+
+
+def policy_from_env() -> RetryPolicy:
+    return RetryPolicy(
+        max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "3")),
+        failure_threshold=int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30")),
+    )
+
+
+CHAT_UPSTREAM = UpstreamGuard("chat", policy_from_env())
+EMBEDDINGS_UPSTREAM = UpstreamGuard("embeddings", policy_from_env(), stage="embed_api")
+
+REGISTRY.register_callback(
+    "stylemail_upstream_circuit_open",
+    "1 while calls to this OpenAI API are being rejected (open or half-open circuit).",
+    "gauge",
+    ["api"],
+    lambda: {(guard.api,): int(guard.breaker.state != "closed") for guard in (CHAT_UPSTREAM, EMBEDDINGS_UPSTREAM)},
+)
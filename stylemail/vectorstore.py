@@ -2,36 +2,368 @@ import redis
 import numpy as np
 import hashlib
 import json
-from typing import List
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+from stylemail.ann import IVFIndex, centroids_build_id, outgrown
+from stylemail.cache import UserMatrixCache
+from stylemail.metrics import MATRIX_CACHE, span
+
+# Embeddings are stored as packed little-endian float32 so they can be decoded
+# zero-copy with np.frombuffer instead of round-tripping through JSON.
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def pack_embedding(embedding: Sequence[float]) -> bytes:
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, dtype=EMBEDDING_DTYPE)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Users with at least this many samples are searched through an IVF index.
+DEFAULT_ANN_THRESHOLD = 5000
 
 
 class UserVectorStore:
-    def __init__(self, redis_url: str = None, host: str = "localhost", port: int = 6379, db: int = None, password: str = "", namespace: str = "style_mail_vector"):
+    def __init__(self, redis_url: str = None, host: str = "localhost", port: int = 6379, db: int = None, password: str = "", namespace: str = "style_mail_vector", matrix_cache: Optional[UserMatrixCache] = None, redis_client: Optional[redis.Redis] = None, ann_threshold: Optional[int] = DEFAULT_ANN_THRESHOLD, ann_n_probe: Optional[int] = None):
         kwargs = {"host": host, "port": port, "password": password}
         if db is not None:
             kwargs["db"] = db
-        self.redis = redis.Redis(**kwargs)
+        self.redis = redis_client or redis.Redis(**kwargs)
         self.namespace = namespace
+        self.matrix_cache = matrix_cache
+        # None disables the index; smaller corpora always use exact search.
+        self.ann_threshold = ann_threshold
+        self.ann_n_probe = ann_n_probe
+        self._listener: Optional[threading.Thread] = None
+        self._listener_stop = threading.Event()
+        self._listening = False
 
     def _user_key(self, user_id: str) -> str:
         prefix = f"{self.namespace}:" if self.namespace else ""
         return f"{prefix}user:{user_id}:vectors"
 
+    def _texts_key(self, user_id: str) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}user:{user_id}:texts"
+
+    def _version_key(self, user_id: str) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}user:{user_id}:version"
+
+    def _ivf_centroids_key(self, user_id: str) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}user:{user_id}:ivf:centroids"
+
+    def _ivf_lists_key(self, user_id: str) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}user:{user_id}:ivf:lists"
+
+    def _invalidation_channel(self) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}invalidate"
+
     def _hash_text(self, text: str) -> str:
         return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
     def store_embedding(self, user_id: str, text: str, embedding: List[float]) -> None:
-        key = self._user_key(user_id)
-        doc_id = self._hash_text(text)
-        self.redis.hset(key, doc_id, json.dumps({"text": text, "embedding": embedding}))
+        self.store_embeddings(user_id, [text], [embedding])
+
+    def store_embeddings(self, user_id: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """
+        Store many samples in one pipeline: one multi-field HSET per hash and a
+        single version bump.
+        """
+        if not texts:
+            return
+        pipe = self.redis.pipeline()
+        self._queue_store(pipe, user_id, texts, embeddings)
+        pipe.execute()
+        self._invalidate_local(user_id)
+
+    def _queue_store(self, pipe, user_id: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        doc_ids = [self._hash_text(text) for text in texts]
+        pipe.hset(self._user_key(user_id), mapping={d: pack_embedding(e) for d, e in zip(doc_ids, embeddings)})
+        pipe.hset(self._texts_key(user_id), mapping={d: t.encode("utf-8") for d, t in zip(doc_ids, texts)})
+        for doc_id, embedding in zip(doc_ids, embeddings):
+            self._queue_index_assignment(pipe, user_id, doc_id, embedding)
+        self._bump_version(pipe, user_id)
+
+    def has_samples(self, user_id: str, texts: Sequence[str]) -> List[bool]:
+        """Whether each text is already stored for the user, in one round trip."""
+        if not texts:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for text in texts:
+            pipe.hexists(self._user_key(user_id), self._hash_text(text))
+        return [bool(found) for found in pipe.execute()]
+
+    def _queue_index_assignment(self, pipe, user_id: str, doc_id: str, embedding: Sequence[float]) -> None:
+        """
+        File a new sample under its list when this process holds the user's
+        index. Otherwise the next load assigns it.
+        """
+        cached = self.matrix_cache.get(user_id) if self.matrix_cache is not None else None
+        if cached is None or cached.index is None:
+            return
+        index = cached.index
+        vector = normalize_rows(np.asarray(embedding, dtype=np.float32))
+        if vector.shape[-1] != index.centroids.shape[1]:
+            return
+        label = int(IVFIndex.assign_rows(index.centroids, vector[None, :])[0])
+        pipe.hset(self._ivf_lists_key(user_id), doc_id, f"{index.build_id}:{label}")
+
+    def _bump_version(self, pipe, user_id: str) -> None:
+        # The version key is never deleted, so a cached matrix can't match a
+        # recycled version after clear_user_data.
+        pipe.incr(self._version_key(user_id))
+        pipe.publish(self._invalidation_channel(), user_id)
+
+    def _invalidate_local(self, user_id: str) -> None:
+        if self.matrix_cache is not None:
+            self.matrix_cache.invalidate(user_id)
+
+    def _fetch_raw(self, user_id: str):
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._user_key(user_id))
+        pipe.hgetall(self._texts_key(user_id))
+        pipe.get(self._version_key(user_id))
+        vectors, texts, version = pipe.execute()
+        return vectors, texts, int(version or 0)
 
     def get_all_embeddings(self, user_id: str) -> List[dict]:
-        key = self._user_key(user_id)
         try:
-            raw = self.redis.hgetall(key)
-            return [json.loads(v) for v in raw.values()]
+            vectors, texts, _ = self._fetch_raw(user_id)
+            return self._decode_entries(vectors, texts)
+        except Exception as e:
+            raise RuntimeError(f"Failed to retrieve embeddings from Redis for user '{user_id}': {e}")
+
+    def _decode_entries(self, vectors: dict, texts: dict) -> List[dict]:
+        entries = []
+        for doc_id, raw in vectors.items():
+            text = texts.get(doc_id)
+            key = doc_id.decode("utf-8") if isinstance(doc_id, bytes) else doc_id
+            if text is None:
+                # Legacy entry written as a JSON {"text", "embedding"} blob.
+                legacy = json.loads(raw)
+                entries.append({"doc_id": key, "text": legacy["text"], "embedding": np.asarray(legacy["embedding"], dtype=EMBEDDING_DTYPE)})
+            else:
+                entries.append({"doc_id": key, "text": text.decode("utf-8"), "embedding": unpack_embedding(raw)})
+        return entries
+
+    def get_embedding_matrix(self, user_id: str) -> Tuple[List[str], np.ndarray]:
+        """
+        Return the user's sample texts and a row-aligned (n, dim) float32 matrix
+        of L2-normalized embeddings, ready for a single matmul against a query.
+
+        With a matrix cache configured, hot users are served from memory. While
+        the invalidation listener is running no Redis call is made at all;
+        otherwise a single GET of the user's version counter validates the entry.
+        """
+        texts, matrix, _ = self.get_search_index(user_id)
+        return texts, matrix
+
+    def get_search_index(self, user_id: str) -> Tuple[List[str], np.ndarray, Optional[IVFIndex]]:
+        """
+        Like get_embedding_matrix, plus the user's IVF index when the corpus is
+        at least ann_threshold samples (None means exact search).
+        """
+        cache = self.matrix_cache
+        if cache is None:
+            _, texts, matrix, index = self._load_matrix(user_id)
+            return texts, matrix, index
+
+        if self._listening:
+            cached = cache.get(user_id)
+            if cached is not None:
+                MATRIX_CACHE.inc(result="hit")
+                return cached.texts, cached.matrix, cached.index
+        else:
+            version = int(self.redis.get(self._version_key(user_id)) or 0)
+            cached = cache.get(user_id)
+            if cached is not None and cached.version == version:
+                MATRIX_CACHE.inc(result="hit")
+                return cached.texts, cached.matrix, cached.index
+
+        MATRIX_CACHE.inc(result="miss")
+        generation = cache.generation
+        version, texts, matrix, index = self._load_matrix(user_id)
+        cache.put(user_id, version, texts, matrix, generation=generation, index=index)
+        return texts, matrix, index
+
+    def _load_matrix(self, user_id: str) -> Tuple[int, List[str], np.ndarray, Optional[IVFIndex]]:
+        try:
+            with span("redis_fetch"):
+                vectors, raw_texts, version = self._fetch_raw(user_id)
+            entries = self._decode_entries(vectors, raw_texts)
         except Exception as e:
             raise RuntimeError(f"Failed to retrieve embeddings from Redis for user '{user_id}': {e}")
+        with span("decode"):
+            texts, matrix = self._stack_entries(entries)
+        if not self._wants_index(len(entries)):
+            return version, texts, matrix, None
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._ivf_centroids_key(user_id))
+            pipe.hgetall(self._ivf_lists_key(user_id))
+            centroids, lists = pipe.execute()
+            index, assigned, rebuilt = self._sync_index([e["doc_id"] for e in entries], matrix, centroids, lists)
+            if assigned:
+                pipe = self.redis.pipeline()
+                self._queue_index_writes(pipe, user_id, index, assigned, rebuilt)
+                pipe.execute()
+        except Exception as e:
+            logging.warning(f"[vectorstore] IVF index unavailable for user '{user_id}', using exact search: {e}")
+            return version, texts, matrix, None
+        # Keep each list contiguous so searches score matrix slices.
+        texts = [texts[i] for i in index.order]
+        return version, texts, matrix[index.order], index.grouped()
+
+    @staticmethod
+    def _stack_entries(entries: List[dict]) -> Tuple[List[str], np.ndarray]:
+        texts = [e["text"] for e in entries]
+        if not entries:
+            return texts, np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+        matrix = np.vstack([e["embedding"] for e in entries]).astype(np.float32, copy=False)
+        return texts, normalize_rows(matrix)
+
+    def _wants_index(self, n: int) -> bool:
+        return self.ann_threshold is not None and n >= self.ann_threshold
+
+    def _sync_index(self, doc_ids: List[str], matrix: np.ndarray, centroids_raw: Optional[bytes], lists_raw: Dict[bytes, bytes]) -> Tuple[IVFIndex, Dict[str, str], bool]:
+        """
+        Rebuild the index from the stored centroids and list assignments.
+
+        Samples without a valid assignment (new, or filed under an older set of
+        centroids) are assigned to their nearest list. The index is retrained
+        when there are no usable centroids or the corpus has outgrown them.
+        Returns the index, the assignments to persist and whether it was retrained.
+        """
+        dim = matrix.shape[1]
+        centroids = None
+        if centroids_raw and len(centroids_raw) % (4 * dim) == 0:
+            centroids = unpack_embedding(centroids_raw).reshape(-1, dim)
+        if centroids is None or len(centroids) == 0 or outgrown(len(centroids), len(doc_ids)):
+            index = IVFIndex.train(matrix, n_probe=self.ann_n_probe)
+            return index, {d: f"{index.build_id}:{label}" for d, label in zip(doc_ids, index.assignments.tolist())}, True
+
+        build_id = centroids_build_id(centroids)
+        labels = np.full(len(doc_ids), -1, dtype=np.int32)
+        for i, doc_id in enumerate(doc_ids):
+            value = lists_raw.get(doc_id.encode("utf-8"))
+            if value is not None:
+                value_build, _, label = value.decode("utf-8").partition(":")
+                if value_build == build_id:
+                    labels[i] = int(label)
+        missing = np.flatnonzero(labels < 0)
+        if len(missing):
+            labels[missing] = IVFIndex.assign_rows(centroids, matrix[missing])
+        index = IVFIndex(centroids, labels, n_probe=self.ann_n_probe)
+        return index, {doc_ids[i]: f"{build_id}:{labels[i]}" for i in missing.tolist()}, False
+
+    def _queue_index_writes(self, pipe, user_id: str, index: IVFIndex, assigned: Dict[str, str], rebuilt: bool) -> None:
+        lists_key = self._ivf_lists_key(user_id)
+        if rebuilt:
+            pipe.delete(lists_key)
+            pipe.set(self._ivf_centroids_key(user_id), index.centroids.astype(EMBEDDING_DTYPE).tobytes())
+        pipe.hset(lists_key, mapping=assigned)
+
+    def start_invalidation_listener(self) -> None:
+        """
+        Subscribe to the namespace's invalidation channel in a background thread
+        so writes from other workers evict this process's cached matrices.
+        """
+        if self.matrix_cache is None or self._listener is not None:
+            return
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen, name="stylemail-invalidation", daemon=True)
+        self._listener.start()
+
+    def stop_invalidation_listener(self) -> None:
+        self._listener_stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+        self._listener = None
+        self._listening = False
+
+    def _listen(self) -> None:
+        channel = self._invalidation_channel()
+        while not self._listener_stop.is_set():
+            pubsub = self.redis.pubsub()
+            try:
+                pubsub.subscribe(channel)
+                while not self._listener_stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    if message["type"] == "subscribe":
+                        # Anything published before we (re)subscribed was missed.
+                        self.matrix_cache.clear()
+                        self._listening = True
+                    elif message["type"] == "message":
+                        user_id = message["data"]
+                        self.matrix_cache.invalidate(user_id.decode("utf-8") if isinstance(user_id, bytes) else user_id)
+            except Exception as e:
+                logging.warning(f"[vectorstore] Invalidation listener error, falling back to version checks: {e}")
+                self._listening = False
+                self.matrix_cache.clear()
+                self._listener_stop.wait(1.0)
+            finally:
+                self._listening = False
+                pubsub.close()
+
+    def migrate_user(self, user_id: str) -> int:
+        """
+        Rewrite any legacy JSON entries for a user into the packed float32 format.
+        Returns the number of entries migrated.
+        """
+        vectors, texts, _ = self._fetch_raw(user_id)
+        pipe = self.redis.pipeline()
+        migrated = self._queue_migration(pipe, user_id, vectors, texts)
+        if migrated:
+            pipe.execute()
+            self._invalidate_local(user_id)
+        return migrated
+
+    def _queue_migration(self, pipe, user_id: str, vectors: dict, texts: dict) -> int:
+        legacy_ids = [doc_id for doc_id in vectors if doc_id not in texts]
+        for doc_id in legacy_ids:
+            legacy = json.loads(vectors[doc_id])
+            pipe.hset(self._user_key(user_id), doc_id, pack_embedding(legacy["embedding"]))
+            pipe.hset(self._texts_key(user_id), doc_id, legacy["text"].encode("utf-8"))
+        if legacy_ids:
+            self._bump_version(pipe, user_id)
+        return len(legacy_ids)
+
+    def _vectors_pattern(self) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        return f"{prefix}user:*:vectors"
+
+    def _user_id_from_key(self, key) -> str:
+        prefix = f"{self.namespace}:" if self.namespace else ""
+        key = key.decode("utf-8") if isinstance(key, bytes) else key
+        return key[len(f"{prefix}user:"):-len(":vectors")]
+
+    def migrate_all(self) -> int:
+        """
+        Migrate every user in this namespace. Returns the total number of entries migrated.
+        """
+        migrated = 0
+        for key in self.redis.scan_iter(match=self._vectors_pattern()):
+            migrated += self.migrate_user(self._user_id_from_key(key))
+        return migrated
 
     def clear_user_data(self, user_id: str) -> None:
-        self.redis.delete(self._user_key(user_id))
+        pipe = self.redis.pipeline()
+        pipe.delete(self._user_key(user_id), self._texts_key(user_id), self._ivf_centroids_key(user_id), self._ivf_lists_key(user_id))
+        self._bump_version(pipe, user_id)
+        pipe.execute()
+        self._invalidate_local(user_id)
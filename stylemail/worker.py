@@ -0,0 +1,149 @@
+"""
+Long-running worker behind `python -m stylemail.cli serve`.
+
+Clients send one JSON request per line and read one JSON response per line:
+
+    -> {"id": 1, "method": "generate", "params": {"user_id": "u1", "subject": "Hi", "prompt": "..."}}
+    <- {"id": 1, "result": {"subject": "...", "body": "..."}}
+    <- {"id": 2, "error": "user_id must be a non-empty string"}
+
+Requests run concurrently on a thread pool and responses are written as they
+finish, so callers match them to requests by id. The process keeps its Redis
+pool, OpenAI client and caches for its whole lifetime, so a call costs one
+round trip instead of an interpreter start.
+"""
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, IO
+from stylemail import api
+
+Handler = Callable[[Dict[str, Any]], Any]
+
+
+class Worker:
+    def __init__(self, handlers: Dict[str, Handler], max_workers: int = 8):
+        self.handlers = handlers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        request_id = request.get("id")
+        method = request.get("method")
+        handler = self.handlers.get(method)
+        if handler is None:
+            return {"id": request_id, "error": f"Unknown method: {method}"}
+        try:
+            return {"id": request_id, "result": handler(request.get("params") or {})}
+        except Exception as e:
+            return {"id": request_id, "error": str(e)}
+
+    def reply(self, request: Dict[str, Any]) -> str:
+        """handle() as one protocol line; a result that is not JSON becomes an error response."""
+        response = self.handle(request)
+        try:
+            return json.dumps(response)
+        except (TypeError, ValueError) as e:
+            return json.dumps({"id": request.get("id"), "error": f"Unserializable result: {e}"})
+
+    def serve_stream(self, reader: IO[str], writer: IO[str]) -> None:
+        """Answer every request line from reader until EOF, then wait for pending work."""
+        write_lock = threading.Lock()
+        pending = []
+
+        def respond(response: Dict[str, Any]) -> None:
+            write(json.dumps(response))
+
+        def write(line: str) -> None:
+            with write_lock:
+                writer.write(line + "\n")
+                writer.flush()
+
+        def finish(request: Dict[str, Any], future: Future) -> None:
+            # reply() only raises for what handle() does not catch; the future
+            # has captured it, so answer the request rather than lose it.
+            try:
+                line = future.result()
+            except BaseException as e:
+                line = json.dumps({"id": request.get("id"), "error": str(e) or type(e).__name__})
+            write(line)
+
+        for line in reader:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                respond({"id": None, "error": f"Invalid request: {e}"})
+                continue
+            future = self.pool.submit(self.reply, request)
+            future.add_done_callback(lambda f, request=request: finish(request, f))
+            pending.append(future)
+            pending = [f for f in pending if not f.done()]
+        wait(pending)
+
+    def serve_stdio(self) -> None:
+        """
+        Serve over stdin/stdout. Anything else printed to stdout (the
+        generators log their prompts) is redirected to stderr so it cannot
+        corrupt the protocol.
+        """
+        protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        try:
+            self.serve_stream(sys.stdin, protocol_out)
+        finally:
+            protocol_out.close()
+
+    def serve_unix(self, path: str) -> None:
+        """Serve the same protocol to any number of connections on a Unix socket."""
+        worker = self
+
+        class ConnectionHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                worker.serve_stream((line.decode("utf-8") for line in self.rfile), _TextWriter(self.wfile))
+
+        # Replace a stale socket from an earlier run, but never another kind of file.
+        try:
+            if stat.S_ISSOCK(os.lstat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        with socketserver.ThreadingUnixStreamServer(path, ConnectionHandler) as server:
+            server.daemon_threads = True
+            print(f"[worker] Listening on {path}", file=sys.stderr, flush=True)
+            server.serve_forever()
+
+
+class _TextWriter:
+    """Adapts a binary socket file to the str writes used by serve_stream."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, text: str) -> None:
+        self.raw.write(text.encode("utf-8"))
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+
+def api_handlers(store, openai_api_key: str, clients=None, embedding_cache=None) -> Dict[str, Handler]:
+    """Worker methods backed by stylemail.api with shared clients and caches."""
+    shared = {"store": store, "openai_api_key": openai_api_key, "clients": clients}
+    return {
+        "ping": lambda params: "pong",
+        "seed": lambda params: {"stored": api.seed_user_style(params.get("user_id"), params.get("samples"), embedding_cache=embedding_cache, **shared)},
+        "generate": lambda params: api.generate_email(
+            params.get("user_id"), params.get("subject"), params.get("prompt"),
+            embedding_cache=embedding_cache, top_k=params.get("top_k"), mmr_lambda=params.get("lambda"), style_tokens=params.get("style_tokens"), **shared,
+        ),
+        "nudge_email": lambda params: api.generate_nudge_email(params.get("user_id"), params.get("prompt"), params.get("nudges"), **shared),
+        "nudge_summary": lambda params: api.generate_nudge_summary(params.get("user_id"), params.get("prompt"), params.get("nudges"), **shared),
+    }